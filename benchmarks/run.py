@@ -0,0 +1,184 @@
+# benchmarks/run.py
+
+"""
+K-Cube 性能基准套件。
+
+在确定性的合成保险库上依次计时 add、commit、get_status、log、restore
+以及与本地服务器之间的 Synchronizer.sync (推送与拉取)，结果以 JSON 输出，
+便于在不同提交之间对比。
+
+用法:
+    python -m benchmarks.run --files 2000 --output before.json
+    python -m benchmarks.run --files 2000 --output after.json --compare before.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from k_cube.repository import Repository
+from k_cube.utils import get_console
+
+from .vault_generator import VaultSpec, generate_vault, apply_churn
+
+
+class Timer:
+    """收集各个场景的耗时 (秒)。"""
+
+    def __init__(self):
+        self.results: Dict[str, dict] = {}
+
+    def measure(self, name: str, func: Callable, **extra):
+        # 基准只关心耗时：屏蔽 Repository/Synchronizer 打印的进度信息
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            value = func()
+            elapsed = time.perf_counter() - start
+        self.results[name] = {"seconds": round(elapsed, 4), **extra}
+        return value
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True,
+                              text=True, cwd=Path(__file__).parent).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def _tree_size(files, root: Path) -> int:
+    return sum((root / f).stat().st_size for f in files)
+
+
+def run_local_scenarios(workdir: Path, spec: VaultSpec, timer: Timer) -> Repository:
+    """本地仓库操作的基准场景。"""
+    vault = workdir / "vault"
+    vault.mkdir()
+    repo = Repository.initialize(vault)
+
+    files = generate_vault(vault, spec)
+    total_bytes = _tree_size(files, vault)
+    timer.measure("status_initial", repo.get_status,
+                  files=len(files), bytes=total_bytes)
+    timer.measure("add_initial", lambda: repo.add([vault]),
+                  files=len(files), bytes=total_bytes)
+    timer.measure("commit_initial", lambda: repo.commit(
+        {"type": "Bench", "summary": "initial"}))
+    timer.measure("status_clean", repo.get_status, files=len(files))
+    first_version = repo.db.get_latest_version_hash()
+
+    changed = apply_churn(vault, files, spec)
+    timer.measure("status_after_churn", repo.get_status, changed=len(changed))
+    timer.measure("add_after_churn", lambda: repo.add([vault]), changed=len(changed))
+    # 让第二个版本的时间戳严格更晚，保证 HEAD 的判定稳定
+    time.sleep(1.0)
+    timer.measure("commit_after_churn", lambda: repo.commit(
+        {"type": "Bench", "summary": "churn"}))
+
+    timer.measure("log", repo.get_history)
+    timer.measure("restore_previous", lambda: repo.restore(
+        first_version, hard_mode=True), files=len(files))
+    timer.measure("restore_latest", lambda: repo.restore(
+        repo.db.get_latest_version_hash(), hard_mode=True), files=len(files))
+    return repo
+
+
+def run_sync_scenarios(workdir: Path, repo: Repository, timer: Timer, latency: float = 0.0) -> None:
+    """与本地服务器实例之间的同步场景 (推送、克隆式拉取、无变更同步)。"""
+    from k_cube.sync import Synchronizer
+    from .server import LocalServer
+
+    with LocalServer(latency=latency) as server:
+        client = server.client()
+        vault_id = client.create_vault("bench")['id']
+        repo.config.set("vault_id", vault_id)
+        repo.vault_id = vault_id
+
+        timer.measure("sync_push", Synchronizer(repo, client).sync)
+        timer.measure("sync_noop", Synchronizer(repo, client).sync)
+
+        clone_path = workdir / "clone"
+        clone = Repository.initialize(clone_path)
+        clone.config.set("vault_id", vault_id)
+        clone.vault_id = vault_id
+        timer.measure("sync_pull", Synchronizer(clone, server.client()).sync)
+        timer.measure("checkout_after_pull", lambda: clone.restore(
+            clone.db.get_latest_version_hash()))
+        clone.db.close()
+
+
+def compare(current: dict, baseline: dict) -> None:
+    """打印当前结果相对于基线结果的耗时变化。"""
+    print(f"{'scenario':<24}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, result in current["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        old, new = before["seconds"], result["seconds"]
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        print(f"{name:<24}{old:>12.4f}{new:>12.4f}{change:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="K-Cube 性能基准")
+    parser.add_argument("--files", type=int, default=VaultSpec.file_count)
+    parser.add_argument("--size-median", type=int, default=VaultSpec.size_median)
+    parser.add_argument("--size-sigma", type=float, default=VaultSpec.size_sigma)
+    parser.add_argument("--size-max", type=int, default=VaultSpec.size_max)
+    parser.add_argument("--depth", type=int, default=VaultSpec.depth)
+    parser.add_argument("--churn", type=float, default=VaultSpec.churn)
+    parser.add_argument("--binary-ratio", type=float, default=VaultSpec.binary_ratio)
+    parser.add_argument("--seed", type=int, default=VaultSpec.seed)
+    parser.add_argument("--no-sync", action="store_true", help="跳过需要服务器依赖的同步场景")
+    parser.add_argument("--latency-ms", type=float, default=0.0,
+                        help="为每个服务器请求增加的延迟，模拟高延迟网络")
+    parser.add_argument("--output", help="把 JSON 结果写入文件而不是标准输出")
+    parser.add_argument("--compare", help="与之前保存的 JSON 结果对比")
+    options = parser.parse_args()
+
+    spec = VaultSpec(file_count=options.files, size_median=options.size_median,
+                     size_sigma=options.size_sigma, size_max=options.size_max,
+                     depth=options.depth, churn=options.churn,
+                     binary_ratio=options.binary_ratio, seed=options.seed)
+
+    get_console().quiet = True
+    timer = Timer()
+    workdir = Path(tempfile.mkdtemp(prefix="kcube-bench-"))
+    try:
+        repo = run_local_scenarios(workdir, spec, timer)
+        if not options.no_sync:
+            run_sync_scenarios(workdir, repo, timer, options.latency_ms / 1000)
+        repo.db.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "spec": spec.to_dict(),
+        "latency_ms": options.latency_ms,
+        "scenarios": timer.results,
+    }
+    output = json.dumps(report, indent=2)
+    if options.output:
+        Path(options.output).write_text(output, encoding='utf-8')
+    else:
+        print(output)
+
+    if options.compare:
+        baseline = json.loads(Path(options.compare).read_text(encoding='utf-8'))
+        compare(report, baseline)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
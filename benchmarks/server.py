@@ -0,0 +1,97 @@
+# benchmarks/server.py
+
+"""
+在当前进程中启动一个临时的 k-cube-server 实例，供同步基准使用。
+
+服务器使用临时目录中的 SQLite 数据库，监听本机的随机端口，
+并预先创建一个测试用户。需要安装 k-cube-server 的依赖 (Flask 等)。
+"""
+
+import logging
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+SERVER_DIR = Path(__file__).resolve().parent.parent / "k-cube-server"
+
+BENCH_EMAIL = "bench@example.com"
+BENCH_PASSWORD = "bench-password"
+
+
+class LocalServer:
+    """
+    上下文管理器：进入时启动服务器，退出时关闭并清理数据库。
+
+    Attributes:
+        url (str): 服务器根地址，例如 http://127.0.0.1:54321。
+        token (str): 测试用户的 API token。
+        app (Flask): 服务器应用，测试可以在它的 app_context 中直接读写数据库。
+    """
+
+    def __init__(self, latency: float = 0.0):
+        """
+        Args:
+            latency (float): 每个请求额外增加的延迟 (秒)，用于模拟高延迟网络。
+        """
+        self.latency = latency
+        self.url = None
+        self.token = None
+        self.app = None
+        self._tmp = None
+        self._server = None
+        self._thread = None
+
+    def __enter__(self) -> 'LocalServer':
+        if str(SERVER_DIR) not in sys.path:
+            sys.path.insert(0, str(SERVER_DIR))
+        from werkzeug.serving import make_server
+        from config import Config
+        from app import create_app, db
+        from app.models import User
+
+        self._tmp = tempfile.TemporaryDirectory()
+
+        class BenchConfig(Config):
+            SQLALCHEMY_DATABASE_URI = 'sqlite:///' + \
+                str(Path(self._tmp.name) / "bench.db")
+            SNAPSHOT_CACHE_DIR = str(Path(self._tmp.name) / "snapshots")
+
+        app = self.app = create_app(BenchConfig)
+        with app.app_context():
+            db.create_all()
+            user = User(email=BENCH_EMAIL)
+            user.set_password(BENCH_PASSWORD)
+            db.session.add(user)
+            db.session.commit()
+
+        if self.latency:
+            inner = app.wsgi_app
+
+            def delayed(environ, start_response):
+                time.sleep(self.latency)
+                return inner(environ, start_response)
+            app.wsgi_app = delayed
+
+        # 基准输出只保留 JSON 结果，关闭 werkzeug 的逐请求日志
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        self._server = make_server("127.0.0.1", 0, app, threaded=True)
+        self.url = f"http://127.0.0.1:{self._server.server_port}"
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+        from k_cube.client import APIClient
+        self.token = APIClient(self.url).login(BENCH_EMAIL, BENCH_PASSWORD)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._server.shutdown()
+        self._thread.join()
+        self._tmp.cleanup()
+
+    def client(self):
+        """返回一个已认证的 APIClient。"""
+        from k_cube.client import APIClient
+        return APIClient(self.url, self.token)
@@ -0,0 +1,112 @@
+# benchmarks/startup.py
+
+"""
+`kv` 入口的启动耗时基准。
+
+使用 `python -X importtime` 在子进程中运行指定的 kv 命令，统计导入耗时，
+并检查本地命令是否意外加载了网络相关的模块。
+
+用法:
+    python -m benchmarks.startup              # 打印可读报告
+    python -m benchmarks.startup --json       # 输出 JSON，便于跨提交对比
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+# 默认预算 (毫秒)：总导入耗时超过它即视为回归。可用环境变量覆盖以适配慢机器。
+STARTUP_BUDGET_MS = float(os.environ.get("KV_STARTUP_BUDGET_MS", 400))
+
+# 本地命令绝不应该导入的模块
+NETWORK_MODULES = ("requests", "urllib3", "k_cube.client", "k_cube.sync")
+
+SCENARIOS = {
+    "help": ["--help"],
+    "status": ["status"],
+}
+
+_RUNNER = "import sys; sys.argv = ['kv'] + sys.argv[1:]; from k_cube.cli import main; main()"
+
+
+def parse_importtime(stderr: str) -> Dict[str, int]:
+    """
+    解析 `-X importtime` 的输出。
+
+    Returns:
+        Dict[str, int]: 模块名 -> 自身导入耗时 (微秒)。
+    """
+    modules: Dict[str, int] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3:
+            continue
+        modules[fields[2].strip()] = int(fields[0])
+    return modules
+
+
+def measure(args: List[str], cwd: Path, repeat: int = 5) -> dict:
+    """在子进程中运行一次 kv 命令并收集导入耗时与墙钟时间。"""
+    wall_times = []
+    modules: Dict[str, int] = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", _RUNNER, *args],
+            cwd=cwd, capture_output=True, text=True, encoding='utf-8')
+        wall_times.append((time.perf_counter() - start) * 1000)
+        modules = parse_importtime(proc.stderr)
+
+    import_ms = sum(modules.values()) / 1000
+    slowest = sorted(modules.items(), key=lambda kv: kv[1], reverse=True)[:10]
+    return {
+        "args": args,
+        "wall_ms_median": round(statistics.median(wall_times), 2),
+        "import_ms": round(import_ms, 2),
+        "module_count": len(modules),
+        "network_modules": [m for m in NETWORK_MODULES if m in modules],
+        "rich_loaded": "rich" in modules,
+        "slowest_imports": [{"module": m, "self_us": us} for m, us in slowest],
+    }
+
+
+def run_all(repeat: int = 5) -> Dict[str, dict]:
+    """在一个临时的空保险库中运行所有启动场景。"""
+    from k_cube.repository import Repository
+
+    with tempfile.TemporaryDirectory() as tmp:
+        vault = Path(tmp)
+        Repository.initialize(vault).db.close()
+        return {name: measure(args, vault, repeat) for name, args in SCENARIOS.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="kv 启动耗时基准")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="以 JSON 格式输出结果")
+    options = parser.parse_args()
+
+    results = run_all(options.repeat)
+    if options.json:
+        print(json.dumps({"budget_ms": STARTUP_BUDGET_MS, "scenarios": results}, indent=2))
+        return
+
+    for name, result in results.items():
+        verdict = "OK" if result["import_ms"] <= STARTUP_BUDGET_MS else "OVER BUDGET"
+        print(f"kv {' '.join(result['args'])}: import {result['import_ms']} ms, "
+              f"wall {result['wall_ms_median']} ms [{verdict}]")
+        if result["network_modules"]:
+            print(f"  !! 加载了网络模块: {', '.join(result['network_modules'])}")
+
+
+if __name__ == "__main__":
+    main()
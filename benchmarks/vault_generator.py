@@ -0,0 +1,107 @@
+# benchmarks/vault_generator.py
+
+"""
+确定性的合成保险库生成器。
+
+同一个 `VaultSpec` (包括 seed) 总是生成完全相同的目录结构和文件内容，
+因此不同提交之间的基准结果可以直接对比。
+"""
+
+import math
+import random
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import List
+
+_WORDS = (
+    "knowledge note vault idea draft link graph sync version history "
+    "markdown summary concept detail question answer source reference "
+    "review outline project task journal meeting insight thought"
+).split()
+
+
+@dataclass
+class VaultSpec:
+    """合成保险库的参数。"""
+    file_count: int = 500
+    # 文件大小服从对数正态分布：中位数、离散程度 (sigma) 和上限 (字节)
+    size_median: int = 2048
+    size_sigma: float = 1.0
+    size_max: int = 1024 * 1024
+    # 目录嵌套的最大深度，以及每层的子目录数
+    depth: int = 3
+    fanout: int = 4
+    # 每一轮编辑中被修改的文件比例
+    churn: float = 0.05
+    # 二进制 (不可压缩) 文件的比例，模拟图片、PDF 等附件
+    binary_ratio: float = 0.1
+    seed: int = 42
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _file_size(rng: random.Random, spec: VaultSpec) -> int:
+    size = int(rng.lognormvariate(math.log(spec.size_median), spec.size_sigma))
+    return max(1, min(size, spec.size_max))
+
+
+def _text_content(rng: random.Random, size: int) -> bytes:
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(_WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words).encode('utf-8')[:size]
+
+
+def _directory(rng: random.Random, spec: VaultSpec) -> Path:
+    depth = rng.randint(0, spec.depth)
+    parts = [f"dir{rng.randrange(spec.fanout)}" for _ in range(depth)]
+    return Path(*parts) if parts else Path()
+
+
+def _content(rng: random.Random, spec: VaultSpec, is_binary: bool) -> bytes:
+    size = _file_size(rng, spec)
+    return rng.randbytes(size) if is_binary else _text_content(rng, size)
+
+
+def generate_vault(root: Path, spec: VaultSpec) -> List[Path]:
+    """
+    在 `root` 下生成合成保险库的工作区文件。
+
+    Returns:
+        List[Path]: 生成的文件的相对路径列表 (按生成顺序)。
+    """
+    rng = random.Random(spec.seed)
+    files = []
+    for index in range(spec.file_count):
+        is_binary = rng.random() < spec.binary_ratio
+        suffix = ".bin" if is_binary else ".md"
+        relative = _directory(rng, spec) / f"file{index:06d}{suffix}"
+        target = root / relative
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(_content(rng, spec, is_binary))
+        files.append(relative)
+    return files
+
+
+def apply_churn(root: Path, files: List[Path], spec: VaultSpec, round_index: int = 1) -> List[Path]:
+    """
+    按 `spec.churn` 的比例确定性地修改一部分文件 (文本追加、二进制重写)。
+
+    Returns:
+        List[Path]: 被修改的文件的相对路径列表。
+    """
+    rng = random.Random(spec.seed * 1000 + round_index)
+    count = max(1, int(len(files) * spec.churn)) if files else 0
+    changed = rng.sample(files, count)
+    for relative in changed:
+        target = root / relative
+        if relative.suffix == ".bin":
+            target.write_bytes(_content(rng, spec, is_binary=True))
+        else:
+            with open(target, 'ab') as f:
+                f.write(b"\n" + _text_content(rng, rng.randint(16, 256)))
+    return changed
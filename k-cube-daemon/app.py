@@ -8,10 +8,13 @@ from PyQt6.QtGui import QGuiApplication
 from ui.main_window import MainWindow
 from tray_icon import TrayIcon
 from core.worker import Worker
+from core.notifier import NotifierThread
 from config_manager import config, ConfigManager
 from k_cube.repository import Repository
 from k_cube.client import APIClient, APIError
+from k_cube.local_remote import is_local_remote, open_remote
 from k_cube.sync import SyncResult, Synchronizer
+from k_cube.profiling import render_span_tree
 from ui.components.toast import Toast
 from ui.components.custom_dialogs import CustomMessageBox, PasswordConfirmDialog
 import time
@@ -58,6 +61,9 @@ class KCubeApplication(QApplication):
 
         self.client = None
         self.worker_pool = {}
+        self.notifier = None
+        # 事件流报告的各保险库最新变更序号，供稍后启动的 Worker 补上
+        self.remote_seqs = {}
         self.active_toast = None
         self.last_auth_time = 0
         self.auth_cache_duration = 300  # 5分钟 (秒)
@@ -87,7 +93,9 @@ class KCubeApplication(QApplication):
         self.check_initial_state()
 
     def check_initial_state(self):
-        if config.get("api_token") and config.get("remote_url"):
+        remote_url = config.get("remote_url")
+        # file:// 远程是本机目录，不需要登录
+        if remote_url and (config.get("api_token") or is_local_remote(remote_url)):
             self.set_logged_in_state()
             self.main_window.show()
         else:
@@ -112,8 +120,9 @@ class KCubeApplication(QApplication):
             self.active_toast = None
 
     def set_logged_in_state(self):
-        self.client = APIClient(config.get(
+        self.client = open_remote(config.get(
             "remote_url"), config.get("api_token"))
+        self.start_notifier()
         self.main_window.set_view_for_login_state(
             True, config.get("user_email"))
         if config.get("vault_paths"):
@@ -122,6 +131,8 @@ class KCubeApplication(QApplication):
             self.fetch_remote_vaults_and_decide_page()
 
     def set_logged_out_state(self):
+        self.stop_notifier()
+        self.remote_seqs.clear()
         self.stop_all_workers()
         self.client = None
         self.main_window.set_view_for_login_state(False)
@@ -229,10 +240,13 @@ class KCubeApplication(QApplication):
             repo.config.set("remote_url", config.get("remote_url"))
             repo.vault_id = vault_id
 
+            # 服务器支持快照时只下载并检出最新版本，其余历史交给工作线程的首次同步，
+            # 避免在界面线程中等待完整历史下载完成
             synchronizer = Synchronizer(repo, self.client)
-            synchronizer.sync()
-
-            latest_hash = repo.db.get_latest_version_hash()
+            latest_hash = synchronizer.fetch_snapshot()
+            if latest_hash is None:
+                synchronizer.sync()
+                latest_hash = repo.db.get_latest_version_hash()
             if latest_hash:
                 repo.restore(latest_hash)
 
@@ -364,6 +378,7 @@ class KCubeApplication(QApplication):
         worker.moveToThread(thread)
         worker.validation_finished.connect(
             self.main_window.update_vault_status)
+        worker.validation_finished.connect(self.on_worker_validated)
         worker.sync_started.connect(self.on_sync_started)
         worker.sync_finished.connect(self.on_sync_finished)
         worker.sync_error.connect(self.on_sync_error)
@@ -373,11 +388,43 @@ class KCubeApplication(QApplication):
         thread.start()
         self.worker_pool[vault_path] = {'worker': worker, 'thread': thread}
 
-    def on_sync_started(self, vault_path: str, direction: str):
-        self.main_window.update_vault_status(vault_path, direction, "")
+    def start_notifier(self):
+        """订阅服务器的变更事件，其他设备的修改会主动触发对应保险库的拉取。"""
+        self.stop_notifier()
+        if is_local_remote(config.get("remote_url")):
+            return  # 本机目录没有事件流，同步由本地变更和手动操作触发
+        self.notifier = NotifierThread(config.get("remote_url"), config.get("api_token"))
+        self.notifier.vault_changed.connect(self.on_remote_vault_changed)
+        self.notifier.start()
+
+    def stop_notifier(self):
+        if self.notifier and self.notifier.isRunning():
+            self.notifier.stop()
+            self.notifier.wait()
+        self.notifier = None
+
+    @pyqtSlot(str, int)
+    def on_remote_vault_changed(self, vault_id: str, seq: int):
+        self.remote_seqs[vault_id] = seq
+        for worker_data in self.worker_pool.values():
+            worker = worker_data['worker']
+            if worker.vault_id == vault_id:
+                worker._remote_change_request.emit(seq)
+
+    def on_worker_validated(self, vault_path: str, success: bool, message: str):
+        """Worker 验证完成之前收到的事件 (例如连接时的 snapshot) 在这里补发。"""
+        worker_data = self.worker_pool.get(vault_path)
+        if success and worker_data:
+            worker = worker_data['worker']
+            if worker.vault_id in self.remote_seqs:
+                worker._remote_change_request.emit(self.remote_seqs[worker.vault_id])
+
+    def on_sync_started(self, vault_path: str, direction: str, summary: str):
+        self.main_window.update_vault_status(vault_path, direction, summary)
         message_map = {"upload": "正在上传...",
                        "download": "正在下载...", "bidirectional": "正在双向同步..."}
-        self.show_toast(message_map.get(direction, "正在同步..."), direction)
+        message = message_map.get(direction, "正在同步...")
+        self.show_toast(f"{message} {summary}" if summary else message, direction)
 
     def on_sync_finished(self, vault_path: str, result: SyncResult):
         message = "已是最新"
@@ -390,6 +437,11 @@ class KCubeApplication(QApplication):
             message = " & ".join(msg_parts)
         self.main_window.update_vault_status(vault_path, "success", message)
         self.show_toast(message, "success")
+        if result.profile:
+            # 把本次同步各阶段的耗时写入日志，托盘提示中显示总耗时
+            print(render_span_tree(result.profile, min_seconds=0.001))
+            self.tray_icon.set_status(
+                "success", f"{Path(vault_path).name}: {message} ({result.profile['seconds']:.1f}s)")
 
     def on_sync_error(self, vault_path: str, error_message: str):
         self.main_window.update_vault_status(
@@ -441,6 +493,7 @@ class KCubeApplication(QApplication):
 
     def quit_app(self):
         print("正在退出 K-Cube 守护进程...")
+        self.stop_notifier()
         self.stop_all_workers()
         print("所有线程已停止，安全退出。")
         self.quit()
@@ -0,0 +1,62 @@
+# k-cube-daemon/core/notifier.py
+import random
+import time
+from PyQt6.QtCore import QThread, pyqtSignal
+
+from k_cube.client import APIClient, AuthenticationError
+
+
+class NotifierThread(QThread):
+    """
+    订阅服务器的变更事件流，远程有新版本时通知对应保险库的 Worker 拉取。
+
+    一个连接复用当前用户的所有保险库；连接断开后按指数退避重连，
+    每次重连收到的 snapshot 事件会补上断线期间错过的变更。
+    服务器不支持事件流时线程直接退出，同步仍由本地变更和手动操作触发。
+    """
+    # vault_id, 服务器上的最新变更序号
+    vault_changed = pyqtSignal(str, int)
+
+    MAX_BACKOFF = 60.0
+
+    def __init__(self, remote_url: str, api_token: str):
+        super().__init__()
+        # 使用独立的连接，避免长连接占用 Worker 共享的连接池
+        self.client = APIClient(remote_url, api_token, max_retries=0)
+        self._is_running = False
+
+    def run(self):
+        self._is_running = True
+        failures = 0
+        while self._is_running:
+            try:
+                if not self.client.supports("change-events"):
+                    print("服务器不支持变更事件推送，仅依赖本地变更触发同步。")
+                    return
+                for event, data in self.client.stream_events():
+                    if not self._is_running:
+                        return
+                    failures = 0
+                    if event == "snapshot":
+                        for vault_id, seq in data.get("vaults", {}).items():
+                            self.vault_changed.emit(vault_id, seq)
+                    elif event == "change":
+                        self.vault_changed.emit(data["vault_id"], data["seq"])
+            except AuthenticationError:
+                return
+            except Exception as e:
+                if not self._is_running:
+                    return
+                failures += 1
+                print(f"变更事件流断开 ({e})，稍后重连。")
+            # 正常结束 (服务器定期关闭连接) 时立即重连，失败时退避
+            if failures:
+                delay = random.uniform(0, min(self.MAX_BACKOFF, 2 ** failures))
+                deadline = time.monotonic() + delay
+                while self._is_running and time.monotonic() < deadline:
+                    time.sleep(0.2)
+
+    def stop(self):
+        self._is_running = False
+        # 关闭连接，使阻塞在读取上的事件流立即返回
+        self.client.session.close()
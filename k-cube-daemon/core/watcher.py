@@ -1,19 +1,46 @@
 # k-cube-daemon/core/watcher.py
+from pathlib import Path
 from PyQt6.QtCore import QObject, pyqtSignal, QThread
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
+from watchdog.events import FileSystemEventHandler, EVENT_TYPE_MODIFIED
 import time
 
+from k_cube.fsmonitor import DirtyJournal
+from k_cube.utils import KCUBE_DIR
+
 
 class _ChangeHandler(FileSystemEventHandler):
-    def __init__(self, changed_signal: pyqtSignal):
+    def __init__(self, changed_signal: pyqtSignal, vault_path: Path, journal: DirtyJournal):
         super().__init__()
         self.changed_signal = changed_signal
+        self.vault_path = vault_path
+        self.journal = journal
+
+    def _record(self, path: str, is_directory: bool) -> bool:
+        """把事件路径记录到脏路径日志中。返回该路径是否属于工作区。"""
+        try:
+            relative = Path(path).relative_to(self.vault_path)
+        except ValueError:
+            return False
+        if KCUBE_DIR in relative.parts:
+            return False
+        self.journal.record(relative.as_posix(), is_dir=is_directory)
+        return True
 
     def on_any_event(self, event):
-        if ".kcube" in event.src_path or event.is_directory:
+        # 目录的 modified 事件只是其子项变化的副产物，子项本身会有独立事件
+        if event.is_directory and event.event_type == EVENT_TYPE_MODIFIED:
             return
-        self.changed_signal.emit()
+        paths = [event.src_path]
+        dest_path = getattr(event, 'dest_path', None)
+        if dest_path:
+            paths.append(dest_path)
+
+        relevant = False
+        for path in paths:
+            relevant = self._record(path, event.is_directory) or relevant
+        if relevant and not event.is_directory:
+            self.changed_signal.emit()
 
 
 class WatcherThread(QThread):
@@ -22,21 +49,29 @@ class WatcherThread(QThread):
     def __init__(self, path_to_watch: str):
         super().__init__()
         self.path = path_to_watch
+        self.journal = DirtyJournal(Path(path_to_watch) / KCUBE_DIR)
         self._is_running = False
 
     def run(self):
         self._is_running = True
+        vault_path = Path(self.path).resolve()
         # 在线程内部创建 Observer
         observer = Observer()
-        event_handler = _ChangeHandler(self.file_changed)
-        observer.schedule(event_handler, self.path, recursive=True)
+        event_handler = _ChangeHandler(
+            self.file_changed, vault_path, self.journal)
+        observer.schedule(event_handler, str(vault_path), recursive=True)
         observer.start()
+        # Observer 就绪后才开启新的日志会话：停止期间发生的变更无从得知，
+        # 新会话会让 `kv status` 先做一次全量扫描
+        self.journal.start()
 
         while self._is_running:
             time.sleep(0.5)
+            self.journal.heartbeat()
 
         observer.stop()
         observer.join()
+        self.journal.stop()
 
     def stop(self):
         self._is_running = False
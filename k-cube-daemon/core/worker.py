@@ -1,18 +1,21 @@
 # k-cube-daemon/core/worker.py
 # (替换完整内容)
+import time
 from pathlib import Path
 from PyQt6.QtCore import QObject, pyqtSignal, QTimer, pyqtSlot
 
 from k_cube.repository import Repository
 from k_cube.client import APIClient
 from k_cube.sync import Synchronizer, SyncResult
+from k_cube.sync_log import SyncLog
+from k_cube.profiling import profiler
 from .watcher import WatcherThread
 
 
 class Worker(QObject):
     # --- 升级后的信号 ---
-    # vault_path, direction ('upload'/'download'/'bidirectional')
-    sync_started = pyqtSignal(str, str)
+    # vault_path, direction ('upload'/'download'/'bidirectional'), 计划概要
+    sync_started = pyqtSignal(str, str, str)
     sync_finished = pyqtSignal(str, SyncResult)  # vault_path, result_object
     sync_error = pyqtSignal(str, str)       # vault_path, error_message
     # vault_path, success, message
@@ -21,6 +24,8 @@ class Worker(QObject):
 
     # --- 新增信号，用于线程安全的任务触发 ---
     _manual_sync_request = pyqtSignal()
+    # 服务器推送的远程变更 (最新变更序号)
+    _remote_change_request = pyqtSignal(int)
 
     def __init__(self, vault_path: str, client: APIClient):
         super().__init__()
@@ -33,8 +38,11 @@ class Worker(QObject):
         self.debounce_timer.setInterval(2000)
         self._is_running = False
 
+        self.vault_id = None
+
         # --- 核心修复：连接内部信号到槽 ---
         self._manual_sync_request.connect(self.perform_sync)
+        self._remote_change_request.connect(self.on_remote_change)
 
     def run(self):
         self._is_running = True
@@ -43,6 +51,7 @@ class Worker(QObject):
             if not repo or not repo.vault_id:
                 raise ValueError("本地保险库无效或未关联。")
             self.client.get_vault_details(repo.vault_id)
+            self.vault_id = repo.vault_id
             self.validation_finished.emit(
                 self.vault_path_str, True, "验证成功，正在监控")
         except Exception as e:
@@ -68,48 +77,58 @@ class Worker(QObject):
             return
         self.debounce_timer.start()
 
+    @pyqtSlot(int)
+    def on_remote_change(self, seq: int):
+        """服务器上的变更序号超过本地游标时才同步；本机刚上传的版本不会引起重复同步。"""
+        if not self._is_running:
+            return
+        cursor = Repository.find(self.vault_path).config.get("sync_cursor") or {}
+        if cursor.get("vault_id") == self.vault_id and cursor.get("remote_seq", -1) >= seq:
+            return
+        self.perform_sync()
+
     @pyqtSlot()
     def perform_sync(self):
         if not self._is_running:
             return
         try:
-            repo = Repository.find(self.vault_path)
-            status = repo.get_status()
-            if status.has_unstaged_changes() or status.has_tracked_unstaged_changes() or status.untracked_files:
-                repo.add([self.vault_path])
-                repo.commit({"type": "Auto", "summary": "Auto-sync changes"})
-
-            synchronizer = Synchronizer(repo, self.client)
-            local_versions = repo.db.get_all_version_hashes()
-            sync_state = self.client.check_sync_state(
-                repo.vault_id, local_versions)
-            versions_to_upload = sync_state.get('versions_to_upload', [])
-            versions_to_download = sync_state.get('versions_to_download', [])
-
-            direction = "none"
-            if versions_to_upload and versions_to_download:
-                direction = "bidirectional"
-            elif versions_to_upload:
-                direction = "upload"
-            elif versions_to_download:
-                direction = "download"
-
-            # 只有在有事可做时才发射信号和同步
-            if direction != "none":
-                self.sync_started.emit(self.vault_path_str, direction)
-
-            result = synchronizer.sync()  # sync 内部不再检查，直接执行
-
-            self.sync_started.emit(self.vault_path_str, result.direction)
-
-            if result.direction in ["download", "bidirectional"]:
-                latest_hash = repo.db.get_latest_version_hash()
-                if latest_hash:
-                    # 暂停监控以避免循环
-                    self.watcher_thread.stop()
-                    repo.restore(latest_hash, hard_mode=True)
-                    self.watcher_thread.start()
-
+            # 整个同步周期 (扫描、提交、网络、检出) 记录为一棵 Span 树，随结果一起上报
+            with profiler.capture("daemon.sync") as root:
+                result = self._sync_cycle()
+            result.profile = root.to_dict()
             self.sync_finished.emit(self.vault_path_str, result)
         except Exception as e:
             self.sync_error.emit(self.vault_path_str, str(e))
+
+    def _sync_cycle(self) -> SyncResult:
+        repo = Repository.find(self.vault_path)
+        # 一次扫描：状态结果直接决定暂存哪些路径，不再对整个保险库重新哈希
+        status = repo.get_status()
+        repo.add_from_status(status)
+        if status.has_staged_changes() or status.has_unstaged_changes():
+            repo.commit({"type": "Auto", "summary": "Auto-sync changes"})
+
+        # 每个周期只与服务器协商一次，计划同时用于界面提示和执行
+        synchronizer = Synchronizer(repo, self.client)
+        # 检出也计入同步记录，由下面补上 restore 阶段后再写入
+        synchronizer.record_log = False
+        plan = synchronizer.plan()
+        if plan.has_changes:
+            self.sync_started.emit(self.vault_path_str, plan.direction, plan.describe())
+
+        result = synchronizer.execute(plan)
+
+        if result.direction in ["download", "bidirectional"]:
+            latest_hash = repo.db.get_latest_version_hash()
+            if latest_hash:
+                # 暂停监控以避免循环。必须等线程真正退出后再启动，
+                # 否则 start() 在线程仍在运行时不起作用，监控会就此停止
+                self.watcher_thread.stop()
+                self.watcher_thread.wait()
+                start = time.perf_counter()
+                repo.restore(latest_hash, hard_mode=True)
+                result.phase_seconds["restore"] = time.perf_counter() - start
+                self.watcher_thread.start()
+
+        SyncLog(repo.kcube_path).append(result.telemetry())
+        return result
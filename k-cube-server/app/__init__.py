@@ -18,12 +18,19 @@ def create_app(config_class=Config):
     db.init_app(app)
     migrate.init_app(app, db)
 
+    from app import compression
+    compression.init_app(app)
+
     from app.api.auth import auth_bp
     from app.api.sync import sync_bp
     from app.api.vault import vault_bp  # <--- 新增导入
+    from app.api.meta import meta_bp
+    from app.api.events import events_bp
 
     app.register_blueprint(auth_bp)
     app.register_blueprint(sync_bp)
     app.register_blueprint(vault_bp)  # <--- 新增注册
+    app.register_blueprint(meta_bp)
+    app.register_blueprint(events_bp)
 
     return app
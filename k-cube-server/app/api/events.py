@@ -0,0 +1,78 @@
+# k-cube-server/app/api/events.py
+
+import json
+import time
+
+from flask import Blueprint, Response, current_app, jsonify, stream_with_context
+
+from app import db
+from app.events import broker
+from app.models import Vault
+from .sync import get_user_from_token  # 复用认证函数
+
+events_bp = Blueprint('events', __name__, url_prefix='/api/v1')
+
+# 没有进程内通知时，重新查询变更序号的间隔 (秒)
+EVENT_POLL_INTERVAL = 2.0
+# 心跳间隔 (秒)：让客户端的读超时和中间代理都不会断开空闲连接
+HEARTBEAT_INTERVAL = 15.0
+# 单个连接的最长时间 (秒)，到期后由客户端重新连接，避免长期占用 worker。
+# 每个连接在整个期间占用一个 worker 线程，部署时需要使用线程 worker，且 worker 超时要长于该值
+# (参见 entrypoint.sh)
+MAX_STREAM_SECONDS = 600.0
+
+
+def _format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _vault_sequences(user_id):
+    rows = db.session.query(Vault.id, Vault.change_seq).filter(
+        Vault.user_id == user_id).all()
+    # 结束只读事务，下一次查询才能看到其他连接提交的写入
+    db.session.rollback()
+    return dict(rows)
+
+
+@events_bp.route('/events', methods=['GET'])
+def stream_events():
+    """
+    Server-Sent Events：一个连接推送当前用户所有保险库的变更。
+
+    - 连接建立时发送 `snapshot` 事件：{"vaults": {vault_id: seq}}，
+      客户端据此补上断线期间错过的变更；
+    - 之后每当某个保险库的变更序号增加，发送 `change` 事件：{"vault_id", "seq"}；
+    - 空闲时定期发送 `ping` 事件作为心跳。
+    """
+    user = get_user_from_token()
+    if not user:
+        return jsonify({'detail': '需要认证'}), 401
+    user_id = user.id
+    config = current_app.config
+    poll_interval = config.get('EVENT_POLL_INTERVAL', EVENT_POLL_INTERVAL)
+    heartbeat_interval = config.get('EVENT_HEARTBEAT_INTERVAL', HEARTBEAT_INTERVAL)
+    max_seconds = config.get('EVENT_MAX_STREAM_SECONDS', MAX_STREAM_SECONDS)
+
+    def generate():
+        started = last_sent = time.monotonic()
+        generation = broker.generation
+        known = _vault_sequences(user_id)
+        yield "retry: 5000\n" + _format_event('snapshot', {'vaults': known})
+
+        while time.monotonic() - started < max_seconds:
+            generation = broker.wait(generation, poll_interval)
+            current = _vault_sequences(user_id)
+            for vault_id, seq in current.items():
+                if seq > known.get(vault_id, 0):
+                    yield _format_event('change', {'vault_id': vault_id, 'seq': seq})
+                    last_sent = time.monotonic()
+            known = current
+            if time.monotonic() - last_sent >= heartbeat_interval:
+                yield _format_event('ping', {})
+                last_sent = time.monotonic()
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # 关闭 nginx 等反向代理的响应缓冲，事件才能立即到达客户端
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,30 @@
+# k-cube-server/app/api/meta.py
+
+from flask import Blueprint, jsonify
+
+from k_cube_protocol.compression import available_encodings
+from k_cube_protocol.pack import VERSION as PACK_VERSION
+
+meta_bp = Blueprint('meta', __name__, url_prefix='/api/v1')
+
+# 服务器支持的可选协议特性。客户端 (k_cube.sync) 逐项检查，只使用这里声明的特性，
+# 缺少某一项时回退到原有的做法 (例如没有 blob-negotiation 时上传全部对象，没有 pack 时使用 JSON)；
+# 没有该端点的旧服务器视为不支持任何特性。
+CAPABILITIES = [
+    "blob-negotiation",
+    "batch-query",
+    "sync-cursor",
+    "reconcile-v1",
+    "manifest-delta",
+    "idempotency-keys",
+    "change-events",
+    "shallow-history",
+    "snapshot-v1",
+    "blob-delta-v1",
+    f"pack-v{PACK_VERSION}",
+] + [f"content-encoding-{encoding}" for encoding in available_encodings()]
+
+
+@meta_bp.route('/capabilities', methods=['GET'])
+def get_capabilities():
+    return jsonify({'capabilities': CAPABILITIES})
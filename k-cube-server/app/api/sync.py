@@ -1,14 +1,24 @@
 # k-cube-server/app/api/sync.py
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, send_file, stream_with_context
 from app.models import Version, Blob, VersionFile, User, Vault
 from app import db
+from k_cube_protocol.pack import CONTENT_TYPE as PACK_CONTENT_TYPE, PackError, iter_pack, read_pack
+from app.compression import compress_response
+from k_cube_protocol.delta import DeltaError, apply_delta, make_delta
+from app.events import broker
+from app.idempotency import idempotent
+from k_cube_protocol.manifest import MissingBaseError, decode_versions, encode_versions
+from k_cube_protocol.reconcile import HEX_DIGITS, MAX_RANGES_PER_REQUEST, answer_ranges
+from app.snapshot import get_snapshot
 import base64
 import json
 
 # 关键修改：蓝图 URL 现在包含 vault_id
 sync_bp = Blueprint(
     'sync', __name__, url_prefix='/api/v1/vaults/<string:vault_id>/sync')
+# 版本清单等大块 JSON 响应按 Accept-Encoding 压缩
+sync_bp.after_request(compress_response)
 
 # 辅助函数：复用
 
@@ -33,6 +43,19 @@ def get_vault_for_user(vault_id, user):
     return Vault.query.filter_by(id=vault_id, user_id=user.id).first()
 
 
+def _ensure_sequenced(vault):
+    """为没有序号的旧版本按时间顺序补齐序号 (在引入变更序号之前上传的数据)。"""
+    unsequenced = Version.query.filter_by(vault_id=vault.id, seq=None).order_by(
+        Version.timestamp, Version.hash).all()
+    if not unsequenced:
+        return
+    vault = Vault.query.filter_by(id=vault.id).with_for_update().one()
+    for version in unsequenced:
+        vault.change_seq += 1
+        version.seq = vault.change_seq
+    db.session.commit()
+
+
 @sync_bp.route('/check', methods=['POST'])
 def check_sync_state(vault_id):
     user = get_user_from_token()
@@ -43,23 +66,119 @@ def check_sync_state(vault_id):
     if not vault:
         return jsonify({'error': '保险库未找到或无权访问'}), 404
 
+    _ensure_sequenced(vault)
     data = request.get_json() or {}
     local_hashes = set(data.get('local_version_hashes', []))
+    since_seq = data.get('since_seq')
 
-    server_hashes_query = db.session.query(
-        Version.hash).filter_by(vault_id=vault.id).all()
-    server_hashes = {h for h, in server_hashes_query}
+    if since_seq is not None:
+        # 增量模式：客户端只发送上次同步以来新建的本地版本，
+        # 服务器只返回游标之后写入的版本，两边都不需要加载完整的版本列表
+        if not isinstance(since_seq, int) or since_seq < 0 or since_seq > vault.change_seq:
+            # 游标来自另一个 (或已被重置的) 服务器数据库，要求客户端做一次完整对账
+            return jsonify({'full_reconcile_required': True, 'current_seq': vault.change_seq})
+        known = {h for h, in db.session.query(Version.hash).filter(
+            Version.vault_id == vault.id, Version.hash.in_(local_hashes)).all()} if local_hashes else set()
+        newer = db.session.query(Version.hash).filter(
+            Version.vault_id == vault.id, Version.seq > since_seq).order_by(Version.seq).all()
+        versions_to_upload = list(local_hashes - known)
+        versions_to_download = [h for h, in newer if h not in local_hashes]
+    else:
+        server_hashes_query = db.session.query(
+            Version.hash, Version.timestamp).filter_by(vault_id=vault.id).all()
+        server_hashes = {h for h, _ in server_hashes_query}
+        # 浅克隆的客户端只需要其历史边界 (含) 之后的版本
+        shallow_since = data.get('shallow_since')
+        wanted = {h for h, ts in server_hashes_query
+                  if not isinstance(shallow_since, int) or ts >= shallow_since}
 
-    versions_to_upload = list(local_hashes - server_hashes)
-    versions_to_download = list(server_hashes - local_hashes)
+        versions_to_upload = list(local_hashes - server_hashes)
+        versions_to_download = list(wanted - local_hashes)
 
     return jsonify({
         'versions_to_upload': versions_to_upload,
-        'versions_to_download': versions_to_download
+        'versions_to_download': versions_to_download,
+        'current_seq': vault.change_seq
     })
 
 
+@sync_bp.route('/history', methods=['GET'])
+def version_window(vault_id):
+    """
+    按时间倒序列出一段历史窗口内的版本，供浅克隆 (--depth / --since) 和加深历史使用。
+
+    查询参数 (均可选):
+        depth: 最多返回的版本数。
+        since: 只返回时间戳不早于该值的版本。
+        before: 只返回时间戳早于该值的版本 (加深已有的浅克隆)。
+    """
+    user = get_user_from_token()
+    if not user:
+        return jsonify({'detail': '需要认证'}), 401
+    vault = get_vault_for_user(vault_id, user)
+    if not vault:
+        return jsonify({'error': '保险库未找到或无权访问'}), 404
+
+    depth, since, before = (request.args.get(name, type=int) for name in ('depth', 'since', 'before'))
+    if depth is not None and depth < 1:
+        return jsonify({'error': 'depth 必须大于 0'}), 400
+
+    query = db.session.query(Version.hash, Version.timestamp).filter(Version.vault_id == vault.id)
+    if since is not None:
+        query = query.filter(Version.timestamp >= since)
+    if before is not None:
+        query = query.filter(Version.timestamp < before)
+    query = query.order_by(Version.timestamp.desc(), Version.hash)
+    rows = query.limit(depth).all() if depth else query.all()
+
+    # 窗口之外是否还有更早的版本：没有时客户端拥有的就是完整历史
+    boundary = rows[-1][1] if rows else (before if before is not None else since)
+    older = db.session.query(Version.hash).filter(Version.vault_id == vault.id)
+    if boundary is not None:
+        older = older.filter(Version.timestamp < boundary)
+    has_more = boundary is not None and older.first() is not None
+
+    return jsonify({'versions': [{'hash': h, 'timestamp': ts} for h, ts in rows],
+                    'has_more': has_more,
+                    'current_seq': vault.change_seq})
+
+
+@sync_bp.route('/reconcile', methods=['POST'])
+def reconcile_versions(vault_id):
+    """
+    区间对账的一轮：客户端提交若干前缀区间的 (数量, 指纹)，服务器逐个回答
+    一致、列出区间内的哈希，或给出 16 个子区间的概括 (参见 k_cube_protocol/reconcile.py)。
+    """
+    user = get_user_from_token()
+    if not user:
+        return jsonify({'detail': '需要认证'}), 401
+    vault = get_vault_for_user(vault_id, user)
+    if not vault:
+        return jsonify({'error': '保险库未找到或无权访问'}), 404
+
+    _ensure_sequenced(vault)
+    data = request.get_json() or {}
+    ranges = data.get('ranges', [])
+    if len(ranges) > MAX_RANGES_PER_REQUEST:
+        return jsonify({'error': f'单次最多对账 {MAX_RANGES_PER_REQUEST} 个区间'}), 400
+
+    answers = []
+    for summary in ranges:
+        prefix = summary.get('prefix', '')
+        if len(prefix) > 64 or any(c not in HEX_DIGITS for c in prefix):
+            return jsonify({'error': f'无效的前缀: {prefix[:70]}'}), 400
+        # 只加载该前缀区间内的哈希，利用主键索引做范围查询
+        query = db.session.query(Version.hash).filter(Version.vault_id == vault.id)
+        if prefix:
+            query = query.filter(Version.hash >= prefix, Version.hash < prefix + 'g')
+        members = sorted(h for h, in query.all())
+        answers.extend(answer_ranges(members, [summary]))
+
+    return jsonify({'ranges': answers, 'current_seq': vault.change_seq})
+
+
 @sync_bp.route('/versions', methods=['POST'])
+@idempotent
 def upload_versions(vault_id):
     user = get_user_from_token()
     if not user:
@@ -70,15 +189,24 @@ def upload_versions(vault_id):
         return jsonify({'error': '保险库未找到或无权访问'}), 404
 
     data = request.get_json() or {}
-    versions_to_upload = data.get('versions', [])
+    # 增量编码的版本 (见 k_cube_protocol/manifest.py) 在这里还原为完整清单，存储格式不变
+    try:
+        versions_to_upload = decode_versions(
+            data.get('versions', []), lambda h: _load_manifest(vault, h))
+    except MissingBaseError as e:
+        return jsonify({'error': str(e), 'missing_bases': e.missing}), 409
 
+    # 锁定保险库行，保证并发写入时变更序号严格递增且不重复
+    vault = Vault.query.filter_by(id=vault.id).with_for_update().one()
     for v_data in versions_to_upload:
         if not Version.query.get(v_data['hash']):
+            vault.change_seq += 1
             new_version = Version(
                 hash=v_data['hash'],
                 timestamp=v_data['timestamp'],
                 message_json=json.dumps(v_data['message']),
-                vault_id=vault.id  # 关联到正确的保险库
+                vault_id=vault.id,  # 关联到正确的保险库
+                seq=vault.change_seq
             )
             for path, blob_hash in v_data['manifest'].items():
                 vf = VersionFile(file_path=path, blob_hash=blob_hash)
@@ -86,13 +214,25 @@ def upload_versions(vault_id):
             db.session.add(new_version)
 
     db.session.commit()
-    return jsonify({'status': '成功'}), 201
+    # 唤醒该用户的事件流，让其他设备尽快拉取
+    broker.publish()
+    return jsonify({'status': '成功', 'current_seq': vault.change_seq}), 201
+
+
+
+def _load_manifest(vault, version_hash):
+    """加载保险库中已有版本的清单；版本不存在时返回 None。"""
+    version = Version.query.filter_by(hash=version_hash, vault_id=vault.id).first()
+    if version is None:
+        return None
+    return {vf.file_path: vf.blob_hash for vf in version.files}
 
 # ... upload_blobs, download_blobs, download_versions 的逻辑基本不变 ...
 # ... 但为了完整性，我们提供完整文件 ...
 
 
 @sync_bp.route('/blobs', methods=['POST'])
+@idempotent
 def upload_blobs(vault_id):
     user = get_user_from_token()
     if not user:
@@ -113,6 +253,108 @@ def upload_blobs(vault_id):
     return jsonify({'status': '成功'}), 201
 
 
+# 单次增量请求最多携带的对象数：服务器需要逐个重建或计算增量，CPU 开销较大
+MAX_DELTAS_PER_REQUEST = 100
+
+
+@sync_bp.route('/blobs/deltas', methods=['POST'])
+@idempotent
+def upload_blob_deltas(vault_id):
+    """
+    以增量上传对象：用服务器已有的基准对象重建目标对象并校验哈希 (参见 k_cube_protocol/delta.py)。
+
+    无法重建的对象列在 rejected 中，客户端改为上传完整对象。
+    """
+    user = get_user_from_token()
+    if not user:
+        return jsonify({'detail': '需要认证'}), 401
+    vault = get_vault_for_user(vault_id, user)
+    if not vault:
+        return jsonify({'error': '保险库未找到或无权访问'}), 404
+
+    deltas = (request.get_json(silent=True) or {}).get('deltas', [])
+    if len(deltas) > MAX_DELTAS_PER_REQUEST:
+        return jsonify({'error': f'单次最多上传 {MAX_DELTAS_PER_REQUEST} 个增量'}), 400
+
+    stored, rejected = [], []
+    for item in deltas:
+        target_hash = item.get('hash')
+        if db.session.get(Blob, target_hash):
+            stored.append(target_hash)
+            continue
+        base = db.session.get(Blob, item.get('base'))
+        try:
+            if base is None:
+                raise DeltaError('基准对象不存在')
+            content = apply_delta(base.content, base64.b64decode(item['delta_b64']), target_hash)
+        except (DeltaError, KeyError, ValueError, TypeError):
+            rejected.append(target_hash)
+            continue
+        db.session.add(Blob(hash=target_hash, content=content))
+        stored.append(target_hash)
+    db.session.commit()
+    return jsonify({'stored': stored, 'rejected': rejected}), 201
+
+
+@sync_bp.route('/blobs/deltas/fetch', methods=['POST'])
+def download_blob_deltas(vault_id):
+    """
+    以增量下载对象。请求体为 {"pairs": {目标哈希: 客户端已有的基准哈希}}；
+    增量不划算或无法计算的对象不出现在结果中，客户端照常下载完整对象。
+    """
+    user = get_user_from_token()
+    if not user:
+        return jsonify({'detail': '需要认证'}), 401
+    vault = get_vault_for_user(vault_id, user)
+    if not vault:
+        return jsonify({'error': '保险库未找到或无权访问'}), 404
+
+    pairs = (request.get_json(silent=True) or {}).get('pairs', {})
+    if not isinstance(pairs, dict):
+        return jsonify({'error': 'pairs 必须是对象'}), 400
+    if len(pairs) > MAX_DELTAS_PER_REQUEST:
+        return jsonify({'error': f'单次最多请求 {MAX_DELTAS_PER_REQUEST} 个增量'}), 400
+
+    wanted = set(pairs) | set(pairs.values())
+    contents = {b.hash: b.content for b in Blob.query.filter(Blob.hash.in_(wanted)).all()} if wanted else {}
+    deltas = []
+    for target_hash, base_hash in pairs.items():
+        if target_hash not in contents or base_hash not in contents:
+            continue
+        delta = make_delta(contents[base_hash], contents[target_hash])
+        if delta is not None:
+            deltas.append({'hash': target_hash, 'base': base_hash,
+                           'delta_b64': base64.b64encode(delta).decode('ascii')})
+    return jsonify({'deltas': deltas})
+
+
+# 单次协商请求最多携带的候选哈希数，防止请求体过大
+MAX_NEGOTIATE_HASHES = 5000
+
+
+@sync_bp.route('/blobs/missing', methods=['POST'])
+def find_missing_blobs(vault_id):
+    """
+    have/want 协商：客户端提交一批候选 blob 哈希，服务器返回其中尚未存储的部分。
+    """
+    user = get_user_from_token()
+    if not user:
+        return jsonify({'detail': '需要认证'}), 401
+    vault = get_vault_for_user(vault_id, user)
+    if not vault:
+        return jsonify({'error': '保险库未找到或无权访问'}), 404
+
+    data = request.get_json() or {}
+    candidates = list(dict.fromkeys(data.get('hashes', [])))
+    if len(candidates) > MAX_NEGOTIATE_HASHES:
+        return jsonify({'error': f'单次最多协商 {MAX_NEGOTIATE_HASHES} 个哈希'}), 400
+
+    existing = {h for h, in db.session.query(
+        Blob.hash).filter(Blob.hash.in_(candidates)).all()} if candidates else set()
+    missing = [h for h in candidates if h not in existing]
+    return jsonify({'missing': missing})
+
+
 @sync_bp.route('/blobs', methods=['GET'])
 def download_blobs(vault_id):
     user = get_user_from_token()
@@ -125,10 +367,145 @@ def download_blobs(vault_id):
     blob_hashes = request.args.getlist('h')
     if not blob_hashes:
         return jsonify({'error': '没有提供 blob 哈希'}), 400
+    return jsonify({'blobs': _serialize_blobs(blob_hashes)})
+
+
+def _serialize_blobs(blob_hashes):
     blobs = Blob.query.filter(Blob.hash.in_(blob_hashes)).all()
-    response_blobs = [{'hash': b.hash, 'content_b64': base64.b64encode(
+    return [{'hash': b.hash, 'content_b64': base64.b64encode(
         b.content).decode('ascii')} for b in blobs]
-    return jsonify({'blobs': response_blobs})
+
+
+def _hashes_from_body():
+    """
+    读取 POST 请求体中的哈希列表 ({"hashes": [...]})，去重并检查数量上限。
+
+    Returns:
+        tuple: (哈希列表, None) 或 (None, 错误响应)。
+    """
+    data = request.get_json(silent=True) or {}
+    hashes = list(dict.fromkeys(data.get('hashes', [])))
+    if not hashes:
+        return None, (jsonify({'error': '没有提供哈希'}), 400)
+    if len(hashes) > MAX_NEGOTIATE_HASHES:
+        return None, (jsonify({'error': f'单次最多查询 {MAX_NEGOTIATE_HASHES} 个哈希'}), 400)
+    return hashes, None
+
+
+@sync_bp.route('/blobs/query', methods=['POST'])
+def query_blobs(vault_id):
+    """与 GET /blobs 相同，但哈希列表放在请求体中，不受 URL 长度限制。"""
+    user = get_user_from_token()
+    if not user:
+        return jsonify({'detail': '需要认证'}), 401
+    vault = get_vault_for_user(vault_id, user)
+    if not vault:
+        return jsonify({'error': '保险库未找到或无权访问'}), 404
+
+    blob_hashes, error = _hashes_from_body()
+    if error:
+        return error
+    return jsonify({'blobs': _serialize_blobs(blob_hashes)})
+
+
+@sync_bp.route('/blobs/sizes', methods=['POST'])
+def query_blob_sizes(vault_id):
+    """返回请求的 blob 在服务器上的存储大小 (字节)，客户端据此按字节数划分下载批次。"""
+    user = get_user_from_token()
+    if not user:
+        return jsonify({'detail': '需要认证'}), 401
+    vault = get_vault_for_user(vault_id, user)
+    if not vault:
+        return jsonify({'error': '保险库未找到或无权访问'}), 404
+
+    blob_hashes, error = _hashes_from_body()
+    if error:
+        return error
+    rows = db.session.query(Blob.hash, db.func.length(Blob.content)).filter(
+        Blob.hash.in_(blob_hashes)).all()
+    return jsonify({'sizes': {h: size for h, size in rows}})
+
+
+# 流式写入 pack 时，每累积这么多个 blob 就提交一次，避免会话中堆积过多对象
+PACK_COMMIT_EVERY = 200
+# 流式输出 pack 时，每次从数据库加载的 blob 数量
+PACK_QUERY_BATCH = 100
+
+
+@sync_bp.route('/pack', methods=['POST'])
+def upload_pack(vault_id):
+    """以二进制 pack 数据流上传 blob，逐帧校验哈希后写入。"""
+    user = get_user_from_token()
+    if not user:
+        return jsonify({'detail': '需要认证'}), 401
+    vault = get_vault_for_user(vault_id, user)
+    if not vault:
+        return jsonify({'error': '保险库未找到或无权访问'}), 404
+    if request.mimetype != PACK_CONTENT_TYPE:
+        return jsonify({'error': f'需要 {PACK_CONTENT_TYPE} 请求体'}), 415
+
+    received = stored = 0
+    try:
+        for blob_hash, content in read_pack(request.stream):
+            received += 1
+            if not db.session.get(Blob, blob_hash):
+                db.session.add(Blob(hash=blob_hash, content=content))
+                stored += 1
+            if received % PACK_COMMIT_EVERY == 0:
+                db.session.commit()
+    except PackError as e:
+        # 已经校验通过并提交的 blob 保留下来，客户端重试时会通过协商跳过它们
+        db.session.rollback()
+        return jsonify({'error': f'pack 数据无效: {e}'}), 400
+    db.session.commit()
+    return jsonify({'status': '成功', 'received': received, 'stored': stored}), 201
+
+
+@sync_bp.route('/pack/fetch', methods=['POST'])
+def download_pack(vault_id):
+    """按请求体中的哈希列表，以二进制 pack 数据流返回 blob。"""
+    user = get_user_from_token()
+    if not user:
+        return jsonify({'detail': '需要认证'}), 401
+    vault = get_vault_for_user(vault_id, user)
+    if not vault:
+        return jsonify({'error': '保险库未找到或无权访问'}), 404
+
+    blob_hashes, error = _hashes_from_body()
+    if error:
+        return error
+
+    def blobs():
+        for start in range(0, len(blob_hashes), PACK_QUERY_BATCH):
+            batch = blob_hashes[start:start + PACK_QUERY_BATCH]
+            for blob in Blob.query.filter(Blob.hash.in_(batch)).all():
+                yield blob.hash, blob.content
+
+    return Response(stream_with_context(iter_pack(blobs())),
+                    mimetype=PACK_CONTENT_TYPE)
+
+
+@sync_bp.route('/snapshot', methods=['GET'])
+def download_snapshot(vault_id):
+    """
+    以 pack 数据流返回最新版本的快照 (元数据帧 + 全部对象)，供新设备快速克隆。
+
+    快照在保险库发生变化之前一直缓存在磁盘上 (参见 app/snapshot.py)，
+    ETag 为保险库的变更序号。保险库为空时返回 204。
+    """
+    user = get_user_from_token()
+    if not user:
+        return jsonify({'detail': '需要认证'}), 401
+    vault = get_vault_for_user(vault_id, user)
+    if not vault:
+        return jsonify({'error': '保险库未找到或无权访问'}), 404
+
+    _ensure_sequenced(vault)
+    path = get_snapshot(vault)
+    if path is None:
+        return '', 204
+    return send_file(path, mimetype=PACK_CONTENT_TYPE, conditional=True,
+                     etag=f"{vault.id}-{vault.change_seq}")
 
 
 @sync_bp.route('/versions', methods=['GET'])
@@ -142,9 +519,39 @@ def download_versions(vault_id):
 
     version_hashes = request.args.getlist('h')
     versions = Version.query.filter(Version.hash.in_(version_hashes)).all()
+    return jsonify({'versions': _serialize_versions(
+        versions, delta=request.args.get('delta') == '1')})
+
+
+def _serialize_versions(versions, delta=False):
+    """
+    序列化版本数据。
+
+    Args:
+        delta (bool): 客户端支持时，除第一个版本外都编码为相对前一个版本的增量。
+    """
     response_versions = []
     for v in versions:
         manifest = {vf.file_path: vf.blob_hash for vf in v.files}
         response_versions.append(
             {'hash': v.hash, 'timestamp': v.timestamp, 'message': v.message, 'manifest': manifest})
-    return jsonify({'versions': response_versions})
+    return encode_versions(response_versions) if delta else response_versions
+
+
+@sync_bp.route('/versions/query', methods=['POST'])
+def query_versions(vault_id):
+    """与 GET /versions 相同，但哈希列表放在请求体中，不受 URL 长度限制。"""
+    user = get_user_from_token()
+    if not user:
+        return jsonify({'detail': '需要认证'}), 401
+    vault = get_vault_for_user(vault_id, user)
+    if not vault:
+        return jsonify({'error': '保险库未找到或无权访问'}), 404
+
+    version_hashes, error = _hashes_from_body()
+    if error:
+        return error
+    versions = Version.query.filter(
+        Version.vault_id == vault.id, Version.hash.in_(version_hashes)).all()
+    delta = bool((request.get_json(silent=True) or {}).get('delta'))
+    return jsonify({'versions': _serialize_versions(versions, delta=delta)})
@@ -2,6 +2,7 @@
 
 from flask import Blueprint, request, jsonify
 from app import db
+from app.idempotency import idempotent
 from app.models import Vault
 from .sync import get_user_from_token  # 复用认证函数
 
@@ -9,6 +10,7 @@ vault_bp = Blueprint('vault', __name__, url_prefix='/api/v1/vaults')
 
 
 @vault_bp.route('', methods=['POST'])
+@idempotent
 def create_vault():
     user = get_user_from_token()
     # ...
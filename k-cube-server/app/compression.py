@@ -0,0 +1,98 @@
+# k-cube-server/app/compression.py
+
+"""
+HTTP 请求体 / 响应体的透明压缩：请求体解压的 WSGI 中间件和压缩 JSON 响应的 after_request 钩子。
+
+编解码本身与客户端共用 k_cube_protocol.compression，两端的协商和解压上限因此始终一致。
+"""
+
+import io
+import json
+
+from flask import current_app, request
+
+from k_cube_protocol.compression import (COMPRESSION_THRESHOLD, MAX_DECODED_SIZE, CompressionError,
+                                         available_encodings, choose_encoding, compress, decompress)
+
+# 压缩请求体本身的大小上限：中间件需要把整个请求体读入内存才能解压，超过时直接以 413 拒绝
+MAX_COMPRESSED_SIZE = 64 * 1024 * 1024
+
+
+class RequestDecompressionMiddleware:
+    """
+    WSGI 中间件：在 Flask 解析请求之前解压带有 Content-Encoding 的请求体，
+    视图函数因此无需关心请求是否被压缩。
+    """
+
+    def __init__(self, wsgi_app, max_size: int = MAX_DECODED_SIZE,
+                 max_compressed_size: int = MAX_COMPRESSED_SIZE):
+        self.wsgi_app = wsgi_app
+        self.max_size = max_size
+        self.max_compressed_size = max_compressed_size
+
+    def __call__(self, environ, start_response):
+        encoding = environ.get('HTTP_CONTENT_ENCODING', '').strip().lower()
+        if not encoding or encoding == 'identity':
+            return self.wsgi_app(environ, start_response)
+        if encoding not in available_encodings():
+            return self._error(start_response, '415 Unsupported Media Type',
+                               f"不支持的 Content-Encoding: {encoding}")
+
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or -1)
+        except ValueError:
+            return self._error(start_response, '400 Bad Request', "无效的 Content-Length。")
+        if length > self.max_compressed_size:
+            return self._error(start_response, '413 Payload Too Large', "请求体超过大小上限。")
+        # 没有 Content-Length 时最多多读一个字节，用来判断是否超过上限
+        body = environ['wsgi.input'].read(length if length >= 0 else self.max_compressed_size + 1)
+        if len(body) > self.max_compressed_size:
+            return self._error(start_response, '413 Payload Too Large', "请求体超过大小上限。")
+        try:
+            decoded = decompress(body, encoding, self.max_size)
+        except CompressionError as e:
+            return self._error(start_response, '400 Bad Request', str(e))
+
+        environ['wsgi.input'] = io.BytesIO(decoded)
+        environ['CONTENT_LENGTH'] = str(len(decoded))
+        del environ['HTTP_CONTENT_ENCODING']
+        return self.wsgi_app(environ, start_response)
+
+    @staticmethod
+    def _error(start_response, status: str, message: str):
+        body = json.dumps({'error': message}, ensure_ascii=False).encode('utf-8')
+        start_response(status, [('Content-Type', 'application/json'),
+                                ('Content-Length', str(len(body)))])
+        return [body]
+
+
+def compress_response(response):
+    """
+    after_request 钩子：按 Accept-Encoding 压缩较大的 JSON 响应。
+
+    流式响应 (如 pack 下载) 和已经带有 Content-Encoding 的响应保持原样：
+    pack 中的 blob 已按内容选择过编码，客户端也直接从原始流中读取。
+    """
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code >= 300
+            or 'Content-Encoding' in response.headers
+            or response.mimetype != 'application/json'):
+        return response
+    response.vary.add('Accept-Encoding')
+
+    threshold = current_app.config.get('COMPRESSION_THRESHOLD', COMPRESSION_THRESHOLD)
+    if response.content_length is not None and response.content_length < threshold:
+        return response
+    accepted = [value for value, quality in request.accept_encodings if quality > 0]
+    encoding = choose_encoding(accepted)
+    if encoding is None:
+        return response
+
+    response.set_data(compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_app(app):
+    """为应用启用请求体解压。响应压缩由各蓝图通过 `compress_response` 注册。"""
+    app.wsgi_app = RequestDecompressionMiddleware(app.wsgi_app)
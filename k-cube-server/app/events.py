@@ -0,0 +1,43 @@
+# k-cube-server/app/events.py
+
+import threading
+
+
+class ChangeBroker:
+    """
+    进程内的变更通知：写入版本后调用 `publish()`，等待中的事件流立即被唤醒。
+
+    数据库中的 `Vault.change_seq` 才是唯一的事实来源，事件流被唤醒后总是重新查询它；
+    通知只是为了减少延迟。多进程部署 (例如多个 gunicorn worker) 时，
+    其他进程中的写入会在下一个轮询间隔内被发现。
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._generation = 0
+
+    def publish(self):
+        """通知所有等待者：某个保险库的变更序号可能已经增加。"""
+        with self._condition:
+            self._generation += 1
+            self._condition.notify_all()
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def wait(self, generation: int, timeout: float) -> int:
+        """
+        等待 `generation` 之后的下一次通知，最多等待 `timeout` 秒。
+
+        Returns:
+            int: 当前的通知代数，调用方下次等待时传入。
+        """
+        with self._condition:
+            if self._generation == generation:
+                self._condition.wait(timeout)
+            return self._generation
+
+
+# 进程内共享的实例
+broker = ChangeBroker()
@@ -0,0 +1,80 @@
+# k-cube-server/app/idempotency.py
+
+import functools
+import hashlib
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app, jsonify, request
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import IdempotencyRecord
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+# 响应被重放时附带的头，便于客户端和日志区分
+REPLAYED_HEADER = 'Idempotent-Replayed'
+# 记录的保留时间，超过后同一个键会被当作新请求
+KEY_TTL = timedelta(hours=24)
+MAX_KEY_LENGTH = 200
+
+
+def _scope(key):
+    """把键与调用者、方法和路径绑定，避免不同用户或不同接口之间的键冲突。"""
+    parts = [request.headers.get('Authorization', ''), request.method, request.path, key]
+    return hashlib.sha256('\n'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _cutoff():
+    """早于该时间记录的响应已经过期。"""
+    return datetime.now(timezone.utc).replace(tzinfo=None) - KEY_TTL
+
+
+def _purge_expired():
+    IdempotencyRecord.query.filter(IdempotencyRecord.created_at < _cutoff()).delete()
+
+
+def idempotent(view):
+    """
+    装饰器：让写接口可以安全地重试。
+
+    带有 Idempotency-Key 的请求第一次执行后保存其响应 (5xx 除外)，
+    之后带相同键的请求不再执行视图，而是原样返回保存的响应。
+    没有该请求头的请求照常执行。
+
+    视图提交事务之后、响应被记录之前如果进程崩溃，重试会再次执行视图，
+    因此被装饰的视图自身也应当容忍重复写入 (例如跳过已存在的版本和 blob)。
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return jsonify({'error': f'{IDEMPOTENCY_HEADER} 过长'}), 400
+
+        scope = _scope(key)
+        record = db.session.get(IdempotencyRecord, scope)
+        if record is not None and record.created_at < _cutoff():
+            # 过期的记录 (尚未被清理) 视为不存在，请求照常执行并重新记录
+            db.session.delete(record)
+            db.session.commit()
+            record = None
+        if record is not None:
+            response = current_app.response_class(
+                record.body, status=record.status_code, content_type=record.content_type)
+            response.headers[REPLAYED_HEADER] = 'true'
+            return response
+
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code < 500 and not response.is_streamed:
+            db.session.add(IdempotencyRecord(
+                key=scope, status_code=response.status_code,
+                body=response.get_data(), content_type=response.content_type))
+            _purge_expired()
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # 并发的重复请求已经先记录了结果
+                db.session.rollback()
+        return response
+    return wrapper
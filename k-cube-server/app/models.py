@@ -2,6 +2,7 @@
 
 from app import db
 from werkzeug.security import generate_password_hash, check_password_hash
+from datetime import datetime, timezone
 import json
 import uuid
 
@@ -14,6 +15,9 @@ class Vault(db.Model):
     name = db.Column(db.String(100), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, server_default=db.func.now())
+    # 单调递增的变更序号：每写入一个版本加一，客户端以此作为增量同步的游标
+    change_seq = db.Column(db.Integer, nullable=False,
+                           default=0, server_default='0')
 
     # 关系：一个保险库可以有多个版本
     versions = db.relationship(
@@ -48,6 +52,8 @@ class Version(db.Model):
     # 关键修改：不再关联 author_id，而是关联 vault_id
     vault_id = db.Column(db.String(36), db.ForeignKey(
         'vault.id'), nullable=False)
+    # 写入时分配的保险库内序号 (见 Vault.change_seq)；旧数据为空，首次检查时补齐
+    seq = db.Column(db.Integer, index=True)
 
     files = db.relationship(
         'VersionFile', backref='version', cascade="all, delete-orphan")
@@ -66,3 +72,14 @@ class VersionFile(db.Model):
         'blob.hash'), nullable=False)
 
     blob = db.relationship('Blob')
+
+
+class IdempotencyRecord(db.Model):
+    """已处理的带 Idempotency-Key 的写请求及其响应，重试的请求直接重放该响应。"""
+    # sha256(Authorization, 方法, 路径, Idempotency-Key)，不同用户的键互不影响
+    key = db.Column(db.String(64), primary_key=True)
+    status_code = db.Column(db.Integer, nullable=False)
+    body = db.Column(db.LargeBinary, nullable=False)
+    content_type = db.Column(db.String(100))
+    created_at = db.Column(db.DateTime, index=True, nullable=False,
+                           default=lambda: datetime.now(timezone.utc).replace(tzinfo=None))
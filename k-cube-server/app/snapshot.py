@@ -0,0 +1,82 @@
+# k-cube-server/app/snapshot.py
+
+"""
+保险库最新版本的快照：一个 pack 数据流，元数据帧中是最新版本的完整数据 (含清单)，
+其后是该版本引用的全部对象。新设备克隆时一次请求即可检出可用的工作区，
+其余历史再通过普通同步补齐。
+
+快照按 (保险库, 变更序号) 缓存为磁盘文件，保险库有新版本写入后序号变化，
+下一次请求时重新生成并删除旧的缓存。
+"""
+
+import glob
+import json
+import os
+import uuid
+from typing import Optional
+
+from flask import current_app
+
+from app.models import Blob, Version
+from k_cube_protocol.pack import iter_pack
+
+# 生成快照时每次从数据库加载的 blob 数量
+QUERY_BATCH = 100
+
+
+def _cache_dir() -> str:
+    """快照缓存目录：配置项 SNAPSHOT_CACHE_DIR，默认位于实例目录下。"""
+    directory = current_app.config.get('SNAPSHOT_CACHE_DIR') or \
+        os.path.join(current_app.instance_path, 'snapshots')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def get_snapshot(vault) -> Optional[str]:
+    """
+    返回保险库当前快照的缓存文件路径，缓存不存在时先生成。
+
+    Args:
+        vault (Vault): 已经补齐版本序号的保险库。
+
+    Returns:
+        Optional[str]: 快照文件路径；保险库还没有任何版本时返回 None。
+    """
+    directory = _cache_dir()
+    path = os.path.join(directory, f"{vault.id}-{vault.change_seq}.pack")
+    if os.path.exists(path):
+        return path
+
+    latest = Version.query.filter_by(vault_id=vault.id).order_by(
+        Version.timestamp.desc(), Version.hash).first()
+    if latest is None:
+        return None
+
+    manifest = {vf.file_path: vf.blob_hash for vf in latest.files}
+    meta = json.dumps({
+        'version': {'hash': latest.hash, 'timestamp': latest.timestamp,
+                    'message': latest.message, 'manifest': manifest},
+        'seq': vault.change_seq,
+    }, ensure_ascii=False).encode('utf-8')
+    blob_hashes = sorted(set(manifest.values()))
+
+    def blobs():
+        for start in range(0, len(blob_hashes), QUERY_BATCH):
+            batch = blob_hashes[start:start + QUERY_BATCH]
+            for blob in Blob.query.filter(Blob.hash.in_(batch)).all():
+                yield blob.hash, blob.content
+
+    # 并发请求可能同时生成同一个快照：各自写入临时文件，最后原子替换
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'wb') as f:
+        for chunk in iter_pack(blobs(), meta=meta):
+            f.write(chunk)
+    os.replace(tmp_path, path)
+
+    for stale in glob.glob(os.path.join(directory, f"{vault.id}-*.pack")):
+        if stale != path:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass  # 可能正被另一个请求发送或删除
+    return path
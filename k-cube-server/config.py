@@ -17,3 +17,6 @@ class Config:
 
     # 提供一个默认的 SQLite 作为备用，但它不应该在生产中被使用
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'app.db')
+
+    # 克隆快照的缓存目录，为空时使用 Flask 实例目录下的 snapshots/
+    SNAPSHOT_CACHE_DIR = os.environ.get('SNAPSHOT_CACHE_DIR')
@@ -28,5 +28,11 @@ echo "Creating default user..."
 flask --app wsgi create-user test@example.com password123
 
 # 使用 exec 启动 Gunicorn，使其成为容器的主进程
+# 守护进程通过 /api/v1/events 长连接接收变更通知，每个连接占用一个线程最长 10 分钟
+# (app/api/events.py 中的 MAX_STREAM_SECONDS)。因此使用线程 worker：长连接只占用线程，
+# 不会让同步、登录等普通请求排队；--timeout 也必须长于单个事件流的最长时间，
+# 否则 worker 会在推送中途被强制重启。
 echo "Starting Gunicorn server..."
-exec gunicorn --bind 0.0.0.0:5000 --workers 3 wsgi:app
\ No newline at end of file
+exec gunicorn --bind 0.0.0.0:5000 --workers 3 \
+  --worker-class gthread --threads "${GUNICORN_THREADS:-32}" \
+  --timeout 660 wsgi:app
\ No newline at end of file
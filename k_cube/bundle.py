@@ -0,0 +1,160 @@
+# k_cube/bundle.py
+
+"""
+离线同步包 (bundle)：把一段版本历史和它引用的对象打包成一个文件，用 U 盘等方式
+带到无法连接服务器的设备上导入。
+
+bundle 就是一个 pack 数据流 (参见 k_cube_protocol.pack)，每一帧都带有 SHA-256 摘要，结尾帧记录帧数：
+
+    META 帧:  {"format": "kcube-bundle", "version": 1, "vault_id", "created_at",
+               "base": 基准版本哈希或 null, "versions": [带完整清单的版本数据], "blobs": 对象数}
+    BLOB 帧:  基准版本的清单没有引用的对象
+
+导入方必须已经拥有基准版本及其对象；这是唯一的前提，导入时会检查。时间上早于基准的版本
+(例如另一台设备并发提交的版本) 导入方不一定拥有，因此它们的对象不会被省略。创建和导入都是流式的，
+对象逐个读取、按批写入，GB 级别的 bundle 也不会整个放进内存。
+"""
+
+import json
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+from k_cube_protocol.pack import PackError, iter_pack, read_pack
+
+from .profiling import span
+from .repository import Repository
+
+FORMAT = "kcube-bundle"
+VERSION = 1
+# 导入时每批写入对象库的对象数
+WRITE_BATCH = 100
+
+
+class BundleError(Exception):
+    """bundle 格式错误、校验失败或不能导入当前保险库时引发。"""
+    pass
+
+
+def create_bundle(repo: Repository, output: Path, since: Optional[str] = None) -> Dict:
+    """
+    把 `since` 之后的版本及其新增的对象写入 bundle 文件。
+
+    Args:
+        repo (Repository): 源保险库。
+        output (Path): bundle 文件路径；先写入临时文件，完成后原子替换。
+        since (Optional[str]): 基准版本 (完整哈希或前缀)。为空时打包完整历史。
+
+    Returns:
+        Dict: {"base", "versions", "blobs", "bytes"}。
+
+    Raises:
+        BundleError: 找不到基准版本，或基准之后没有新版本。
+    """
+    base = None
+    known = set()
+    versions = [repo.db.get_version_data(v_hash) for v_hash in repo.db.get_all_version_hashes()]
+    if since:
+        base = repo.db.find_version_by_prefix(since)
+        if not base:
+            raise BundleError(f"找不到版本 '{since}'。")
+        base_data = repo.db.get_version_data(base)
+        versions = [v for v in versions if v['timestamp'] > base_data['timestamp']]
+        # 导入方唯一确定拥有的是基准版本本身，只有它引用的对象可以省略
+        known = set(base_data['manifest'].values())
+    if not versions:
+        raise BundleError("基准版本之后没有新的版本，无需打包。")
+    versions.sort(key=lambda v: v['timestamp'])
+
+    blob_hashes = sorted({h for v in versions for h in v['manifest'].values()} - known)
+    repo._ensure_blobs(blob_hashes)
+
+    meta = json.dumps({
+        "format": FORMAT, "version": VERSION, "vault_id": repo.vault_id,
+        "created_at": int(time.time()), "base": base,
+        "versions": versions, "blobs": len(blob_hashes),
+    }, ensure_ascii=False).encode('utf-8')
+
+    def blobs() -> Iterator[Tuple[str, bytes]]:
+        for blob_hash in blob_hashes:
+            yield blob_hash, repo._read_blob(blob_hash, compressed=True)
+
+    output = Path(output)
+    tmp_path = output.with_name(f"{output.name}.{uuid.uuid4().hex}.tmp")
+    size = 0
+    try:
+        with span("bundle.create", blobs=len(blob_hashes)), open(tmp_path, 'wb') as f:
+            for chunk in iter_pack(blobs(), meta=meta):
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(tmp_path, output)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+    return {"base": base, "versions": len(versions), "blobs": len(blob_hashes), "bytes": size}
+
+
+def apply_bundle(repo: Repository, path: Path) -> Dict:
+    """
+    导入 bundle：逐帧校验并分批写入对象，全部对象就绪后再批量插入版本 (与同步拉取相同)。
+
+    Args:
+        repo (Repository): 目标保险库。
+        path (Path): bundle 文件路径。
+
+    Returns:
+        Dict: {"base", "versions": 新增的版本数, "blobs": 写入的对象数}。
+
+    Raises:
+        BundleError: 文件损坏、属于其他保险库、缺少基准版本或缺少对象。
+    """
+    header = {}
+
+    def on_meta(content: bytes):
+        try:
+            meta = json.loads(content)
+        except ValueError as e:
+            raise BundleError(f"bundle 的元数据无效: {e}") from e
+        if meta.get("format") != FORMAT or meta.get("version") != VERSION:
+            raise BundleError("不是受支持的 K-Cube bundle。")
+        if repo.vault_id and meta.get("vault_id") != repo.vault_id:
+            raise BundleError(f"bundle 属于另一个保险库 ({meta.get('vault_id')})。")
+        base = meta.get("base")
+        if base and repo.db.filter_missing_versions([base]):
+            raise BundleError(f"本地缺少 bundle 的基准版本 {base[:7]}，请先导入更早的 bundle。")
+        header.update(meta)
+
+    written = 0
+    batch = []
+    try:
+        with span("bundle.apply"), open(path, 'rb') as f:
+            for blob in read_pack(f, on_meta=on_meta):
+                if not header:
+                    raise BundleError("bundle 缺少元数据。")
+                batch.append(blob)
+                if len(batch) >= WRITE_BATCH:
+                    repo._write_blobs(batch)
+                    written += len(batch)
+                    batch = []
+            repo._write_blobs(batch)
+            written += len(batch)
+    except PackError as e:
+        raise BundleError(f"bundle 已损坏: {e}") from e
+    if not header:
+        raise BundleError("bundle 缺少元数据。")
+
+    # 所有对象落盘之后才写入版本，保证任何已记录的版本都可以检出
+    new_hashes = set(repo.db.filter_missing_versions([v['hash'] for v in header["versions"]]))
+    versions = [v for v in header["versions"] if v['hash'] in new_hashes]
+    needed = sorted({h for v in versions for h in v['manifest'].values()})
+    missing = set(needed) - set(repo.db.get_blob_sizes(needed))
+    if missing and not repo.is_partial:
+        raise BundleError(f"bundle 缺少 {len(missing)} 个对象，无法导入。")
+    repo.db.bulk_insert_versions(versions, promised=repo.is_partial)
+    if not repo.vault_id and header.get("vault_id"):
+        # 离线设备上新建的空仓库通过第一个 bundle 关联到保险库
+        repo.config.set("vault_id", header["vault_id"])
+        repo.vault_id = header["vault_id"]
+    return {"base": header.get("base"), "versions": len(versions), "blobs": written}
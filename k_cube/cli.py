@@ -1,31 +1,65 @@
 # k_cube/cli.py
 
 from pathlib import Path
-from typing import Tuple
+from typing import Tuple, TYPE_CHECKING
 
 import click
-from rich.console import Console
-from rich.panel import Panel
 import sys
 
-from .repository import Repository
 from .config import ConfigManager
-from .client import APIClient, APIError, AuthenticationError
-from .sync import Synchronizer
-from .utils import format_timestamp, find_vault_root  # <--- 修改这一行
-from rich.table import Table
+from .utils import format_timestamp, find_vault_root, LazyConsole
 
+if TYPE_CHECKING:
+    from .client import APIClient
 
-# 创建一个 Rich Console 实例，用于美化输出
-console = Console()
+# 命令按需导入各自的依赖：Rich、Repository 以及网络相关的 client/sync 模块
+# 都只在真正用到时才加载，`kv status` 这类本地命令因此不会导入 requests。
+
+# 创建一个 Rich Console 代理，用于美化输出
+console = LazyConsole()
 
 
 @click.group()
-def main():
+@click.option('--profile', 'profile', is_flag=True,
+              help="命令结束后打印各阶段耗时 (遍历、哈希、SQLite、HTTP 等)。")
+@click.option('--profile-output', type=click.Path(dir_okay=False),
+              help="同时保存性能数据：*.json 为 Chrome Trace，其余 (如 *.prof) 为 cProfile 数据。")
+@click.pass_context
+def main(ctx: click.Context, profile: bool, profile_output: str):
     """
     K-Cube (kv): 一个为知识管理而生的版本控制工具。
     """
-    pass
+    if profile or profile_output:
+        _start_profiling(ctx, profile_output)
+
+
+def _start_profiling(ctx: click.Context, output: str):
+    """启用 Span 记录 (以及可选的 cProfile)，并在命令结束时输出结果。"""
+    from .profiling import profiler, render_span_tree
+
+    cprofile = None
+    if output and not output.endswith('.json'):
+        import cProfile
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+    profiler.enable(name=f"kv {ctx.invoked_subcommand or ''}".strip())
+
+    def finish():
+        root = profiler.disable()
+        if cprofile is not None:
+            cprofile.disable()
+            cprofile.dump_stats(output)
+        elif output:
+            import json
+            with open(output, 'w', encoding='utf-8') as f:
+                json.dump(profiler.to_chrome_trace(root), f)
+        console.print("\n[bold]性能分析 (Profile):[/bold]")
+        console.print(render_span_tree(root.to_dict()),
+                      markup=False, highlight=False, soft_wrap=True)
+        if output:
+            console.print(f"[dim]性能数据已写入 {output}[/dim]")
+
+    ctx.call_on_close(finish)
 
 
 def get_global_config_path() -> Path:
@@ -48,6 +82,9 @@ def vault_list():
     """
     列出你云端账户下的所有保险库。
     """
+    from rich.panel import Panel
+    from rich.table import Table
+
     try:
         client = get_authenticated_client()
         with console.status("[bold green]正在从云端获取列表...[/bold green]"):
@@ -71,25 +108,38 @@ def vault_list():
                             title="[bold]错误[/bold]", expand=False, border_style="red"))
 
 
-def get_authenticated_client() -> APIClient:
-    """辅助函数：加载全局配置并返回一个已认证的 API 客户端。"""
+def get_authenticated_client() -> 'APIClient':
+    """辅助函数：加载全局配置并返回一个已认证的 API 客户端 (file:// 远程不需要登录)。"""
+    from rich.panel import Panel
+    from .local_remote import is_local_remote, open_remote
+
     global_config = ConfigManager(get_global_config_path())
     remote_url = global_config.get("remote_url")
     api_token = global_config.get("api_token")
-    if not remote_url or not api_token:
+    if not remote_url or not (api_token or is_local_remote(remote_url)):
         console.print(Panel("[bold red]❌ 操作失败[/bold red]\n\n需要全局配置和登录信息。\n请先运行 `kv remote <url>` 和 `kv login`。",
                             title="[bold]错误[/bold]", expand=False, border_style="red"))
         sys.exit(1)
-    return APIClient(remote_url, api_token)
+    return open_remote(remote_url, api_token)
 
 
 @main.command()
 @click.argument('vault_id')
 @click.argument('directory', required=False)
-def clone(vault_id: str, directory: str):
+@click.option('--partial', is_flag=True,
+              help="部分克隆：只下载最新版本的文件内容，历史版本的内容在恢复时按需下载。")
+@click.option('--depth', type=click.IntRange(min=1),
+              help="浅克隆：只下载最近的 N 个版本。")
+@click.option('--since', type=click.DateTime(formats=["%Y-%m-%d", "%Y-%m-%d %H:%M:%S"]),
+              help="浅克隆：只下载该日期之后的版本。")
+def clone(vault_id: str, directory: str, partial: bool, depth: int, since):
     """
     从云端克隆一个已存在的保险库到本地。
     """
+    from rich.panel import Panel
+    from .repository import Repository
+    from .sync import Synchronizer
+
     # 如果用户只提供了 vault_id，我们使用一个默认的文件夹名
     # 为了避免歧义，我们从云端获取 vault name
     client = get_authenticated_client()
@@ -129,18 +179,31 @@ def clone(vault_id: str, directory: str):
             remote_url = global_config.get("remote_url")
             repo.config.set("vault_id", vault_id)
             repo.config.set("remote_url", remote_url)
+            if partial:
+                # 记录 promisor 远程：本地缺少的对象都可以从这里获取
+                repo.config.set("promisor", {"remote_url": remote_url, "vault_id": vault_id})
 
             # --- 核心修复 ---
             # 手动更新内存中 repo 实例的 vault_id 属性，以确保后续操作能获取到
             repo.vault_id = vault_id
 
-        # 3. 执行第一次同步以下载所有数据
+        # 3. 服务器支持快照时，先用一个请求下载并检出最新版本，工作区立即可用
         synchronizer = Synchronizer(repo, client)
+        with console.status("[bold green]正在下载最新版本的快照...[/bold green]"):
+            snapshot_hash = synchronizer.fetch_snapshot()
+        if snapshot_hash:
+            repo.restore(snapshot_hash)
+            console.print("✅ 最新版本已检出，正在同步其余历史...")
+
+        # 4. 同步其余数据；浅克隆先只获取指定的历史窗口，之后的同步不会再下载边界之前的版本
+        if depth or since:
+            synchronizer.fetch_history(
+                depth=depth, since=int(since.timestamp()) if since else None)
         synchronizer.sync()
 
-        # 4. 自动恢复到最新状态
+        # 5. 自动恢复到最新状态 (快照之后服务器上可能又有了新版本)
         latest_hash = repo.db.get_latest_version_hash()
-        if latest_hash:
+        if latest_hash and latest_hash != snapshot_hash:
             with console.status("[bold green]正在检出最新文件...[/bold green]"):
                 repo.restore(latest_hash)
 
@@ -160,6 +223,10 @@ def init(name: str):
     """
     在当前目录初始化一个新的保险库，并与云端关联。
     """
+    from rich.panel import Panel
+    from .local_remote import is_local_remote, open_remote
+    from .repository import Repository
+
     current_path = Path.cwd()
     if find_vault_root(current_path):
         console.print(Panel("[bold red]❌ 操作失败[/bold red]\n\n当前目录或其父目录已经是一个 K-Cube 保险库。",
@@ -169,14 +236,14 @@ def init(name: str):
     global_config = ConfigManager(get_global_config_path())
     remote_url = global_config.get("remote_url")
     api_token = global_config.get("api_token")
-    if not remote_url or not api_token:
+    if not remote_url or not (api_token or is_local_remote(remote_url)):
         console.print(Panel("[bold red]❌ 操作失败[/bold red]\n\n需要全局配置和登录信息。\n请先运行 `kv remote <url>` 和 `kv login`。",
                             title="[bold]错误[/bold]", expand=False, border_style="red"))
         sys.exit(1)
 
     try:
         with console.status("[bold green]正在云端创建保险库记录...[/bold green]"):
-            client = APIClient(remote_url, api_token)
+            client = open_remote(remote_url, api_token)
             vault_info = client.create_vault(name)
             vault_id = vault_info['id']
 
@@ -201,6 +268,9 @@ def init(name: str):
 @main.command()
 def status():
     """显示当前工作区的变更状态。"""
+    from rich.panel import Panel
+    from .repository import Repository
+
     repo = Repository.find()
     if not repo:
         console.print("[bold red]错误：[/bold red]当前目录不是一个 K-Cube 保险库。")
@@ -274,6 +344,8 @@ def status():
 @click.argument('paths', nargs=-1, required=True)
 def add(paths: Tuple[str]):
     """将文件变更添加到暂存区。"""
+    from .repository import Repository
+
     repo = Repository.find()
     if not repo:
         console.print("[bold red]错误：[/bold red]当前目录不是一个 K-Cube 保险库。")
@@ -289,6 +361,8 @@ def add(paths: Tuple[str]):
 @click.option('-m', '--message', 'summary', help="本次提交的摘要信息。")
 def commit_command(summary: str):
     """将暂存区的变更记录为一个新版本。"""
+    from .repository import Repository
+
     repo = Repository.find()
     if not repo:
         console.print("[bold red]错误：[/bold red]当前目录不是一个 K-Cube 保险库。")
@@ -332,6 +406,8 @@ def reset(paths: Tuple[str]):
 
     如果未提供文件路径，则清空整个暂存区。
     """
+    from .repository import Repository
+
     repo = Repository.find()
     if not repo:
         console.print("[bold red]错误：[/bold red]当前目录不是一个 K-Cube 保险库。")
@@ -351,6 +427,9 @@ def revert(version: str):
 
     这不会修改历史记录，而是在历史的顶端添加一个新的提交。
     """
+    from rich.panel import Panel
+    from .repository import Repository
+
     repo = Repository.find()
     if not repo:
         console.print("[bold red]错误：[/bold red]当前目录不是一个 K-Cube 保险库。")
@@ -378,6 +457,8 @@ def restore(version: str, file_path: str, hard: bool):
     VERSION:   版本哈希的前缀。
     FILE_PATH: [可选] 要恢复的文件的相对路径。如果未提供，则恢复整个工作区。
     """
+    from .repository import Repository
+
     repo = Repository.find()
     # ... (前置检查)
 
@@ -394,6 +475,11 @@ def restore(version: str, file_path: str, hard: bool):
     if not click.confirm(confirm_msg, abort=True):
         return
 
+    if repo.is_partial:
+        # 部分克隆：目标版本缺少的对象在恢复前从 promisor 远程批量下载
+        from .sync import Synchronizer
+        repo.promisor = Synchronizer(repo, get_authenticated_client()).fetch_blobs
+
     try:
         repo.restore(version, path_obj, hard_mode=hard)
         # ... (成功提示)
@@ -408,6 +494,9 @@ def log(file_path: str):
     """
     显示整个仓库或单个文件的版本历史。
     """
+    from rich.panel import Panel
+    from .repository import Repository
+
     repo = Repository.find()
     if not repo:
         console.print("[bold red]错误：[/bold red]当前目录不是一个 K-Cube 保险库。")
@@ -445,18 +534,120 @@ def log(file_path: str):
         console.print(" │")
         console.print(" ▼")
 
+    if repo.shallow:
+        console.print("[dim] ⋯ 更早的历史未下载 (浅克隆)。使用 `kv fetch --deepen N` 获取更多版本。[/dim]")
+
+
+@main.command()
+@click.option('--deepen', type=click.IntRange(min=1), required=True,
+              help="在浅克隆的历史边界之前再下载 N 个版本。")
+def fetch(deepen: int):
+    """为浅克隆的保险库下载更早的历史版本。"""
+    from rich.panel import Panel
+    from .repository import Repository
+    from .sync import Synchronizer
+
+    repo = Repository.find()
+    if not repo:
+        console.print("[bold red]错误：[/bold red]当前目录不是一个 K-Cube 保险库。")
+        sys.exit(1)
+    if not repo.shallow:
+        console.print("[green]本地已拥有完整的版本历史。[/green]")
+        return
+
+    try:
+        fetched = Synchronizer(repo, get_authenticated_client()).fetch_history(deepen=deepen)
+    except Exception as e:
+        console.print(Panel(f"[bold red]❌ 获取历史失败: {e}[/bold red]",
+                            title="[bold]错误[/bold]", expand=False, border_style="red"))
+        sys.exit(1)
+    remaining = "已拥有完整的版本历史" if not repo.shallow else "更早的历史仍未下载"
+    console.print(Panel(f"✅ 下载了 {fetched} 个历史版本，{remaining}。", expand=False))
+
+
+@main.group()
+def bundle():
+    """
+    创建和导入离线同步包，在无法连接服务器的设备之间传递版本历史。
+    """
+    pass
+
+
+@bundle.command(name="create")
+@click.argument('output', type=click.Path(dir_okay=False, path_type=Path))
+@click.option('--since', 'since', metavar='<版本>',
+              help="基准版本 (哈希前缀)：只打包它之后的版本。接收方必须已有该版本。默认打包完整历史。")
+def bundle_create(output: Path, since: str):
+    """把版本历史和所需的对象打包成一个文件。"""
+    from rich.panel import Panel
+    from .bundle import BundleError, create_bundle
+    from .repository import Repository
+    from .sync import Synchronizer, format_bytes
+
+    repo = Repository.find()
+    if not repo:
+        console.print("[bold red]错误：[/bold red]当前目录不是一个 K-Cube 保险库。")
+        sys.exit(1)
+    if repo.is_partial:
+        # 部分克隆中缺少的对象在打包前从 promisor 远程批量下载
+        repo.promisor = Synchronizer(repo, get_authenticated_client()).fetch_blobs
+
+    try:
+        with console.status("[bold green]正在打包...[/bold green]"):
+            summary = create_bundle(repo, output, since=since)
+    except (BundleError, IOError) as e:
+        console.print(Panel(f"[bold red]❌ 打包失败: {e}[/bold red]",
+                            title="[bold]错误[/bold]", expand=False, border_style="red"))
+        sys.exit(1)
+    base = f"版本 {summary['base'][:7]} 之后的" if summary['base'] else "全部"
+    console.print(Panel(
+        f"✅ 已将{base} {summary['versions']} 个版本和 {summary['blobs']} 个对象写入 "
+        f"[cyan]{output}[/cyan] ({format_bytes(summary['bytes'])})。", expand=False))
+
+
+@bundle.command(name="apply")
+@click.argument('path', type=click.Path(exists=True, dir_okay=False, path_type=Path))
+def bundle_apply(path: Path):
+    """导入离线同步包中的版本和对象。"""
+    from rich.panel import Panel
+    from .bundle import BundleError, apply_bundle
+    from .repository import Repository
+
+    repo = Repository.find()
+    if not repo:
+        console.print("[bold red]错误：[/bold red]当前目录不是一个 K-Cube 保险库。")
+        sys.exit(1)
+
+    try:
+        with console.status("[bold green]正在导入...[/bold green]"):
+            summary = apply_bundle(repo, path)
+    except BundleError as e:
+        console.print(Panel(f"[bold red]❌ 导入失败: {e}[/bold red]",
+                            title="[bold]错误[/bold]", expand=False, border_style="red"))
+        sys.exit(1)
+    console.print(Panel(
+        f"✅ 导入了 {summary['versions']} 个新版本和 {summary['blobs']} 个对象。\n"
+        f"使用 `kv log` 查看历史，`kv restore <版本>` 检出文件。", expand=False))
+
 
 @main.command()
 def login():
     """
     [全局命令] 登录到 K-Cube 云端服务。
     """
+    from rich.panel import Panel
+    from .client import APIClient, APIError, AuthenticationError
+    from .local_remote import is_local_remote
+
     global_config = ConfigManager(get_global_config_path())
     remote_url = global_config.get("remote_url")
     if not remote_url:
         console.print(Panel("[bold red]❌ 操作失败[/bold red]\n\n请先使用 `kv remote <url>` 设置远程仓库地址。",
                             title="[bold]错误[/bold]", expand=False, border_style="red"))
         sys.exit(1)
+    if is_local_remote(remote_url):
+        console.print(Panel(f"ℹ️ 远程仓库 [cyan]{remote_url}[/cyan] 是本机目录，不需要登录。", expand=False))
+        return
 
     email = click.prompt("邮箱")
     password = click.prompt("密码", hide_input=True)
@@ -481,16 +672,30 @@ def login():
 @click.argument('url')
 def remote(url: str):
     """
-    [全局命令] 设置 K-Cube 云端服务的远程仓库 URL。
+    [全局命令] 设置 K-Cube 云端服务的远程仓库 URL，也可以是本机目录 (file:///path/to/dir)。
     """
+    from rich.panel import Panel
+
     global_config = ConfigManager(get_global_config_path())
     global_config.set("remote_url", url)
     console.print(Panel(f"✅ 全局远程仓库已设置为: [cyan]{url}[/cyan]", expand=False))
 
 
 @main.command()
-def sync():
+@click.option('-j', '--jobs', type=click.IntRange(min=1),
+              help="同时进行的上传/下载批次数 (默认读取保险库配置 sync_concurrency，否则为 4)。")
+@click.option('--full', is_flag=True, help="忽略同步游标，与服务器完整对账全部版本。")
+@click.option('--stats', is_flag=True, help="同步结束后打印流量、各阶段耗时和吞吐量，以及最近几次同步的对比。")
+@click.option('--dry-run', 'dry_run', is_flag=True,
+              help="只与服务器协商，报告每个方向要传输的版本、对象和字节数及预计耗时，不做任何修改。")
+def sync(jobs, full, stats, dry_run):
     """与远程仓库同步当前保险库的变更。"""
+    from rich.panel import Panel
+    from .client import APIError, AuthenticationError
+    from .local_remote import is_local_remote, open_remote
+    from .repository import Repository
+    from .sync import Synchronizer, format_bytes
+
     repo = Repository.find()
     if not repo:
         console.print(Panel("[bold red]❌ 操作失败[/bold red]\n\n当前目录不是一个 K-Cube 保险库。请先运行 `kv init`。",
@@ -503,15 +708,31 @@ def sync():
     global_config = ConfigManager(get_global_config_path())
     api_token = global_config.get("api_token")
 
-    if not remote_url or not api_token or not vault_id:
+    if not remote_url or not vault_id or not (api_token or is_local_remote(remote_url)):
         console.print(Panel("[bold red]❌ 配置不完整[/bold red]\n\n保险库配置或全局登录信息不完整。请检查配置或重新登录。",
                             title="[bold]错误[/bold]", expand=False, border_style="red"))
         sys.exit(1)
 
     try:
-        client = APIClient(remote_url, api_token)
-        synchronizer = Synchronizer(repo, client)
-        synchronizer.sync()
+        client = open_remote(remote_url, api_token)
+        synchronizer = Synchronizer(
+            repo, client, concurrency=jobs, full_reconcile=full)
+        plan = synchronizer.plan()
+        if dry_run:
+            _print_transfer_estimate(synchronizer.estimate(plan))
+            return
+        if plan.has_changes:
+            console.print(f"同步计划：{plan.describe()}")
+        result = synchronizer.execute(plan)
+        if result.blobs_uploaded:
+            console.print(
+                f"已上传 {result.blobs_uploaded} 个对象 ({result.bytes_uploaded / 1024:.1f} KiB)。")
+        if result.bytes_saved_by_delta:
+            delta_blobs = result.blobs_delta_uploaded + result.blobs_delta_downloaded
+            console.print(
+                f"其中 {delta_blobs} 个对象以增量传输，节省 {format_bytes(result.bytes_saved_by_delta)}。")
+        if stats:
+            _print_sync_stats(repo, result, client.metrics.summary())
     except AuthenticationError:
         console.print(Panel("[bold red]❌ 认证失败！[/bold red]\n\n你的 token 可能已过期，请重新使用 `kv login` 登录。",
                             title="[bold]错误[/bold]", expand=False, border_style="red"))
@@ -523,3 +744,70 @@ def sync():
         traceback.print_exc()
         console.print(Panel(f"[bold red]❌ 发生未知错误: {e}[/bold red]",
                             title="[bold]错误[/bold]", expand=False, border_style="red"))
+
+
+def _print_transfer_estimate(estimate):
+    """打印 `kv sync --dry-run` 的结果。"""
+    from rich.table import Table
+    from .sync import format_bytes
+
+    if not (estimate.versions_to_upload or estimate.versions_to_download):
+        console.print("[bold green]✅ 已是最新，没有需要传输的内容。[/bold green]")
+        return
+    table = Table(title="同步预演 (未做任何修改)")
+    for column in ("方向", "版本", "对象", "字节数 (编码后)"):
+        table.add_column(column, style="cyan" if column == "方向" else None)
+    unknown = f" + {estimate.unknown_sizes} 个大小未知的对象" if estimate.unknown_sizes else ""
+    table.add_row("上传", str(estimate.versions_to_upload), str(estimate.blobs_to_upload),
+                  format_bytes(estimate.upload_bytes))
+    table.add_row("下载", str(estimate.versions_to_download), str(estimate.blobs_to_download),
+                  format_bytes(estimate.download_bytes) + unknown)
+    console.print(table)
+    seconds = estimate.estimated_seconds
+    if seconds is None:
+        console.print("[dim]还没有同步记录，无法估算耗时。[/dim]")
+    else:
+        console.print(f"按最近的吞吐量 {format_bytes(estimate.throughput)}/s 估算，"
+                      f"传输约需 {seconds:.1f}s (增量传输和压缩可能使实际传输量更少)。")
+
+
+def _print_sync_stats(repo, result, endpoints: dict):
+    """打印 `kv sync --stats` 的统计：本次同步的流量与耗时，以及同步记录中最近几次的对比。"""
+    from rich.table import Table
+    from .sync import format_bytes
+    from .sync_log import SyncLog
+
+    table = Table(title="同步统计", show_header=False)
+    table.add_column("项目", style="cyan")
+    table.add_column("数值")
+    table.add_row("版本 (上传 / 下载)", f"{result.versions_uploaded} / {result.versions_downloaded}")
+    table.add_row("对象 (上传 / 下载)", f"{result.blobs_uploaded} / {result.blobs_downloaded}"
+                  f" (另有增量 {result.blobs_delta_uploaded} / {result.blobs_delta_downloaded})")
+    table.add_row("发送 (原始 / 实际)",
+                  f"{format_bytes(result.bytes_sent)} / {format_bytes(result.bytes_sent_compressed)}")
+    table.add_row("接收 (原始 / 实际)",
+                  f"{format_bytes(result.bytes_received)} / {format_bytes(result.bytes_received_compressed)}")
+    table.add_row("请求 / 重试", f"{result.requests} / {result.retries}")
+    for phase, seconds in result.phase_seconds.items():
+        table.add_row(f"耗时: {phase}", f"{seconds:.2f}s")
+    throughput = result.throughput
+    table.add_row("吞吐量", f"{format_bytes(throughput)}/s" if throughput else "-")
+    console.print(table)
+
+    if endpoints:
+        endpoint_table = Table(title="接口")
+        for column in ("接口", "请求", "重试", "错误", "p50 (ms)", "p95 (ms)"):
+            endpoint_table.add_column(column, style="cyan" if column == "接口" else None)
+        for route, m in sorted(endpoints.items()):
+            endpoint_table.add_row(route, str(m["count"]), str(m["retries"]), str(m["errors"]),
+                                   f"{m['p50_ms']:g}", f"{m['p95_ms']:g}")
+        console.print(endpoint_table)
+
+    history = SyncLog(repo.kcube_path).entries(limit=20)
+    rates = [e["throughput"] for e in history if e.get("throughput")]
+    durations = sorted(e["seconds"] for e in history if "seconds" in e)
+    if len(history) > 1 and durations:
+        rate = f"，平均吞吐量 {format_bytes(sum(rates) / len(rates))}/s" if rates else ""
+        console.print(f"[dim]最近 {len(history)} 次同步：耗时中位数 "
+                      f"{durations[len(durations) // 2]:.2f}s{rate}。"
+                      f"完整记录见 .kcube/sync_log.jsonl。[/dim]")
@@ -1,7 +1,21 @@
 # k-cube/k_cube/client.py
 
+import json
+import random
+import re
+import threading
+import time
+import uuid
 import requests
-from typing import Dict, List, Optional
+import urllib3
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from k_cube_protocol.compression import COMPRESSION_THRESHOLD, choose_encoding, compress
+from k_cube_protocol.manifest import MissingBaseError, decode_versions, encode_versions
+from k_cube_protocol.pack import CONTENT_TYPE as PACK_CONTENT_TYPE, PackError, iter_pack, read_pack
+
+from .profiling import span, count
 
 # --- 自定义异常类 ---
 # 升级后的异常类，可以携带 HTTP 状态码
@@ -20,12 +34,106 @@ class AuthenticationError(APIError):
     pass
 
 
+# --- 传输层参数 ---
+# 会被重试的 HTTP 状态码：限流、网关错误和服务暂不可用
+RETRY_STATUSES = {429, 502, 503, 504}
+# 本身幂等的 HTTP 方法，失败后总是可以重发
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = 30.0
+# 估算读超时时假定的最低吞吐量 (字节/秒)：请求体越大，等待服务器处理的时间越长
+MIN_THROUGHPUT = 256 * 1024
+# 服务器通过 Retry-After 要求的等待时间上限 (秒)
+MAX_RETRY_AFTER = 60.0
+
+
+class RequestMetrics:
+    """
+    按接口汇总请求耗时、重试次数和失败次数 (线程安全)。
+
+    接口路径中的保险库 ID 被归一化，同一个接口的所有请求合并统计。
+    """
+
+    _VAULT_ID = re.compile(r"(api/v1/vaults/)[^/]+")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, List[float]] = defaultdict(list)
+        self._retries: Dict[str, int] = defaultdict(int)
+        self._errors: Dict[str, int] = defaultdict(int)
+
+    def record(self, method: str, endpoint: str, seconds: float, attempts: int, ok: bool):
+        route = method + " " + self._VAULT_ID.sub(r"\1<id>", endpoint.lstrip("/"))
+        with self._lock:
+            self._latencies[route].append(seconds)
+            self._retries[route] += attempts - 1
+            if not ok:
+                self._errors[route] += 1
+
+    def summary(self) -> Dict[str, Dict]:
+        """
+        Returns:
+            Dict[str, Dict]: {接口: {"count", "retries", "errors", "p50_ms", "p95_ms", "max_ms"}}。
+        """
+        with self._lock:
+            result = {}
+            for route, latencies in self._latencies.items():
+                ordered = sorted(latencies)
+
+                def pick(q):
+                    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 1)
+                result[route] = {
+                    "count": len(ordered),
+                    "retries": self._retries[route],
+                    "errors": self._errors[route],
+                    "p50_ms": pick(0.5),
+                    "p95_ms": pick(0.95),
+                    "max_ms": round(ordered[-1] * 1000, 1),
+                }
+            return result
+
+
+def parse_event_stream(lines: Iterable[str]) -> Iterator[Tuple[str, dict]]:
+    """
+    解析 Server-Sent Events 文本流。
+
+    Args:
+        lines (Iterable[str]): 逐行的文本 (不含换行符)。
+
+    Yields:
+        Tuple[str, dict]: (事件名, JSON 数据)。没有 `event:` 字段的事件名为 "message"。
+    """
+    event, data = "message", []
+    for line in lines:
+        if not line:
+            if data:
+                try:
+                    yield event, json.loads("\n".join(data))
+                except ValueError:
+                    pass
+            event, data = "message", []
+        elif line.startswith(":"):
+            continue
+        else:
+            field, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if field == "event":
+                event = value
+            elif field == "data":
+                data.append(value)
+
+
 class APIClient:
     """
     封装了所有与 K-Cube 云端服务器的 HTTP 通信。
+
+    传输层会重试暂时性的失败 (连接重置、超时、429/502/503/504)，
+    两次尝试之间按指数退避并加入随机抖动。只有可以安全重发的请求才会重试：
+    幂等方法，或者带有 Idempotency-Key 且服务器支持 "idempotency-keys" 的 POST。
     """
 
-    def __init__(self, remote_url: str, api_token: Optional[str] = None):
+    def __init__(self, remote_url: str, api_token: Optional[str] = None, pool_size: int = 10,
+                 max_retries: int = 4):
         if not remote_url:
             raise ValueError("远程仓库 URL 不能为空。")
 
@@ -34,6 +142,8 @@ class APIClient:
 
         # 使用 requests.Session 来复用 TCP 连接并管理 headers，性能更佳
         self.session = requests.Session()
+        self.pool_size = 0
+        self.set_pool_size(pool_size)
         self.session.headers.update({
             "Content-Type": "application/json",
             "Accept": "application/json",
@@ -43,6 +153,34 @@ class APIClient:
             self.session.headers.update({
                 "Authorization": f"Bearer {self.api_token}"
             })
+        # 服务器支持的协议特性，首次使用时查询一次
+        self._capabilities: Optional[Set[str]] = None
+        # 重试策略：第 n 次重试前等待 [0, min(backoff_max, backoff_base * 2^n)) 秒
+        self.max_retries = max_retries
+        self.backoff_base = 0.5
+        self.backoff_max = 8.0
+        self.metrics = RequestMetrics()
+        # 不小于该字节数的 JSON 请求体会被压缩；设为 None 关闭请求压缩。
+        # 响应压缩由 requests 默认的 Accept-Encoding 协商并自动解压。
+        self.compression_threshold: Optional[int] = COMPRESSION_THRESHOLD
+
+    def set_pool_size(self, pool_size: int):
+        """
+        调整每个主机的连接池大小，使其不小于并发请求数。
+
+        连接池小于并发数时，多出来的线程会新建连接并在用完后丢弃，
+        失去连接复用的意义。
+
+        Args:
+            pool_size (int): 期望的连接数。
+        """
+        if pool_size <= self.pool_size:
+            return
+        self.pool_size = pool_size
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
     def _request(self, method: str, endpoint: str, **kwargs) -> dict:
         """
@@ -60,33 +198,217 @@ class APIClient:
             APIError: 如果发生其他 API 错误或网络层错误。
         """
         url = f"{self.base_url}/{endpoint.lstrip('/')}"
+        with span(f"http.{method}"):
+            if kwargs.get("json") is not None:
+                kwargs = self._encode_json_body(kwargs)
+            return self._send(method, url, **kwargs)
+
+    def _encode_json_body(self, kwargs: dict) -> dict:
+        """
+        自行序列化 `json=` 参数，并在请求体足够大且服务器支持时压缩。
+
+        Returns:
+            dict: 替换为 `data=` 和相应请求头之后的参数。
+        """
+        kwargs = dict(kwargs)
+        body = json.dumps(kwargs.pop("json"), ensure_ascii=False,
+                          separators=(",", ":")).encode("utf-8")
+        headers = dict(kwargs.pop("headers", None) or {})
+        headers.setdefault("Content-Type", "application/json")
+
+        encoding = None
+        if self.compression_threshold is not None and len(body) >= self.compression_threshold:
+            encoding = choose_encoding(self._request_encodings())
+        if encoding is not None:
+            compressed = compress(body, encoding)
+            count("bytes_uncompressed", len(body))
+            # 压缩后反而更大 (例如全是随机哈希的小请求) 时发送原文
+            if len(compressed) < len(body):
+                # bytes_sent 统计实际发送的字节数，加上它即为原始大小
+                count("bytes_sent_saved", len(body) - len(compressed))
+                body = compressed
+                headers["Content-Encoding"] = encoding
+        kwargs["data"] = body
+        kwargs["headers"] = headers
+        return kwargs
+
+    def _request_encodings(self) -> List[str]:
+        """服务器能够解压的请求体编码。"""
+        prefix = "content-encoding-"
+        return [c[len(prefix):] for c in self.get_capabilities() if c.startswith(prefix)]
+
+    def _send(self, method: str, url: str, **kwargs) -> dict:
+        """执行一次 HTTP 请求并解析响应，参见 `_request`。"""
+        response = self._perform(method, url, **kwargs)
+        try:
+            count("bytes_received", len(response.content))
+        except requests.RequestException as e:
+            raise APIError(f"网络连接错误: {e}") from e
+        # bytes_received 是解压后的大小；压缩响应的实际传输量来自 Content-Length
+        encoded_length = response.headers.get("Content-Length", "")
+        if response.headers.get("Content-Encoding") and encoded_length.isdigit():
+            count("bytes_received_saved", max(0, len(response.content) - int(encoded_length)))
+
+        # 尝试解析 JSON，如果失败则将响应文本作为错误信息
         try:
-            response = self.session.request(method, url, timeout=15, **kwargs)
+            json_data = response.json()
+        except requests.exceptions.JSONDecodeError:
+            # 如果响应不是 JSON (例如 Flask debug 模式下的 HTML 错误页)
+            # 将响应文本的前200个字符作为错误详情
+            json_data = {'error': response.text[:200]}
+
+        # 检查 HTTP 状态码是否表示成功 (2xx)
+        if not response.ok:
+            self._raise_for_status(response, json_data)
+
+        return json_data
+
+    def _perform(self, method: str, url: str, stream: bool = False, **kwargs) -> requests.Response:
+        """
+        发送请求，按需重试，返回最终的响应 (可能是非 2xx)。
+
+        请求体可以重放 (bytes 或无请求体) 的 POST 会自动带上 Idempotency-Key，
+        同一个逻辑请求的所有尝试使用同一个键。分块上传的生成器请求体无法重放，不会重试。
 
-            # 尝试解析 JSON，如果失败则将响应文本作为错误信息
+        Raises:
+            APIError: 网络层错误且不能 (或不再) 重试时。
+        """
+        body = kwargs.get("data")
+        replayable = body is None or isinstance(body, (bytes, str))
+        headers = dict(kwargs.pop("headers", None) or {})
+        if method not in IDEMPOTENT_METHODS and replayable:
+            headers.setdefault("Idempotency-Key", uuid.uuid4().hex)
+        kwargs["headers"] = headers
+        size = len(body) if isinstance(body, (bytes, str)) else 0
+        timeout = (CONNECT_TIMEOUT, READ_TIMEOUT + size / MIN_THROUGHPUT)
+
+        endpoint = url[len(self.base_url):]
+        start = time.perf_counter()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = self.session.request(
+                    method, url, timeout=timeout, stream=stream, **kwargs)
+            except requests.RequestException as e:
+                if not (replayable and self._can_retry(method, headers, attempt, error=e)):
+                    self.metrics.record(method, endpoint, time.perf_counter() - start, attempt, False)
+                    raise APIError(f"网络连接错误: {e}") from e
+                delay = self._backoff(attempt)
+            else:
+                count("requests")
+                count("bytes_sent", size)
+                if not (response.status_code in RETRY_STATUSES and replayable
+                        and self._can_retry(method, headers, attempt, status=response.status_code)):
+                    self.metrics.record(method, endpoint, time.perf_counter() - start,
+                                        attempt, response.ok)
+                    return response
+                delay = max(self._backoff(attempt), self._retry_after(response))
+                response.close()
+            count("retries")
+            time.sleep(delay)
+
+    def _can_retry(self, method: str, headers: dict, attempt: int,
+                   error: Optional[Exception] = None, status: Optional[int] = None) -> bool:
+        """判断一次失败的尝试能否重发。"""
+        if attempt > self.max_retries:
+            return False
+        # 连接没有建立或服务器明确表示限流时，请求一定没有被处理
+        if status == 429 or isinstance(error, requests.exceptions.ConnectTimeout) or (
+                isinstance(error, requests.exceptions.ConnectionError)
+                and isinstance(getattr(error.args[0] if error.args else None, "reason", None),
+                               urllib3.exceptions.NewConnectionError)):
+            return True
+        if method in IDEMPOTENT_METHODS:
+            return True
+        if "Idempotency-Key" not in headers:
+            return False
+        try:
+            return self.supports("idempotency-keys")
+        except APIError:
+            return False
+
+    def _backoff(self, attempt: int) -> float:
+        """带"完全抖动"的指数退避，避免大量客户端在同一时刻重试。"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+    @staticmethod
+    def _retry_after(response: requests.Response) -> float:
+        """解析 Retry-After (秒数形式)，无法解析时返回 0。"""
+        try:
+            return min(MAX_RETRY_AFTER, max(0.0, float(response.headers.get("Retry-After", 0))))
+        except ValueError:
+            return 0.0
+
+    def _raise_for_status(self, response: requests.Response, json_data: dict):
+        """把非 2xx 响应转换为对应的异常。"""
+        message = json_data.get('detail') or json_data.get(
+            'error') or "未知服务端错误"
+        if response.status_code in [401, 403]:
+            raise AuthenticationError(
+                f"认证失败: {message}", status_code=response.status_code)
+        raise APIError(
+            f"API 请求失败: {message}", status_code=response.status_code)
+
+    def _stream(self, method: str, endpoint: str, **kwargs) -> requests.Response:
+        """
+        发送一个请求并返回未读取的流式响应，用于二进制 pack 传输。
+
+        Raises:
+            AuthenticationError: 如果认证失败。
+            APIError: 如果发生其他 API 错误或网络层错误。
+        """
+        url = f"{self.base_url}/{endpoint.lstrip('/')}"
+        if kwargs.get("json") is not None:
+            kwargs = self._encode_json_body(kwargs)
+        response = self._perform(method, url, stream=True, **kwargs)
+        if not response.ok:
             try:
                 json_data = response.json()
             except requests.exceptions.JSONDecodeError:
-                # 如果响应不是 JSON (例如 Flask debug 模式下的 HTML 错误页)
-                # 将响应文本的前200个字符作为错误详情
                 json_data = {'error': response.text[:200]}
+            self._raise_for_status(response, json_data)
+        return response
 
-            # 检查 HTTP 状态码是否表示成功 (2xx)
-            if not response.ok:
-                message = json_data.get('detail') or json_data.get(
-                    'error') or "未知服务端错误"
-                if response.status_code in [401, 403]:
-                    raise AuthenticationError(
-                        f"认证失败: {message}", status_code=response.status_code)
-                else:
-                    raise APIError(
-                        f"API 请求失败: {message}", status_code=response.status_code)
+    def get_capabilities(self) -> Set[str]:
+        """查询服务器支持的协议特性；旧服务器没有该端点时返回空集合。"""
+        if self._capabilities is None:
+            try:
+                response = self._request("GET", "api/v1/capabilities")
+                self._capabilities = set(response.get("capabilities", []))
+            except AuthenticationError:
+                raise
+            except APIError as e:
+                if e.status_code != 404:
+                    raise
+                self._capabilities = set()
+        return self._capabilities
 
-            return json_data
+    def supports(self, capability: str) -> bool:
+        """服务器是否支持某个协议特性，例如 "pack-v1"。"""
+        return capability in self.get_capabilities()
 
-        except requests.RequestException as e:
-            # 处理网络连接层面的错误 (e.g., DNS, Connection Refused)
-            raise APIError(f"网络连接错误: {e}") from e
+    def stream_events(self) -> Iterator[Tuple[str, dict]]:
+        """
+        订阅当前用户所有保险库的变更事件 (需要服务器支持 "change-events")。
+
+        一个长连接复用所有保险库：先产出一个 `snapshot` 事件 ({"vaults": {id: seq}})，
+        之后每当有新版本写入产出 `change` 事件 ({"vault_id", "seq"})，空闲时产出 `ping`。
+        服务器会定期关闭连接，调用方应在生成器结束后重新订阅。
+
+        Yields:
+            Tuple[str, dict]: (事件名, 数据)。
+        """
+        with span("http.events"):
+            response = self._stream("GET", "api/v1/events",
+                                    headers={"Accept": "text/event-stream"})
+        response.encoding = "utf-8"
+        with response:
+            try:
+                yield from parse_event_stream(
+                    response.iter_lines(decode_unicode=True))
+            except (requests.RequestException, urllib3.exceptions.HTTPError) as e:
+                raise APIError(f"网络连接错误: {e}") from e
 
     # --- 认证方法 ---
     def login(self, email: str, password: str) -> str:
@@ -128,30 +450,259 @@ class APIClient:
         return self._request("DELETE", f"api/v1/vaults/{vault_id}")
 
     # --- 同步方法 ---
-    def check_sync_state(self, vault_id: str, local_versions: List[str]) -> dict:
-        """向服务器发送本地版本哈希列表，获取同步状态。"""
+    def check_sync_state(self, vault_id: str, local_versions: List[str], since_seq: Optional[int] = None,
+                         shallow_since: Optional[int] = None) -> dict:
+        """
+        向服务器发送本地版本哈希列表，获取同步状态。
+
+        Args:
+            vault_id (str): 保险库 ID。
+            local_versions (List[str]): 完整对账时为全部本地版本；
+                增量模式下只需上次同步以来新建的本地版本。
+            since_seq (Optional[int]): 上次同步时服务器的变更序号，提供时使用增量模式
+                (需要服务器支持 "sync-cursor")。
+            shallow_since (Optional[int]): 浅克隆的历史边界时间戳；完整对账时
+                不返回更早的版本 (需要服务器支持 "shallow-history")。
+
+        Returns:
+            dict: 包含 versions_to_upload、versions_to_download 和 current_seq。
+        """
         endpoint = f"api/v1/vaults/{vault_id}/sync/check"
         payload = {"local_version_hashes": local_versions}
+        if since_seq is not None:
+            payload["since_seq"] = since_seq
+        if shallow_since is not None:
+            payload["shallow_since"] = shallow_since
         return self._request("POST", endpoint, json=payload)
 
+    def get_version_window(self, vault_id: str, depth: Optional[int] = None, since: Optional[int] = None,
+                           before: Optional[int] = None) -> dict:
+        """
+        按时间倒序获取一段历史窗口内的版本 (需要服务器支持 "shallow-history")。
+
+        Args:
+            vault_id (str): 保险库 ID。
+            depth (Optional[int]): 最多返回的版本数。
+            since (Optional[int]): 只返回不早于该时间戳的版本。
+            before (Optional[int]): 只返回早于该时间戳的版本。
+
+        Returns:
+            dict: {"versions": [{"hash", "timestamp"}], "has_more": 窗口之外是否还有更早的版本,
+                "current_seq": 服务器变更序号}。
+        """
+        params = {name: value for name, value in
+                  (("depth", depth), ("since", since), ("before", before)) if value is not None}
+        return self._request("GET", f"api/v1/vaults/{vault_id}/sync/history", params=params)
+
+    def reconcile_versions(self, vault_id: str, ranges: List[Dict]) -> dict:
+        """
+        区间对账的一轮 (需要服务器支持 "reconcile-v1")，参见 k_cube_protocol.reconcile。
+
+        Args:
+            vault_id (str): 保险库 ID。
+            ranges (List[Dict]): 本地的前缀区间概括。
+
+        Returns:
+            dict: {"ranges": 服务器对每个区间的回答, "current_seq": 服务器变更序号}。
+        """
+        endpoint = f"api/v1/vaults/{vault_id}/sync/reconcile"
+        return self._request("POST", endpoint, json={"ranges": ranges})
+
+    def find_missing_blobs(self, vault_id: str, blob_hashes: List[str], batch_size: int = 1000) -> List[str]:
+        """
+        分批向服务器询问哪些 blob 尚未上传 (have/want 协商)。
+
+        Args:
+            vault_id (str): 保险库 ID。
+            blob_hashes (List[str]): 候选 blob 哈希。
+            batch_size (int): 每个请求携带的哈希数，不能超过服务器的上限。
+
+        Returns:
+            List[str]: 服务器缺少的 blob 哈希。
+        """
+        endpoint = f"api/v1/vaults/{vault_id}/sync/blobs/missing"
+        missing = []
+        for start in range(0, len(blob_hashes), batch_size):
+            batch = blob_hashes[start:start + batch_size]
+            response = self._request("POST", endpoint, json={"hashes": batch})
+            missing.extend(response.get("missing", []))
+        return missing
+
+    def get_blob_sizes(self, vault_id: str, blob_hashes: List[str], batch_size: int = 1000) -> Dict[str, int]:
+        """
+        分批查询 blob 在服务器上的存储大小 (需要服务器支持 "batch-query")。
+
+        Returns:
+            Dict[str, int]: 哈希 -> 字节数；服务器上不存在的 blob 不会出现。
+        """
+        endpoint = f"api/v1/vaults/{vault_id}/sync/blobs/sizes"
+        sizes = {}
+        for start in range(0, len(blob_hashes), batch_size):
+            batch = blob_hashes[start:start + batch_size]
+            response = self._request("POST", endpoint, json={"hashes": batch})
+            sizes.update(response.get("sizes", {}))
+        return sizes
+
     def upload_blobs(self, vault_id: str, blobs: List[Dict]):
         """批量上传文件对象 (blobs)。"""
         endpoint = f"api/v1/vaults/{vault_id}/sync/blobs"
         return self._request("POST", endpoint, json={"blobs": blobs})
 
-    def upload_versions(self, vault_id: str, versions_data: List[Dict]):
-        """批量上传版本元数据。"""
+    def upload_blob_deltas(self, vault_id: str, deltas: List[Dict]) -> dict:
+        """
+        以增量上传一批对象 (需要服务器支持 "blob-delta-v1")，参见 k_cube_protocol.delta。
+
+        Args:
+            vault_id (str): 保险库 ID。
+            deltas (List[Dict]): [{"hash": 目标哈希, "base": 服务器已有的基准哈希, "delta_b64"}]。
+
+        Returns:
+            dict: {"stored": 已写入的哈希, "rejected": 无法重建、需要上传完整对象的哈希}。
+        """
+        endpoint = f"api/v1/vaults/{vault_id}/sync/blobs/deltas"
+        return self._request("POST", endpoint, json={"deltas": deltas})
+
+    def download_blob_deltas(self, vault_id: str, pairs: Dict[str, str]) -> List[Dict]:
+        """
+        以增量下载一批对象 (需要服务器支持 "blob-delta-v1")。
+
+        Args:
+            vault_id (str): 保险库 ID。
+            pairs (Dict[str, str]): {目标哈希: 本地已有的基准哈希}。
+
+        Returns:
+            List[Dict]: [{"hash", "base", "delta_b64"}]；不在其中的对象需要完整下载。
+        """
+        endpoint = f"api/v1/vaults/{vault_id}/sync/blobs/deltas/fetch"
+        return self._request("POST", endpoint, json={"pairs": pairs}).get("deltas", [])
+
+    def upload_versions(self, vault_id: str, versions_data: List[Dict],
+                        base: Optional[Tuple[str, Dict[str, str]]] = None):
+        """
+        批量上传版本元数据。
+
+        服务器支持 "manifest-delta" 时，清单按时间顺序编码为相对前一个版本的增量。
+
+        Args:
+            vault_id (str): 保险库 ID。
+            versions_data (List[Dict]): 带有完整清单的版本数据。
+            base (Optional[Tuple[str, Dict[str, str]]]): 服务器应已存在的 (版本哈希, 清单)，
+                作为第一个版本的增量基准。服务器没有该版本时自动改为发送完整清单。
+        """
         endpoint = f"api/v1/vaults/{vault_id}/sync/versions"
-        return self._request("POST", endpoint, json={"versions": versions_data})
+        if not self.supports("manifest-delta"):
+            return self._request("POST", endpoint, json={"versions": versions_data})
+        if base is not None:
+            encoded = encode_versions(versions_data, *base)
+            try:
+                return self._request("POST", endpoint, json={"versions": encoded})
+            except APIError as e:
+                # 409：基准版本不在服务器上，去掉外部基准后重试
+                if e.status_code != 409:
+                    raise
+        return self._request("POST", endpoint, json={"versions": encode_versions(versions_data)})
 
     def download_blobs(self, vault_id: str, blob_hashes: List[str]) -> List[Dict]:
         """根据哈希列表批量下载文件对象。"""
         endpoint = f"api/v1/vaults/{vault_id}/sync/blobs"
-        response = self._request("GET", endpoint, params={"h": blob_hashes})
+        if self.supports("batch-query"):
+            # 哈希列表放在请求体中，避免超长 URL
+            response = self._request(
+                "POST", f"{endpoint}/query", json={"hashes": blob_hashes})
+        else:
+            response = self._request("GET", endpoint, params={"h": blob_hashes})
         return response.get("blobs", [])
 
+    def upload_blob_pack(self, vault_id: str, blobs: Iterable[Tuple[str, bytes]]) -> dict:
+        """
+        以二进制 pack 数据流上传 blob (需要服务器支持 "pack-v1")。
+
+        Args:
+            vault_id (str): 保险库 ID。
+            blobs (Iterable[Tuple[str, bytes]]): (哈希, 对象库内容)，可以是惰性生成器，
+                内容会边读边发送 (分块传输编码)。
+
+        Returns:
+            dict: 服务器返回的统计信息。
+        """
+        endpoint = f"api/v1/vaults/{vault_id}/sync/pack"
+
+        def counted():
+            for chunk in iter_pack(blobs):
+                count("bytes_sent", len(chunk))
+                yield chunk
+
+        return self._request("POST", endpoint, data=counted(),
+                             headers={"Content-Type": PACK_CONTENT_TYPE})
+
+    def download_blob_pack(self, vault_id: str, blob_hashes: List[str]) -> Iterator[Tuple[str, bytes]]:
+        """
+        以二进制 pack 数据流下载 blob，逐个产出已校验的 (哈希, 内容)。
+
+        Args:
+            vault_id (str): 保险库 ID。
+            blob_hashes (List[str]): 需要下载的 blob 哈希。
+
+        Yields:
+            Tuple[str, bytes]: (哈希, 对象库内容)。
+        """
+        endpoint = f"api/v1/vaults/{vault_id}/sync/pack/fetch"
+        with span("http.pack_fetch"):
+            response = self._stream("POST", endpoint, json={"hashes": blob_hashes},
+                                    headers={"Accept": PACK_CONTENT_TYPE})
+            with response:
+                try:
+                    for blob_hash, content in read_pack(response.raw):
+                        count("bytes_received", len(content))
+                        yield blob_hash, content
+                except PackError as e:
+                    raise APIError(f"服务器返回的 pack 数据无效: {e}") from e
+                except urllib3.exceptions.HTTPError as e:
+                    raise APIError(f"网络连接错误: {e}") from e
+
+    def download_snapshot(self, vault_id: str,
+                          on_version: Callable[[Dict], None]) -> Iterator[Tuple[str, bytes]]:
+        """
+        下载保险库最新版本的快照 (需要服务器支持 "snapshot-v1")。
+
+        快照是一个 pack 数据流：元数据帧在所有对象之前到达，解析后的版本数据
+        (带完整清单) 交给 `on_version`，之后逐个产出该版本引用的对象。保险库为空时什么也不产出。
+
+        Args:
+            vault_id (str): 保险库 ID。
+            on_version (Callable[[Dict], None]): 接收快照中的版本数据。
+
+        Yields:
+            Tuple[str, bytes]: (哈希, 对象库内容)。
+        """
+        endpoint = f"api/v1/vaults/{vault_id}/sync/snapshot"
+        with span("http.snapshot"):
+            response = self._stream("GET", endpoint, headers={"Accept": PACK_CONTENT_TYPE})
+            with response:
+                if response.status_code == 204:
+                    return
+                try:
+                    for blob_hash, content in read_pack(
+                            response.raw, on_meta=lambda meta: on_version(json.loads(meta)["version"])):
+                        count("bytes_received", len(content))
+                        yield blob_hash, content
+                except PackError as e:
+                    raise APIError(f"服务器返回的快照无效: {e}") from e
+                except urllib3.exceptions.HTTPError as e:
+                    raise APIError(f"网络连接错误: {e}") from e
+
     def download_versions(self, vault_id: str, version_hashes: List[str]) -> List[Dict]:
         """根据哈希列表批量下载版本元数据。"""
         endpoint = f"api/v1/vaults/{vault_id}/sync/versions"
-        response = self._request("GET", endpoint, params={"h": version_hashes})
-        return response.get("versions", [])
+        # 增量只引用同一批中的版本，还原时不需要本地数据库
+        delta = self.supports("manifest-delta")
+        if self.supports("batch-query"):
+            response = self._request(
+                "POST", f"{endpoint}/query", json={"hashes": version_hashes, "delta": delta})
+        else:
+            params = {"h": version_hashes, **({"delta": "1"} if delta else {})}
+            response = self._request("GET", endpoint, params=params)
+        try:
+            return decode_versions(response.get("versions", []), lambda h: None)
+        except MissingBaseError as e:
+            raise APIError(f"服务器返回的版本增量无效: {e}") from e
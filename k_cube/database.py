@@ -3,9 +3,11 @@
 import sqlite3
 from pathlib import Path
 import json
-from typing import Dict, Optional, Tuple, List
+from typing import Dict, Optional, Set, Tuple, List
 from typing import Optional, List, Dict, Any
 
+from .profiling import traced
+
 
 class Database:
     """
@@ -22,6 +24,7 @@ class Database:
         self.db_path = db_path
         self.conn = None
 
+    @traced("db.connect")
     def connect(self) -> None:
         """建立数据库连接。"""
         try:
@@ -52,6 +55,7 @@ class Database:
             value TEXT NOT NULL
         );
 
+        -- compressed_size 为 0 的记录表示部分克隆中尚未下载到本地的对象 (promised)
         CREATE TABLE IF NOT EXISTS blobs (
             hash TEXT PRIMARY KEY,
             uncompressed_size INTEGER NOT NULL,
@@ -98,16 +102,37 @@ class Database:
         # 初始化后可以保持连接，也可以选择关闭
         # self.close()
 
-    def get_latest_version_hash(self) -> Optional[str]:
-        """查询最新的版本哈希。"""
+    @traced("db.get_latest_version_hash")
+    def get_latest_version_hash(self, exclude: Optional[Set[str]] = None) -> Optional[str]:
+        """
+        查询最新的版本哈希。
+
+        Args:
+            exclude (Optional[Set[str]]): 跳过这些版本，例如尚未上传的版本。
+        """
+        if not self.conn:
+            self.connect()
+        cursor = self.conn.cursor()
+        if not exclude:
+            cursor.execute(
+                "SELECT hash FROM versions ORDER BY timestamp DESC LIMIT 1")
+            result = cursor.fetchone()
+            return result[0] if result else None
+        cursor.execute("SELECT hash FROM versions ORDER BY timestamp DESC")
+        return next((row[0] for row in cursor if row[0] not in exclude), None)
+
+    def get_previous_version_hash(self, timestamp: int) -> Optional[str]:
+        """查询早于给定时间戳的最新版本哈希，用作增量同步的基准。"""
         if not self.conn:
             self.connect()
         cursor = self.conn.cursor()
         cursor.execute(
-            "SELECT hash FROM versions ORDER BY timestamp DESC LIMIT 1")
+            "SELECT hash FROM versions WHERE timestamp < ? ORDER BY timestamp DESC LIMIT 1",
+            (timestamp,))
         result = cursor.fetchone()
         return result[0] if result else None
 
+    @traced("db.get_version_manifest")
     def get_version_manifest(self, version_hash: str) -> Dict[str, str]:
         """获取指定版本的文件清单 (file_path -> blob_hash)。"""
         if not self.conn:
@@ -119,25 +144,65 @@ class Database:
         )
         return {row[0]: row[1] for row in cursor.fetchall()}
 
+    @traced("db.blob_exists")
     def blob_exists(self, blob_hash: str) -> bool:
-        """检查指定的 blob 哈希是否存在。"""
+        """检查指定的 blob 是否已在本地对象库中。"""
         if not self.conn:
             self.connect()
         cursor = self.conn.cursor()
         cursor.execute(
-            "SELECT 1 FROM blobs WHERE hash = ? LIMIT 1", (blob_hash,))
+            "SELECT 1 FROM blobs WHERE hash = ? AND compressed_size > 0 LIMIT 1", (blob_hash,))
         return cursor.fetchone() is not None
 
+    @traced("db.get_blob_sizes")
+    def get_blob_sizes(self, blob_hashes: List[str]) -> Dict[str, int]:
+        """获取一组 blob 在对象库中的 (编码后的) 大小。"""
+        if not self.conn:
+            self.connect()
+        sizes = {}
+        # SQLite 对单条语句的参数个数有限制，分段查询
+        for start in range(0, len(blob_hashes), 500):
+            chunk = blob_hashes[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            cursor = self.conn.execute(
+                f"SELECT hash, compressed_size FROM blobs WHERE hash IN ({placeholders}) AND compressed_size > 0", chunk)
+            sizes.update(cursor.fetchall())
+        return sizes
+
+    @traced("db.get_version_blob_hashes")
+    def get_version_blob_hashes(self, version_hashes: List[str]) -> Set[str]:
+        """获取一组版本引用的全部 blob 哈希 (去重)。"""
+        if not self.conn:
+            self.connect()
+        blob_hashes: Set[str] = set()
+        for start in range(0, len(version_hashes), 500):
+            chunk = version_hashes[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            cursor = self.conn.execute(
+                f"SELECT DISTINCT blob_hash FROM version_files WHERE version_hash IN ({placeholders})",
+                chunk)
+            blob_hashes.update(row[0] for row in cursor.fetchall())
+        return blob_hashes
+
+    @traced("db.insert_blob")
     def insert_blob(self, blob_hash: str, uncompressed_size: int, compressed_size: int):
-        """插入一条新的 blob 记录。"""
+        """插入一条新的 blob 记录 (或补全一条 promised 记录)。"""
+        self.insert_blobs([(blob_hash, uncompressed_size, compressed_size)])
+
+    @traced("db.insert_blobs")
+    def insert_blobs(self, rows: List[Tuple[str, int, int]]):
+        """在一个事务中批量插入 blob 记录 (hash, uncompressed_size, compressed_size)。"""
         if not self.conn:
             self.connect()
         with self.conn:
-            self.conn.execute(
-                "INSERT INTO blobs (hash, uncompressed_size, compressed_size) VALUES (?, ?, ?)",
-                (blob_hash, uncompressed_size, compressed_size)
+            self.conn.executemany(
+                "INSERT INTO blobs (hash, uncompressed_size, compressed_size) VALUES (?, ?, ?) "
+                "ON CONFLICT(hash) DO UPDATE SET uncompressed_size = excluded.uncompressed_size, "
+                "compressed_size = excluded.compressed_size WHERE blobs.compressed_size = 0",
+                rows
             )
 
+    @traced("db.insert_version")
     def insert_version(self, version_hash: str, timestamp: int, message: dict, manifest: Dict[str, str]):
         """插入一个完整的新版本记录（版本信息 + 文件清单）。"""
         if not self.conn:
@@ -159,6 +224,7 @@ class Database:
                 version_files_data
             )
 
+    @traced("db.get_version_history")
     def get_version_history(self, file_path: Optional[str] = None) -> List[Dict[str, Any]]:
         """
         获取整个仓库或单个文件的版本历史。
@@ -232,6 +298,7 @@ class Database:
         result = cursor.fetchone()
         return result[0] if result else None
 
+    @traced("db.get_all_version_hashes")
     def get_all_version_hashes(self) -> List[str]:
         """获取数据库中所有版本的哈希列表。"""
         if not self.conn:
@@ -240,14 +307,46 @@ class Database:
         cursor.execute("SELECT hash FROM versions")
         return [row[0] for row in cursor.fetchall()]
 
+    def get_version_watermark(self) -> int:
+        """返回版本表当前最大的 rowid，作为本地增量同步的游标 (rowid 只增不减)。"""
+        if not self.conn:
+            self.connect()
+        row = self.conn.execute("SELECT MAX(rowid) FROM versions").fetchone()
+        return row[0] or 0
+
+    @traced("db.get_version_hashes_since")
+    def get_version_hashes_since(self, watermark: int) -> List[str]:
+        """获取 rowid 大于 `watermark` 的版本哈希，即该游标之后新增的版本。"""
+        if not self.conn:
+            self.connect()
+        cursor = self.conn.execute(
+            "SELECT hash FROM versions WHERE rowid > ? ORDER BY rowid", (watermark,))
+        return [row[0] for row in cursor.fetchall()]
+
+    @traced("db.filter_missing_versions")
+    def filter_missing_versions(self, version_hashes: List[str]) -> List[str]:
+        """从给定的版本哈希中筛选出本地尚不存在的部分，保持原有顺序。"""
+        if not self.conn:
+            self.connect()
+        existing = set()
+        for start in range(0, len(version_hashes), 500):
+            chunk = version_hashes[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            cursor = self.conn.execute(
+                f"SELECT hash FROM versions WHERE hash IN ({placeholders})", chunk)
+            existing.update(row[0] for row in cursor.fetchall())
+        return [h for h in version_hashes if h not in existing]
+
+    @traced("db.get_all_blob_hashes")
     def get_all_blob_hashes(self) -> List[str]:
-        """获取数据库中所有 blob 的哈希列表。"""
+        """获取本地对象库中所有 blob 的哈希列表 (不含 promised 记录)。"""
         if not self.conn:
             self.connect()
         cursor = self.conn.cursor()
-        cursor.execute("SELECT hash FROM blobs")
+        cursor.execute("SELECT hash FROM blobs WHERE compressed_size > 0")
         return [row[0] for row in cursor.fetchall()]
 
+    @traced("db.get_version_data")
     def get_version_data(self, version_hash: str) -> Optional[Dict[str, Any]]:
         """获取单个版本的完整数据，用于上传。"""
         if not self.conn:
@@ -271,8 +370,16 @@ class Database:
             "manifest": manifest
         }
 
-    def bulk_insert_versions(self, versions_data: List[Dict]):
-        """批量插入从服务器下载的版本数据。"""
+    @traced("db.bulk_insert_versions")
+    def bulk_insert_versions(self, versions_data: List[Dict], promised: bool = False):
+        """
+        批量插入从服务器下载的版本数据。
+
+        Args:
+            versions_data (List[Dict]): 带有完整清单的版本数据。
+            promised (bool): 部分克隆时为 True：为本地还没有的对象插入 promised 记录，
+                这些对象在需要时再从远程下载。
+        """
         if not self.conn:
             self.connect()
 
@@ -290,6 +397,10 @@ class Database:
                 )
 
         with self.conn:
+            if promised:
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO blobs (hash, uncompressed_size, compressed_size) VALUES (?, 0, 0)",
+                    {(row[2],) for row in version_files_to_insert})
             self.conn.executemany(
                 "INSERT OR IGNORE INTO versions (hash, timestamp, message_json, author) VALUES (?, ?, ?, ?)",
                 versions_to_insert
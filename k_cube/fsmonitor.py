@@ -0,0 +1,136 @@
+# k_cube/fsmonitor.py
+
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Set, Tuple
+
+# 脏路径日志文件：由守护进程的文件监控器追加写入
+JOURNAL_FILE = "dirty.journal"
+# 监控器写心跳的间隔，以及读取方认为日志“仍然有效”的最长静默时间 (秒)
+HEARTBEAT_INTERVAL = 2.0
+HEARTBEAT_TIMEOUT = 10.0
+
+_SESSION_PREFIX = "#session "
+
+
+@dataclass
+class JournalSnapshot:
+    """读取方在某一时刻看到的日志状态。"""
+    session: str
+    size: int
+
+
+class DirtyJournal:
+    """
+    保险库的“脏路径”日志，类似于 Git 的 fsmonitor 集成。
+
+    日志格式为纯文本，第一行是会话标识 (`#session <token>`)，
+    之后每行一个相对路径；以 '/' 结尾的行表示整个目录都需要重新扫描。
+
+    写入方 (守护进程) 在每次启动监控时创建一个新会话，并定期刷新文件的
+    修改时间作为心跳；停止监控时删除日志。读取方 (`Repository.get_status`)
+    只有在会话存活且心跳未超时时才信任日志，否则回退到全量扫描。
+    """
+
+    def __init__(self, kcube_path: Path):
+        self.path = kcube_path / JOURNAL_FILE
+        self._lock = threading.Lock()
+        self._last_heartbeat = 0.0
+
+    # --- 写入方 (守护进程) ---
+
+    def start(self) -> str:
+        """开始一个新的监控会话，丢弃之前的所有记录。"""
+        session = uuid.uuid4().hex
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'w', encoding='utf-8') as f:
+                f.write(f"{_SESSION_PREFIX}{session}\n")
+            self._last_heartbeat = time.time()
+        return session
+
+    def record(self, relative_path: str, is_dir: bool = False) -> None:
+        """追加一条脏路径记录。"""
+        relative_path = relative_path.replace('\\', '/').strip('/')
+        if not relative_path or '\n' in relative_path:
+            return
+        line = f"{relative_path}/\n" if is_dir else f"{relative_path}\n"
+        with self._lock:
+            try:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+                self._last_heartbeat = time.time()
+            except OSError:
+                pass
+
+    def heartbeat(self) -> None:
+        """刷新日志的修改时间，向读取方表明监控器仍在运行。"""
+        now = time.time()
+        if now - self._last_heartbeat < HEARTBEAT_INTERVAL:
+            return
+        with self._lock:
+            try:
+                os.utime(self.path, None)
+                self._last_heartbeat = now
+            except OSError:
+                pass
+
+    def stop(self) -> None:
+        """结束监控会话。删除日志后，读取方会回退到全量扫描。"""
+        with self._lock:
+            try:
+                self.path.unlink()
+            except OSError:
+                pass
+
+    # --- 读取方 (Repository) ---
+
+    def snapshot(self) -> Optional[JournalSnapshot]:
+        """
+        获取当前日志的会话标识和大小。
+
+        Returns:
+            Optional[JournalSnapshot]: 如果日志不存在、格式错误或心跳超时，返回 None。
+        """
+        try:
+            stat = self.path.stat()
+            if time.time() - stat.st_mtime > HEARTBEAT_TIMEOUT:
+                return None
+            with open(self.path, 'rb') as f:
+                header = f.readline().decode('utf-8', errors='replace')
+                size = os.fstat(f.fileno()).st_size
+        except OSError:
+            return None
+
+        if not header.startswith(_SESSION_PREFIX) or not header.endswith('\n'):
+            return None
+        return JournalSnapshot(session=header[len(_SESSION_PREFIX):].strip(), size=size)
+
+    def read_paths(self, start: int, end: int) -> Tuple[Set[str], int]:
+        """
+        读取日志中 [start, end) 字节区间内记录的脏路径。
+
+        `start` 为 0 时会跳过会话头。只处理完整的行，
+        写入方尚未写完的最后一行留给下一次读取。
+
+        Returns:
+            Tuple[Set[str], int]: 脏路径集合，以及下一次读取应开始的偏移量。
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(start)
+                data = f.read(max(0, end - start))
+        except OSError:
+            return set(), start
+
+        last_newline = data.rfind(b'\n')
+        if last_newline < 0:
+            return set(), start
+        lines = data[:last_newline].decode('utf-8', errors='replace').split('\n')
+        if start == 0:
+            lines = lines[1:]
+        return {line for line in lines if line}, start + last_newline + 1
@@ -0,0 +1,385 @@
+# k_cube/local_remote.py
+
+"""
+文件系统远程 (file://)：把保险库同步到本机目录、NAS 挂载点或 U 盘，不需要 k-cube-server。
+
+`LocalRemote` 实现了 Synchronizer 使用的 APIClient 接口，直接读写一个裸保险库目录：
+
+    <根目录>/kcube-remote.json                 远程格式标记
+    <根目录>/<保险库 ID>/vault.json             名称和创建时间
+    <根目录>/<保险库 ID>/objects/ab/cdef…       对象 (与本地对象库相同的编码和布局)
+    <根目录>/<保险库 ID>/versions/<哈希>.json   版本数据 (含完整清单)
+    <根目录>/<保险库 ID>/changes.log            每行 "<版本哈希> <时间戳>"，按写入顺序排列，行号即变更序号
+
+对象布局与本地对象库相同，传输对象只需在两个目录之间创建硬链接；跨文件系统时退回到
+shutil.copyfile (Linux 上由内核直接复制，数据不经过 Python)。所有文件都先写入临时文件再原子重命名，
+追加 changes.log 时持有锁文件，多台设备共用同一个目录也不会分配出重复的序号。
+"""
+
+import base64
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+
+from .client import APIClient, APIError, RequestMetrics
+from .profiling import count, span
+
+SCHEME = "file://"
+# 对象可以直接在两个对象库目录之间链接或复制 (见 Synchronizer)
+LOCAL_OBJECTS_CAPABILITY = "local-objects"
+FORMAT_VERSION = 1
+# 等待锁文件的时间上限 (秒)；超过 STALE_LOCK_SECONDS 的锁视为崩溃遗留，直接清除
+LOCK_TIMEOUT = 30
+STALE_LOCK_SECONDS = 600
+
+
+def is_local_remote(remote_url: Optional[str]) -> bool:
+    """远程地址是否为文件系统远程 (file://)。"""
+    return bool(remote_url) and remote_url.startswith(SCHEME)
+
+
+def open_remote(remote_url: str, api_token: Optional[str] = None, **kwargs):
+    """
+    按远程地址创建客户端。
+
+    Args:
+        remote_url (str): http(s):// 服务器地址或 file:// 目录。
+        api_token (Optional[str]): 服务器的 API token；文件系统远程不需要。
+        **kwargs: 传给 APIClient 的其他参数。
+
+    Returns:
+        Union[APIClient, LocalRemote]: 对应的客户端。
+    """
+    if is_local_remote(remote_url):
+        return LocalRemote(remote_url)
+    return APIClient(remote_url, api_token, **kwargs)
+
+
+def _write_file(path: Path, data: bytes):
+    """先写临时文件再原子替换。"""
+    tmp_path = path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _link_or_copy(source: Path, target: Path):
+    """把不可变的对象文件放到另一个对象库中：优先硬链接，跨文件系统时复制。"""
+    target.parent.mkdir(exist_ok=True)
+    tmp_path = target.with_name(f"{target.name}.{uuid.uuid4().hex}.tmp")
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+class LocalRemote:
+    """
+    以本地目录作为远程仓库的客户端，接口与 APIClient 相同 (参见模块说明)。
+
+    只声明目录布局能够高效实现的协议特性；区间对账、增量清单、压缩等面向网络的特性
+    在这里没有意义，Synchronizer 会自动使用对应的基本接口。
+    """
+
+    CAPABILITIES = frozenset({
+        "blob-negotiation", "batch-query", "sync-cursor", "shallow-history",
+        LOCAL_OBJECTS_CAPABILITY,
+    })
+
+    def __init__(self, remote_url: str):
+        self.base_url = remote_url
+        parsed = urlparse(remote_url)
+        path = url2pathname(parsed.path)
+        # file://server/share 形式的 UNC 路径
+        self.root = Path(f"//{parsed.netloc}{path}" if parsed.netloc else path)
+        self.pool_size = 1
+        self.metrics = RequestMetrics()
+
+    def set_pool_size(self, pool_size: int):
+        """本地文件访问没有连接池，什么也不做。"""
+        pass
+
+    def get_capabilities(self) -> Set[str]:
+        return set(self.CAPABILITIES)
+
+    def supports(self, capability: str) -> bool:
+        return capability in self.CAPABILITIES
+
+    # --- 保险库管理 ---
+
+    def login(self, email: str, password: str) -> str:
+        raise APIError("文件系统远程不需要登录。")
+
+    def create_vault(self, name: str, vault_id: Optional[str] = None) -> dict:
+        """在远程目录中创建一个空的裸保险库。"""
+        marker = self.root / "kcube-remote.json"
+        if not marker.exists():
+            self.root.mkdir(parents=True, exist_ok=True)
+            _write_file(marker, json.dumps({"format": FORMAT_VERSION}).encode('utf-8'))
+        vault_id = vault_id or str(uuid.uuid4())
+        vault_path = self.root / vault_id
+        if (vault_path / "vault.json").exists():
+            raise APIError(f"保险库 {vault_id} 已存在。", 409)
+        (vault_path / "objects").mkdir(parents=True, exist_ok=True)
+        (vault_path / "versions").mkdir(exist_ok=True)
+        info = {"id": vault_id, "name": name, "created_at": int(time.time())}
+        _write_file(vault_path / "vault.json", json.dumps(info, ensure_ascii=False).encode('utf-8'))
+        return info
+
+    def list_vaults(self) -> List[Dict]:
+        if not self.root.is_dir():
+            return []
+        vaults = []
+        for info_path in self.root.glob("*/vault.json"):
+            with open(info_path, 'r', encoding='utf-8') as f:
+                vaults.append(json.load(f))
+        return sorted(vaults, key=lambda v: v.get("created_at", 0))
+
+    def get_vault_details(self, vault_id: str) -> dict:
+        with open(self._vault(vault_id) / "vault.json", 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def delete_vault(self, vault_id: str):
+        shutil.rmtree(self._vault(vault_id))
+        return {"status": "成功"}
+
+    def _vault(self, vault_id: str) -> Path:
+        """返回保险库目录；不存在时按服务器的语义引发 404。"""
+        if not vault_id or Path(vault_id).name != vault_id:
+            raise APIError("保险库未找到或无权访问", 404)
+        vault_path = self.root / vault_id
+        if not (vault_path / "vault.json").is_file():
+            raise APIError("保险库未找到或无权访问", 404)
+        return vault_path
+
+    @contextmanager
+    def _lock(self, vault_path: Path):
+        """独占地修改 changes.log (锁文件在共享目录上同样有效)。"""
+        lock_path = vault_path / "lock"
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - lock_path.stat().st_mtime > STALE_LOCK_SECONDS:
+                        lock_path.unlink()
+                        continue
+                except FileNotFoundError:
+                    continue
+                if time.monotonic() > deadline:
+                    raise APIError(f"远程目录被锁定: {lock_path}", 423)
+                time.sleep(0.05)
+        try:
+            yield
+        finally:
+            os.close(fd)
+            lock_path.unlink(missing_ok=True)
+
+    # --- 版本 ---
+
+    def _changes(self, vault_path: Path) -> List[Tuple[str, int]]:
+        """读取按写入顺序排列的 (版本哈希, 时间戳)。"""
+        entries = []
+        try:
+            with open(vault_path / "changes.log", 'r', encoding='ascii') as f:
+                for line in f:
+                    parts = line.split()
+                    # 中断的写入可能留下不完整的行
+                    if len(parts) == 2 and len(parts[0]) == 64 and parts[1].isdigit():
+                        entries.append((parts[0], int(parts[1])))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def check_sync_state(self, vault_id: str, local_versions: List[str], since_seq: Optional[int] = None,
+                         shallow_since: Optional[int] = None) -> dict:
+        """与服务器的 /sync/check 语义相同。"""
+        changes = self._changes(self._vault(vault_id))
+        local = set(local_versions)
+        remote = {h for h, _ in changes}
+        if since_seq is not None:
+            if not isinstance(since_seq, int) or since_seq < 0 or since_seq > len(changes):
+                return {"full_reconcile_required": True, "current_seq": len(changes)}
+            to_download = [h for h, _ in changes[since_seq:] if h not in local]
+        else:
+            to_download = [h for h, ts in changes
+                           if h not in local and (shallow_since is None or ts >= shallow_since)]
+        return {"versions_to_upload": list(local - remote),
+                "versions_to_download": to_download,
+                "current_seq": len(changes)}
+
+    def get_version_window(self, vault_id: str, depth: Optional[int] = None, since: Optional[int] = None,
+                           before: Optional[int] = None) -> dict:
+        """与服务器的 /sync/history 语义相同。"""
+        changes = self._changes(self._vault(vault_id))
+        rows = sorted(((h, ts) for h, ts in changes
+                       if (since is None or ts >= since) and (before is None or ts < before)),
+                      key=lambda row: (-row[1], row[0]))
+        if depth:
+            rows = rows[:depth]
+        boundary = rows[-1][1] if rows else (before if before is not None else since)
+        has_more = boundary is not None and any(ts < boundary for _, ts in changes)
+        return {"versions": [{"hash": h, "timestamp": ts} for h, ts in rows],
+                "has_more": has_more, "current_seq": len(changes)}
+
+    def reconcile_versions(self, vault_id: str, ranges: List[Dict]) -> dict:
+        raise APIError("文件系统远程不支持区间对账。", 404)
+
+    def upload_versions(self, vault_id: str, versions_data: List[Dict],
+                        base: Optional[Tuple[str, Dict[str, str]]] = None):
+        """写入版本数据并追加到 changes.log；已有的版本被忽略。`base` 只对服务器有意义。"""
+        vault_path = self._vault(vault_id)
+        with span("local.upload_versions"), self._lock(vault_path):
+            changes = self._changes(vault_path)
+            known = {h for h, _ in changes}
+            lines = []
+            for version in sorted(versions_data, key=lambda v: v['timestamp']):
+                if version['hash'] in known:
+                    continue
+                known.add(version['hash'])
+                _write_file(vault_path / "versions" / f"{version['hash']}.json",
+                            json.dumps(version, ensure_ascii=False).encode('utf-8'))
+                lines.append(f"{version['hash']} {int(version['timestamp'])}\n")
+            if lines:
+                log_path = vault_path / "changes.log"
+                with open(log_path, 'a+b') as f:
+                    data = "".join(lines).encode('ascii')
+                    # 上一次写入被中断时，先补上换行，避免新行接在残缺的行后面
+                    if f.seek(0, os.SEEK_END):
+                        f.seek(-1, os.SEEK_END)
+                        if f.read(1) != b"\n":
+                            data = b"\n" + data
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+        return {"status": "成功", "current_seq": len(changes) + len(lines)}
+
+    def download_versions(self, vault_id: str, version_hashes: List[str]) -> List[Dict]:
+        vault_path = self._vault(vault_id)
+        versions = []
+        for v_hash in version_hashes:
+            try:
+                with open(vault_path / "versions" / f"{v_hash}.json", 'r', encoding='utf-8') as f:
+                    versions.append(json.load(f))
+            except FileNotFoundError:
+                continue
+        return versions
+
+    # --- 对象 ---
+
+    @staticmethod
+    def _object_path(vault_path: Path, blob_hash: str) -> Path:
+        return vault_path / "objects" / blob_hash[:2] / blob_hash[2:]
+
+    def _store(self, vault_path: Path, blob_hash: str, content: bytes) -> bool:
+        """校验并写入一个对象；已存在时返回 False。"""
+        if hashlib.sha256(content).hexdigest() != blob_hash:
+            raise APIError(f"对象 {blob_hash[:8]} 校验失败。", 400)
+        path = self._object_path(vault_path, blob_hash)
+        if path.exists():
+            return False
+        path.parent.mkdir(exist_ok=True)
+        _write_file(path, content)
+        return True
+
+    def find_missing_blobs(self, vault_id: str, blob_hashes: List[str], batch_size: int = 1000) -> List[str]:
+        vault_path = self._vault(vault_id)
+        return [h for h in blob_hashes if not self._object_path(vault_path, h).exists()]
+
+    def get_blob_sizes(self, vault_id: str, blob_hashes: List[str], batch_size: int = 1000) -> Dict[str, int]:
+        vault_path = self._vault(vault_id)
+        sizes = {}
+        for blob_hash in blob_hashes:
+            try:
+                sizes[blob_hash] = self._object_path(vault_path, blob_hash).stat().st_size
+            except FileNotFoundError:
+                continue
+        return sizes
+
+    def upload_blobs(self, vault_id: str, blobs: List[Dict]):
+        vault_path = self._vault(vault_id)
+        for blob in blobs:
+            self._store(vault_path, blob['hash'], base64.b64decode(blob['content_b64']))
+        return {"status": "成功"}
+
+    def upload_blob_pack(self, vault_id: str, blobs: Iterable[Tuple[str, bytes]]) -> dict:
+        vault_path = self._vault(vault_id)
+        received = stored = 0
+        for blob_hash, content in blobs:
+            received += 1
+            stored += self._store(vault_path, blob_hash, content)
+        return {"status": "成功", "received": received, "stored": stored}
+
+    def download_blob_pack(self, vault_id: str, blob_hashes: List[str]) -> Iterator[Tuple[str, bytes]]:
+        vault_path = self._vault(vault_id)
+        for blob_hash in blob_hashes:
+            path = self._object_path(vault_path, blob_hash)
+            if path.exists():
+                content = path.read_bytes()
+                count("bytes_received", len(content))
+                yield blob_hash, content
+
+    def download_blobs(self, vault_id: str, blob_hashes: List[str]) -> List[Dict]:
+        return [{"hash": blob_hash, "content_b64": base64.b64encode(content).decode('ascii')}
+                for blob_hash, content in self.download_blob_pack(vault_id, blob_hashes)]
+
+    def import_objects(self, vault_id: str, source_dir: Path, blob_hashes: List[str]) -> List[Tuple[str, int]]:
+        """
+        把本地对象库中的对象链接或复制到远程 (需要 "local-objects")。
+
+        Args:
+            vault_id (str): 保险库 ID。
+            source_dir (Path): 本地对象库目录 (.kcube/versions)。
+            blob_hashes (List[str]): 要传输的对象。
+
+        Returns:
+            List[Tuple[str, int]]: 实际传输的 (哈希, 字节数)；本地缺少的对象被跳过。
+        """
+        vault_path = self._vault(vault_id)
+        copied = []
+        with span("local.import_objects", blobs=len(blob_hashes)):
+            for blob_hash in blob_hashes:
+                source = source_dir / blob_hash[:2] / blob_hash[2:]
+                if not source.is_file():
+                    continue
+                target = self._object_path(vault_path, blob_hash)
+                if not target.exists():
+                    _link_or_copy(source, target)
+                size = source.stat().st_size
+                count("bytes_sent", size)
+                copied.append((blob_hash, size))
+        return copied
+
+    def export_objects(self, vault_id: str, blob_hashes: List[str], target_dir: Path) -> List[str]:
+        """
+        把远程对象链接或复制到本地对象库 (需要 "local-objects")。调用方负责校验并登记这些对象。
+
+        Returns:
+            List[str]: 已放入本地对象库的哈希；远程缺少的对象被跳过。
+        """
+        vault_path = self._vault(vault_id)
+        exported = []
+        with span("local.export_objects", blobs=len(blob_hashes)):
+            for blob_hash in blob_hashes:
+                source = self._object_path(vault_path, blob_hash)
+                if not source.is_file():
+                    continue
+                target = target_dir / blob_hash[:2] / blob_hash[2:]
+                if not target.exists():
+                    _link_or_copy(source, target)
+                count("bytes_received", source.stat().st_size)
+                exported.append(blob_hash)
+        return exported
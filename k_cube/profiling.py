@@ -0,0 +1,235 @@
+# k_cube/profiling.py
+
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+
+@dataclass
+class Span:
+    """一段被计时的操作，可以嵌套子 Span 并携带计数器 (如字节数、文件数)。"""
+    name: str
+    start: float
+    end: Optional[float] = None
+    thread_id: int = 0
+    counters: Dict[str, float] = field(default_factory=dict)
+    children: List['Span'] = field(default_factory=list)
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "seconds": round(self.duration, 6),
+            "counters": dict(self.counters),
+            "children": [child.to_dict() for child in self.children],
+        }
+
+
+class Profiler:
+    """
+    轻量级的计时器，记录一棵 Span 树。
+
+    未启用时 `span()` 几乎没有开销，因此可以常驻在 Repository、Database、
+    Synchronizer 和 APIClient 的关键路径上。
+
+    有两种启用方式：
+    - `enable()`：进程级，`kv --profile` 使用，所有线程的 Span 都挂在同一个根下；
+    - `capture()`：只记录当前线程 (以及通过 `attach()` 加入的工作线程)，
+      守护进程里多个保险库并发同步时互不干扰。
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.root: Optional[Span] = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def enable(self, name: str = "kv") -> None:
+        """开始进程级记录，创建一个新的根 Span。"""
+        self.root = Span(name=name, start=time.perf_counter(),
+                         thread_id=threading.get_ident())
+        self._local = threading.local()
+        self.enabled = True
+
+    def disable(self) -> Optional[Span]:
+        """停止进程级记录并返回完整的 Span 树。"""
+        self.enabled = False
+        if self.root is not None and self.root.end is None:
+            self.root.end = time.perf_counter()
+        return self.root
+
+    def _stack(self) -> Optional[List[Span]]:
+        stack = getattr(self._local, "stack", None)
+        if stack is None and self.enabled:
+            stack = self._local.stack = [self.root]
+        return stack
+
+    def current(self) -> Optional[Span]:
+        """返回当前线程正在记录的 Span；未在记录时返回 None。"""
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    @contextmanager
+    def capture(self, name: str, **counters):
+        """
+        记录一段操作并产出它的 Span，即使进程级记录未启用。
+
+        已经处于记录状态时，它等同于一个普通的 `span()`。
+        """
+        if self._stack():
+            with self.span(name, **counters) as current:
+                yield current
+            return
+
+        root = Span(name=name, start=time.perf_counter(),
+                    thread_id=threading.get_ident(), counters=dict(counters))
+        self._local.stack = [root]
+        try:
+            yield root
+        finally:
+            root.end = time.perf_counter()
+            self._local.stack = None
+
+    @contextmanager
+    def attach(self, parent: Optional[Span]):
+        """让工作线程中的 Span 挂到另一个线程的 `parent` 下。"""
+        if parent is None:
+            yield
+            return
+        previous = getattr(self._local, "stack", None)
+        self._local.stack = [parent]
+        try:
+            yield
+        finally:
+            self._local.stack = previous
+
+    @contextmanager
+    def span(self, name: str, **counters):
+        """
+        记录一段操作的耗时。
+
+        Args:
+            name (str): Span 名称，建议使用 `模块.操作` 的形式，如 `repo.status`。
+            **counters: 初始计数器。
+        """
+        stack = self._stack()
+        if not stack:
+            yield None
+            return
+
+        current = Span(name=name, start=time.perf_counter(),
+                       thread_id=threading.get_ident(), counters=dict(counters))
+        with self._lock:
+            stack[-1].children.append(current)
+        stack.append(current)
+        try:
+            yield current
+        finally:
+            current.end = time.perf_counter()
+            stack.pop()
+
+    def count(self, name: str, value: float = 1) -> None:
+        """在当前 Span 上累加一个计数器。"""
+        stack = self._stack()
+        if not stack:
+            return
+        current = stack[-1]
+        with self._lock:
+            current.counters[name] = current.counters.get(name, 0) + value
+
+    def summary(self) -> Optional[dict]:
+        """以可序列化的字典形式返回当前 Span 树。"""
+        return self.root.to_dict() if self.root is not None else None
+
+    def to_chrome_trace(self, root: Optional[Span] = None) -> dict:
+        """
+        导出为 Chrome Trace Event 格式，可在 chrome://tracing 或 Perfetto 中查看。
+
+        Args:
+            root (Optional[Span]): 要导出的 Span 树，默认为进程级的根。
+        """
+        root = root or self.root
+        events = []
+        if root is None:
+            return {"traceEvents": events}
+        origin = root.start
+
+        def visit(node: Span):
+            events.append({
+                "name": node.name,
+                "ph": "X",
+                "ts": round((node.start - origin) * 1e6, 3),
+                "dur": round(node.duration * 1e6, 3),
+                "pid": 1,
+                "tid": node.thread_id,
+                "args": dict(node.counters),
+            })
+            for child in node.children:
+                visit(child)
+
+        visit(root)
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+# 进程内共享的 Profiler 实例
+profiler = Profiler()
+span = profiler.span
+count = profiler.count
+
+
+def traced(name: str):
+    """装饰器：把整个函数调用记录为一个 Span。"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profiler.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render_span_tree(node: dict, min_seconds: float = 0.0) -> str:
+    """
+    把 `Span.to_dict()` 的结果渲染为缩进的文本树，同名的兄弟 Span 会被合并。
+
+    Args:
+        node (dict): Span 字典。
+        min_seconds (float): 低于该耗时的子树不显示。
+
+    Returns:
+        str: 多行文本。
+    """
+    lines: List[str] = []
+
+    def merge(children: List[dict]) -> List[dict]:
+        merged: Dict[str, dict] = {}
+        for child in children:
+            entry = merged.setdefault(child["name"], {
+                "name": child["name"], "seconds": 0.0, "calls": 0,
+                "counters": {}, "children": []})
+            entry["seconds"] += child["seconds"]
+            entry["calls"] += 1
+            for key, value in child["counters"].items():
+                entry["counters"][key] = entry["counters"].get(key, 0) + value
+            entry["children"].extend(child["children"])
+        return list(merged.values())
+
+    def visit(entry: dict, depth: int):
+        calls = f" x{entry['calls']}" if entry.get("calls", 1) > 1 else ""
+        counters = ", ".join(
+            f"{k}={v:g}" for k, v in sorted(entry["counters"].items()))
+        suffix = f"  [{counters}]" if counters else ""
+        lines.append(
+            f"{'  ' * depth}{entry['name']}{calls}: {entry['seconds'] * 1000:.1f} ms{suffix}")
+        for child in merge(entry["children"]):
+            if child["seconds"] >= min_seconds:
+                visit(child, depth + 1)
+
+    visit(dict(node, calls=1), 0)
+    return "\n".join(lines)
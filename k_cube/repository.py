@@ -1,6 +1,7 @@
 # k_cube/repository.py
 
 import json
+import os
 from pathlib import Path
 from typing import Optional
 
@@ -9,14 +10,16 @@ from .utils import KCUBE_DIR, find_vault_root
 
 import time
 from dataclasses import dataclass, field
-from typing import Dict, List, Set, Tuple
+from typing import Callable, Dict, Iterable, List, Set, Tuple
 
-from .utils import compress_blob, hash_blob, KCUBE_DIR
+from .utils import compress_blob, encode_blob, hash_blob, KCUBE_DIR
 
 import shutil
-from .utils import decompress_blob
+from .utils import decompress_blob, decoded_size, get_console, STORED_MAGIC
 
 from .config import ConfigManager  # <--- 确保导入 ConfigManager
+from .fsmonitor import DirtyJournal
+from .profiling import span, count
 
 # 使用 dataclass 来定义一个清晰的数据结构，用于表示仓库状态
 
@@ -53,10 +56,27 @@ class Repository:
         self.versions_path = self.kcube_path / "versions"
         self.db = Database(self.db_path)
         self.staging_path = self.kcube_path / "staging.json"
+        self.scan_cache_path = self.kcube_path / "scan_cache.json"
         # --- 新增 ---
         local_config_path = self.kcube_path / "config.json"
         self.config = ConfigManager(local_config_path)
         self.vault_id = self.config.get("vault_id")
+        # 部分克隆中用于补齐缺失对象的回调 (参见 Synchronizer.fetch_blobs)，
+        # 接收一组 blob 哈希，把它们下载并写入对象库
+        self.promisor: Optional[Callable[[List[str]], None]] = None
+
+    @property
+    def shallow(self) -> Optional[dict]:
+        """
+        浅克隆的历史边界 {"boundary": 本地最早的版本哈希, "timestamp": 其时间戳}；
+        本地拥有完整历史时为 None。
+        """
+        return self.config.get("shallow") or None
+
+    @property
+    def is_partial(self) -> bool:
+        """是否为部分克隆：对象库中可能缺少历史版本的对象，需要时从 promisor 远程获取。"""
+        return bool(self.config.get("promisor"))
 
     def _read_staging_area(self) -> Dict[str, str]:
         """读取暂存区内容。"""
@@ -114,6 +134,10 @@ class Repository:
         return cls(path)
 
     def get_status(self) -> VaultStatus:
+        with span("repo.status"):
+            return self._compute_status()
+
+    def _compute_status(self) -> VaultStatus:
         status = VaultStatus()
 
         # 1. 获取三个核心状态的清单 (manifest)
@@ -126,19 +150,7 @@ class Repository:
         staged_manifest = self._read_staging_area()
 
         # 工作区 (Working Directory)
-        work_tree_files: Dict[str, str] = {}
-        for file_path in self.vault_path.rglob('*'):
-            # 忽略 .kcube 目录和非文件项
-            if KCUBE_DIR in file_path.parts or not file_path.is_file():
-                continue
-
-            relative_path_str = str(file_path.relative_to(
-                self.vault_path)).replace('\\', '/')
-            with open(file_path, 'rb') as f:
-                # 注意：这里我们只计算内容的哈希，压缩和写入对象库是 `add` 的职责
-                content = f.read()
-            blob_hash = hash_blob(compress_blob(content))  # 保持与add一致的哈希计算
-            work_tree_files[relative_path_str] = blob_hash
+        work_tree_files = self._scan_work_tree()
 
         # 2. 对比“暂存区” vs “最新提交”，找出 staged changes
         staged_vs_last_paths = set(
@@ -155,17 +167,22 @@ class Repository:
                 else:  # 哈希不同
                     status.staged_modified.append(path)
 
-        # 3. 对比“工作区” vs “暂存区”，找出 unstaged changes
+        # 3. 对比“工作区” vs “暂存区”，找出 unstaged changes。
+        #    提交后暂存区被清空，未暂存的路径以最新提交中的内容为准
+        index_manifest = dict(last_manifest)
+        index_manifest.update(staged_manifest)
         work_vs_staged_paths = set(
-            work_tree_files.keys()) | set(staged_manifest.keys())
+            work_tree_files.keys()) | set(index_manifest.keys())
         for path in sorted(list(work_vs_staged_paths)):
             work_hash = work_tree_files.get(path)
-            staged_hash = staged_manifest.get(path)
+            staged_hash = index_manifest.get(path)
 
             if not work_hash and staged_hash and staged_hash != "_DELETED_":
                 # 在暂存区存在，但在工作区被删了
                 status.unstaged_deleted.append(path)
             elif work_hash and staged_hash and staged_hash != "_DELETED_" and work_hash != staged_hash:
+                if self._matches_legacy_hash(self.vault_path / path, staged_hash):
+                    continue
                 # 在暂存区和工作区都存在，但内容不同 (被修改)
                 status.unstaged_modified.append(path)
 
@@ -177,13 +194,138 @@ class Repository:
 
         return status
 
+    def _hash_work_file(self, file_path: Path) -> str:
+        """计算工作区文件的 blob 哈希，与 `add` 写入对象库时的哈希保持一致。"""
+        with open(file_path, 'rb') as f:
+            # 注意：这里我们只计算内容的哈希，写入对象库是 `add` 的职责
+            content = f.read()
+        count("files_hashed")
+        count("bytes_hashed", len(content))
+        return hash_blob(self._encode(file_path, content))
+
+    def _encode(self, file_path: Path, content: bytes) -> bytes:
+        """按文件路径和内容选择编码方式 (stored 或 zlib)，返回写入对象库的字节。"""
+        return encode_blob(content, file_path.name)
+
+    def _matches_legacy_hash(self, file_path: Path, known_hash: str) -> bool:
+        """
+        检查一个文件是否与旧版本 (所有对象都用 zlib 编码) 记录的哈希一致。
+
+        引入 stored 编码之前提交的附件，其哈希是对 zlib 压缩结果计算的。
+        只有当前选择了 stored 编码、且哈希不一致时才需要做这次额外的压缩。
+        """
+        if not file_path.is_file():
+            return False
+        content = file_path.read_bytes()
+        encoded = self._encode(file_path, content)
+        if not encoded.startswith(STORED_MAGIC):
+            return False
+        return hash_blob(compress_blob(content)) == known_hash
+
+    def _full_scan(self, root: Optional[Path] = None) -> Dict[str, str]:
+        """遍历工作区 (或其中一个子目录)，计算所有文件的 blob 哈希。"""
+        with span("repo.walk", full=1):
+            return self._walk(root)
+
+    def _walk(self, root: Optional[Path] = None) -> Dict[str, str]:
+        work_tree_files: Dict[str, str] = {}
+        for file_path in (root or self.vault_path).rglob('*'):
+            # 忽略 .kcube 目录和非文件项
+            if KCUBE_DIR in file_path.relative_to(self.vault_path).parts or not file_path.is_file():
+                continue
+            relative_path_str = str(file_path.relative_to(
+                self.vault_path)).replace('\\', '/')
+            work_tree_files[relative_path_str] = self._hash_work_file(file_path)
+        return work_tree_files
+
+    def _scan_work_tree(self) -> Dict[str, str]:
+        """
+        获取工作区的文件清单 (file_path -> blob_hash)。
+
+        如果守护进程正在维护脏路径日志，并且上一次扫描结果属于同一个监控会话，
+        则只重新检查日志中新记录的路径；否则回退到全量扫描。
+        """
+        journal = DirtyJournal(self.kcube_path)
+        snapshot = journal.snapshot()
+        if snapshot is None:
+            self.scan_cache_path.unlink(missing_ok=True)
+            return self._full_scan()
+
+        cache = self._read_scan_cache()
+        if cache.get("session") == snapshot.session and cache.get("offset", 0) <= snapshot.size:
+            dirty_paths, offset = journal.read_paths(
+                cache["offset"], snapshot.size)
+            work_tree_files = cache["files"]
+            count("journal_paths", len(dirty_paths))
+            for dirty in sorted(dirty_paths):
+                if KCUBE_DIR in Path(dirty).parts:
+                    continue
+                if dirty.endswith('/'):
+                    # 目录级事件 (移动/删除)：丢弃该前缀下的缓存并重新扫描子树
+                    for path in [p for p in work_tree_files if p.startswith(dirty)]:
+                        del work_tree_files[path]
+                    dir_path = self.vault_path / dirty
+                    if dir_path.is_dir():
+                        work_tree_files.update(self._full_scan(dir_path))
+                    continue
+                file_path = self.vault_path / dirty
+                if file_path.is_file():
+                    work_tree_files[dirty] = self._hash_work_file(file_path)
+                else:
+                    work_tree_files.pop(dirty, None)
+        else:
+            # 先记下日志位置再扫描：扫描期间发生的变更会在下一次被重新检查
+            _, offset = journal.read_paths(0, snapshot.size)
+            work_tree_files = self._full_scan()
+
+        self._write_scan_cache(
+            {"session": snapshot.session, "offset": offset, "files": work_tree_files})
+        return work_tree_files
+
+    def _read_scan_cache(self) -> dict:
+        """读取上一次工作区扫描的结果。"""
+        if not self.scan_cache_path.exists():
+            return {}
+        try:
+            with open(self.scan_cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (json.JSONDecodeError, IOError):
+            return {}
+
+    def _write_scan_cache(self, cache: dict):
+        """写入工作区扫描结果，供下一次 `get_status` 增量使用。"""
+        try:
+            with open(self.scan_cache_path, 'w', encoding='utf-8') as f:
+                json.dump(cache, f)
+        except IOError:
+            pass
+
     def add(self, paths_to_add: List[Path]):
         """
         将指定路径的变更添加到暂存区。
         该方法能正确处理文件、目录、新增、修改和删除操作，并提供详细输出。
         """
-        from rich.console import Console
-        console = Console()
+        with span("repo.add"):
+            self._add(paths_to_add)
+
+    def add_from_status(self, status: VaultStatus) -> bool:
+        """
+        只暂存 `status` 中报告的未暂存变更，而不是重新哈希整个工作区。
+
+        适合先调用 `get_status()` 判断是否有变更、再自动提交的场景 (例如守护进程)，
+        一个周期内只需一次扫描。
+
+        Returns:
+            bool: 是否有路径被暂存。
+        """
+        paths = status.unstaged_modified + status.unstaged_deleted + status.untracked_files
+        if not paths:
+            return False
+        self.add([self.vault_path / p for p in paths])
+        return True
+
+    def _add(self, paths_to_add: List[Path]):
+        console = get_console()
 
         staging_data = self._read_staging_area()
 
@@ -271,11 +413,20 @@ class Repository:
 
             with open(file_path_abs, 'rb') as f:
                 content = f.read()
+            count("files_hashed")
+            count("bytes_hashed", len(content))
 
-            compressed = compress_blob(content)
-            blob_hash = hash_blob(compressed)
+            encoded = self._encode(file_path_abs, content)
+            blob_hash = hash_blob(encoded)
 
             current_staged_hash = staging_data.get(relative_path_str)
+            known_hash = current_staged_hash or last_manifest.get(relative_path_str)
+            if (known_hash and known_hash != blob_hash
+                    and encoded.startswith(STORED_MAGIC)
+                    and hash_blob(compress_blob(content)) == known_hash
+                    and self.db.blob_exists(known_hash)):
+                # 内容未变，只是旧版本用 zlib 编码了它：沿用已有对象，不产生伪修改
+                blob_hash = known_hash
 
             # 判断是新增还是修改
             is_new = relative_path_str not in all_tracked_files
@@ -290,7 +441,7 @@ class Repository:
 
                 staging_data[relative_path_str] = blob_hash
                 if not self.db.blob_exists(blob_hash):
-                    self._write_blob(blob_hash, compressed, is_compressed=True)
+                    self._write_blob(blob_hash, encoded, is_compressed=True)
 
         # 4. 将更新后的暂存区数据写回文件
         self._write_staging_area(staging_data)
@@ -300,6 +451,10 @@ class Repository:
         将暂存区的内容固化为一个新版本。
         这个方法现在能正确处理新增、修改和删除操作。
         """
+        with span("repo.commit"):
+            self._commit(message)
+
+    def _commit(self, message: dict):
         staged_changes = self._read_staging_area()
         if not staged_changes:
             print("暂存区为空，没有需要提交的内容。")
@@ -344,8 +499,7 @@ class Repository:
         # 5. 清空暂存区，为下一次 `add` 做准备
         self._write_staging_area({})
 
-        from rich.console import Console
-        console = Console()
+        console = get_console()
         console.print(
             f"✅ [bold green]新版本提交成功！[/bold green] 版本号: [cyan]{version_hash[:12]}[/cyan]")
 
@@ -365,10 +519,11 @@ class Repository:
             raise ValueError(f"版本前缀 '{version_prefix}' 不明确或不存在。")
 
         # 2. 根据是恢复单个文件还是整个版本，分发任务
-        if file_path:
-            self._restore_single_file(file_path, full_version_hash)
-        else:
-            self._restore_full_vault(full_version_hash, hard_mode)
+        with span("repo.restore"):
+            if file_path:
+                self._restore_single_file(file_path, full_version_hash)
+            else:
+                self._restore_full_vault(full_version_hash, hard_mode)
 
     def _restore_single_file(self, relative_path: Path, version_hash: str):
         """恢复单个文件到指定版本。"""
@@ -393,6 +548,7 @@ class Repository:
     def _restore_full_vault(self, version_hash: str, hard_mode: bool):
         """恢复整个保险库到指定版本。"""
         target_manifest = self.db.get_version_manifest(version_hash)
+        self._ensure_blobs(target_manifest.values())
 
         # 1. 获取当前工作区所有已追踪的文件
         #    “已追踪”的定义是：存在于上一个版本或暂存区中的文件
@@ -442,6 +598,7 @@ class Repository:
 
     def _restore_version(self, version_hash: str, hard_mode: bool):
         target_manifest = self.db.get_version_manifest(version_hash)
+        self._ensure_blobs(target_manifest.values())
 
         # 1. 恢复/更新版本中存在的文件
         for path_str, blob_hash in target_manifest.items():
@@ -519,6 +676,10 @@ class Repository:
         )
         parent_hash_result = parent_hash_cursor.fetchone()
         parent_hash = parent_hash_result[0] if parent_hash_result else None
+        if parent_hash is None and self.shallow is not None:
+            # 浅克隆边界上的版本：父版本存在于远程但不在本地，无法计算它引入的更改
+            raise ValueError(
+                f"版本 {target_hash[:8]} 位于浅克隆的历史边界，其父版本不在本地。请先运行 `kv fetch --deepen`。")
 
         target_manifest = self.db.get_version_manifest(target_hash)
         parent_manifest = self.db.get_version_manifest(
@@ -565,13 +726,38 @@ class Repository:
                                revert_message, new_manifest)
         print(f"已创建 Revert 提交: {version_hash}")
 
+    def _ensure_blobs(self, blob_hashes: Iterable[str]):
+        """
+        部分克隆中，在读取一组对象之前把本地缺少的对象一次性批量下载。
+
+        不是部分克隆或所有对象都已在本地时什么也不做。
+        """
+        if self.promisor is None:
+            return
+        blob_hashes = sorted(set(blob_hashes))
+        missing = set(blob_hashes) - set(self.db.get_blob_sizes(blob_hashes))
+        if missing:
+            with span("repo.fetch_promised", blobs=len(missing)):
+                self.promisor(sorted(missing))
+
     def _read_blob(self, blob_hash: str, compressed: bool = False) -> bytes:
-        """从对象库读取一个 blob。"""
+        """
+        从对象库读取一个 blob。
+
+        部分克隆中本地缺少的对象会先从 promisor 远程下载；
+        需要读取多个对象时，调用方应先用 `_ensure_blobs` 批量下载。
+        """
         blob_path = self.versions_path / blob_hash[:2] / blob_hash[2:]
+        if not blob_path.exists() and self.promisor is not None:
+            self._ensure_blobs([blob_hash])
         if not blob_path.exists():
+            if self.is_partial:
+                raise IOError(f"找不到 blob {blob_hash}：这是一个部分克隆，需要连接远程才能获取该对象")
             raise IOError(f"数据损坏：找不到 blob 文件 {blob_hash}")
 
         content = blob_path.read_bytes()
+        count("blobs_read")
+        count("bytes_read", len(content))
 
         if compressed:
             return content
@@ -582,19 +768,72 @@ class Repository:
         if self.db.blob_exists(blob_hash):
             return  # Blob 已存在，无需写入
 
+        final_content = content if is_compressed else encode_blob(content)
+
+        self._store_object(blob_hash, final_content)
+        count("blobs_written")
+        count("bytes_written", len(final_content))
+
+        # 注意：写入 blob 时，通常也需要更新数据库记录
+        # stored 编码的对象无需解压即可得到原始大小
+        uncompressed_size = decoded_size(
+            final_content) if is_compressed else len(content)
+        compressed_size = len(final_content)
+
+        self.db.insert_blob(blob_hash, uncompressed_size, compressed_size)
+
+    def _write_blobs(self, blobs: List[Tuple[str, bytes]]):
+        """
+        批量写入一组已编码的 blob (例如同步下载的一个批次)。
+
+        与逐个调用 `_write_blob` 相比，数据库记录在一个事务中提交。
+        """
+        existing = self.db.get_blob_sizes([b_hash for b_hash, _ in blobs])
+        rows = []
+        for blob_hash, content in blobs:
+            if blob_hash in existing:
+                continue
+            self._store_object(blob_hash, content)
+            count("blobs_written")
+            count("bytes_written", len(content))
+            rows.append((blob_hash, decoded_size(content), len(content)))
+            existing[blob_hash] = len(content)
+        self.db.insert_blobs(rows)
+
+    def _store_object(self, blob_hash: str, content: bytes):
+        """
+        把编码后的内容写入对象库。
+
+        先写临时文件再重命名，中断时对象库中不会留下内容不完整的对象文件。
+        """
         blob_dir = self.versions_path / blob_hash[:2]
         blob_dir.mkdir(exist_ok=True)
         blob_file = blob_dir / blob_hash[2:]
+        tmp_file = blob_dir / f"{blob_hash[2:]}.tmp"
+        tmp_file.write_bytes(content)
+        os.replace(tmp_file, blob_file)
 
-        final_content = content if is_compressed else compress_blob(content)
+    def _adopt_orphan_blobs(self, blob_hashes: List[str]) -> List[str]:
+        """
+        找回已经写入对象库、但还没有登记到数据库的 blob (例如同步在写入后被中断)。
 
-        blob_file.write_bytes(final_content)
+        对象文件的内容会按哈希校验，校验失败的文件被删除，之后照常重新下载。
 
-        # 注意：写入 blob 时，通常也需要更新数据库记录
-        # 这里假设下载的 blob 已经在服务器端计算好了大小
-        # 在一个完整的实现中，我们可能需要解压来获取 uncompressed_size
-        uncompressed_size = len(decompress_blob(
-            final_content)) if is_compressed else len(content)
-        compressed_size = len(final_content)
+        Args:
+            blob_hashes (List[str]): 数据库中不存在的 blob 哈希。
 
-        self.db.insert_blob(blob_hash, uncompressed_size, compressed_size)
+        Returns:
+            List[str]: 校验通过并已登记的哈希。
+        """
+        rows = []
+        for blob_hash in blob_hashes:
+            blob_file = self.versions_path / blob_hash[:2] / blob_hash[2:]
+            if not blob_file.is_file():
+                continue
+            content = blob_file.read_bytes()
+            if hash_blob(content) != blob_hash:
+                blob_file.unlink()
+                continue
+            rows.append((blob_hash, decoded_size(content), len(content)))
+        self.db.insert_blobs(rows)
+        return [row[0] for row in rows]
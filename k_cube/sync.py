@@ -1,19 +1,64 @@
 import base64
+import itertools
+import json
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from rich.console import Console
 from rich.progress import Progress
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional, Union
 import logging
+from k_cube_protocol.delta import DeltaError, apply_delta, make_delta
+from k_cube_protocol.pack import VERSION as PACK_VERSION
+from k_cube_protocol.reconcile import reconcile
 from .repository import Repository
 from .client import APIClient, APIError
+from .local_remote import LOCAL_OBJECTS_CAPABILITY
+from .profiling import profiler, span
+from .sync_journal import SyncJournal, plan_key
+from .sync_log import SyncLog
 
 log = logging.getLogger(__name__)
 
+# 服务器在 capabilities 中声明的特性名：二进制 pack 传输、请求体中的哈希查询
+PACK_CAPABILITY = f"pack-v{PACK_VERSION}"
+NEGOTIATION_CAPABILITY = "blob-negotiation"
+BATCH_QUERY_CAPABILITY = "batch-query"
+CURSOR_CAPABILITY = "sync-cursor"
+RECONCILE_CAPABILITY = "reconcile-v1"
+SHALLOW_CAPABILITY = "shallow-history"
+SNAPSHOT_CAPABILITY = "snapshot-v1"
+DELTA_CAPABILITY = "blob-delta-v1"
+
+# 计入同步各阶段耗时的 Span (SyncResult.phase_seconds)
+PHASE_SPANS = {"sync.plan": "negotiate", "sync.push": "upload", "sync.pull": "download"}
+
 
 @dataclass
 class SyncResult:
     """封装同步操作的结果。"""
     versions_uploaded: int = 0
     versions_downloaded: int = 0
+    # 推送阶段实际上传的 blob 数量和字节数 (编码后的对象大小)
+    blobs_uploaded: int = 0
+    bytes_uploaded: int = 0
+    # 以增量 (参见 k_cube_protocol.delta) 传输的对象数，以及相对传输完整对象节省的字节数
+    blobs_delta_uploaded: int = 0
+    blobs_delta_downloaded: int = 0
+    bytes_saved_by_delta: int = 0
+    # 拉取阶段下载的完整对象数 (不含以增量下载的对象)
+    blobs_downloaded: int = 0
+    # 网络流量：原始 (压缩前) 字节数和实际传输的字节数，取自 Span 树中的计数器
+    bytes_sent: int = 0
+    bytes_sent_compressed: int = 0
+    bytes_received: int = 0
+    bytes_received_compressed: int = 0
+    requests: int = 0
+    retries: int = 0
+    # 各阶段耗时 (秒)：negotiate、upload、download，以及检出工作区的调用方填写的 restore
+    phase_seconds: Dict[str, float] = field(default_factory=dict)
+    # 本次同步的计时 Span 树 (参见 k_cube.profiling)，供 CLI 与守护进程展示
+    profile: Optional[dict] = None
 
     @property
     def has_changes(self) -> bool:
@@ -30,28 +75,395 @@ class SyncResult:
         else:
             return "none"
 
+    @property
+    def seconds(self) -> float:
+        return sum(self.phase_seconds.values())
+
+    @property
+    def throughput(self) -> Optional[float]:
+        """传输阶段 (上传与下载) 的平均吞吐量 (字节/秒)；没有传输数据时为 None。"""
+        transferred = self.bytes_sent_compressed + self.bytes_received_compressed
+        elapsed = self.phase_seconds.get("upload", 0) + self.phase_seconds.get("download", 0)
+        if not transferred or elapsed <= 0:
+            return None
+        return transferred / elapsed
+
+    def collect_telemetry(self, *trees: Optional[dict]):
+        """从 Span 树 (计划与执行各一棵) 中汇总流量计数器和各阶段耗时。"""
+        counters: Dict[str, float] = {}
+
+        def walk(node):
+            for key, value in node["counters"].items():
+                counters[key] = counters.get(key, 0) + value
+            phase = PHASE_SPANS.get(node["name"])
+            if phase:
+                self.phase_seconds[phase] = self.phase_seconds.get(phase, 0) + node["seconds"]
+            for child in node["children"]:
+                walk(child)
+
+        for tree in trees:
+            if tree:
+                walk(tree)
+        self.bytes_sent_compressed = int(counters.get("bytes_sent", 0))
+        self.bytes_sent = self.bytes_sent_compressed + int(counters.get("bytes_sent_saved", 0))
+        self.bytes_received = int(counters.get("bytes_received", 0))
+        self.bytes_received_compressed = self.bytes_received - int(counters.get("bytes_received_saved", 0))
+        self.requests = int(counters.get("requests", 0))
+        self.retries = int(counters.get("retries", 0))
+
+    def telemetry(self) -> Dict:
+        """一条可序列化的同步记录 (写入 .kcube/sync_log.jsonl)。"""
+        entry = {k: v for k, v in asdict(self).items() if k != "profile"}
+        entry["phase_seconds"] = {k: round(v, 4) for k, v in self.phase_seconds.items()}
+        entry.update(timestamp=int(time.time()), direction=self.direction,
+                     seconds=round(self.seconds, 4), throughput=self.throughput)
+        return entry
+
+
+@dataclass
+class SyncPlan:
+    """
+    一次协商的结果：本周期要上传和下载哪些版本。
+
+    由 `Synchronizer.plan()` 生成，交给 `Synchronizer.execute()` 执行。
+    CLI 和守护进程可以在执行之前用它展示方向、数量和预计的传输量。
+    """
+    versions_to_upload: List[str] = field(default_factory=list)
+    versions_to_download: List[str] = field(default_factory=list)
+    # 预计上传的字节数：待上传版本引用、而服务器上最近一个已同步版本没有引用的对象大小之和。
+    # 真正上传的对象由执行时的 have/want 协商决定，通常不会更多
+    estimated_upload_bytes: int = 0
+    # 执行成功后保存的同步游标
+    cursor: Optional[dict] = None
+    # 协商过程的 Span 树，执行后汇总到 SyncResult 的统计中
+    profile: Optional[dict] = None
+
+    @property
+    def has_changes(self) -> bool:
+        return bool(self.versions_to_upload or self.versions_to_download)
+
+    @property
+    def direction(self) -> str:
+        if self.versions_to_upload and self.versions_to_download:
+            return "bidirectional"
+        elif self.versions_to_upload:
+            return "upload"
+        elif self.versions_to_download:
+            return "download"
+        else:
+            return "none"
+
+    def describe(self) -> str:
+        """面向用户的一句话概要，例如 "上传 2 个版本 (约 1.5 MiB)，下载 1 个版本"。"""
+        parts = []
+        if self.versions_to_upload:
+            size = f" (约 {format_bytes(self.estimated_upload_bytes)})" if self.estimated_upload_bytes else ""
+            parts.append(f"上传 {len(self.versions_to_upload)} 个版本{size}")
+        if self.versions_to_download:
+            parts.append(f"下载 {len(self.versions_to_download)} 个版本")
+        return "，".join(parts) or "已是最新"
+
+
+@dataclass
+class TransferEstimate:
+    """
+    `kv sync --dry-run` 的结果：按计划执行时每个方向要传输的版本、对象和字节数。
+
+    字节数是对象库中编码后的大小 (上传取本地 blobs 表，下载取服务器报告的大小)，
+    没有计入增量传输和请求压缩的节省，因此是一个上限。
+    """
+    versions_to_upload: int = 0
+    versions_to_download: int = 0
+    blobs_to_upload: int = 0
+    blobs_to_download: int = 0
+    upload_bytes: int = 0
+    download_bytes: int = 0
+    # 服务器没有报告大小的待下载对象数 (旧服务器不支持 "batch-query")
+    unknown_sizes: int = 0
+    # 同步记录中最近几次同步的吞吐量 (字节/秒)，用于估算耗时
+    throughput: Optional[float] = None
+
+    @property
+    def total_bytes(self) -> int:
+        return self.upload_bytes + self.download_bytes
+
+    @property
+    def estimated_seconds(self) -> Optional[float]:
+        """按最近的吞吐量估算的传输时间；没有历史记录时为 None。"""
+        if not self.throughput:
+            return None
+        return self.total_bytes / self.throughput
+
+
+def format_bytes(size: float) -> str:
+    """把字节数格式化为易读的字符串。"""
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
 
 class Synchronizer:
     """
     负责执行本地与远程仓库之间的同步操作。
     """
 
-    def __init__(self, repo: Repository, api_client: APIClient):
+    # 单个上传/下载请求的大小上限：避免触及服务器的请求体限制和客户端的超时
+    max_batch_bytes = 8 * 1024 * 1024
+    max_batch_blobs = 500
+    max_batch_versions = 200
+    # 单个增量请求携带的对象数 (与服务器的 MAX_DELTAS_PER_REQUEST 一致)
+    max_batch_deltas = 100
+    # 同时进行的上传/下载批次数；可以通过保险库配置 "sync_concurrency" 覆盖
+    concurrency = 4
+    # 同步成功后把统计追加到 .kcube/sync_log.jsonl；之后还要检出工作区的调用方
+    # (守护进程) 关闭它，补上 restore 阶段的耗时后自行记录
+    record_log = True
+
+    def __init__(self, repo: Repository, api_client: APIClient, concurrency: Optional[int] = None,
+                 full_reconcile: bool = False):
         self.repo = repo
         self.client = api_client
+        self.concurrency = max(1, int(concurrency or repo.config.get(
+            "sync_concurrency") or self.concurrency))
+        # 为 True 时忽略保存的游标，发送全部本地版本与服务器完整对账
+        self.full_reconcile = full_reconcile
+        self._next_cursor: Optional[dict] = None
+        # 部分克隆 (配置中记录了 promisor 远程) 只下载最新版本的对象，
+        # 其余对象在检出时由仓库通过 `fetch_blobs` 按需下载
+        self.partial = repo.is_partial
+        if self.partial:
+            repo.promisor = self.fetch_blobs
 
-    def sync(self) -> SyncResult:
+    def sync(self, plan: Optional[SyncPlan] = None) -> SyncResult:
         """
         执行一个完整的双向同步周期，并返回详细结果。
+
+        Args:
+            plan (Optional[SyncPlan]): 调用方已经通过 `plan()` 得到的计划；为空时在此处协商。
         """
         log.info("🔄 开始同步...")
 
+        if plan is None:
+            plan = self.plan()
+        with profiler.capture("sync") as root:
+            result = self._execute(plan)
+        result.profile = root.to_dict()
+        result.collect_telemetry(plan.profile, result.profile)
+        if self.record_log:
+            SyncLog(self.repo.kcube_path).append(result.telemetry())
+        return result
+
+    def execute(self, plan: SyncPlan) -> SyncResult:
+        """执行 `plan()` 得到的计划，不再与服务器重新协商。"""
+        return self.sync(plan)
+
+    def plan(self) -> SyncPlan:
+        """
+        与服务器协商本次需要上传和下载的版本 (每个周期只协商一次)。
+
+        保存了同步游标且服务器支持 "sync-cursor" 时只交换游标之后的变更；
+        没有游标、游标失效或要求完整对账时，执行完整对账。
+
+        Returns:
+            SyncPlan: 同步计划。
+        """
+        with profiler.capture("sync.plan") as root:
+            # 能力查询在启动工作线程之前完成，之后只读
+            self.client.get_capabilities()
+            db = self.repo.db
+            watermark = db.get_version_watermark()
+            cursor = self._load_cursor()
+
+            sync_state = None
+            if cursor is not None:
+                sync_state = self.client.check_sync_state(
+                    self.repo.vault_id, db.get_version_hashes_since(cursor["local_watermark"]),
+                    since_seq=cursor["remote_seq"])
+                if sync_state.get("full_reconcile_required"):
+                    log.info("  - 同步游标已失效，执行完整对账")
+                    sync_state = None
+            if sync_state is None:
+                sync_state = self._full_reconcile()
+
+            plan = SyncPlan(
+                versions_to_upload=list(sync_state.get('versions_to_upload', [])),
+                # 游标之后的服务器版本中可能包含本机刚上传的版本，本地已有的无需下载
+                versions_to_download=db.filter_missing_versions(
+                    sync_state.get('versions_to_download', [])))
+            if plan.versions_to_upload:
+                plan.estimated_upload_bytes = self._estimate_upload_bytes(
+                    plan.versions_to_upload)
+            if "current_seq" in sync_state:
+                plan.cursor = {"vault_id": self.repo.vault_id,
+                               "remote_seq": sync_state["current_seq"],
+                               "local_watermark": watermark}
+        plan.profile = root.to_dict()
+        return plan
+
+    def estimate(self, plan: SyncPlan) -> TransferEstimate:
+        """
+        只协商、不传输：计算执行 `plan` 需要传输的对象和字节数 (`kv sync --dry-run`)。
+
+        会向服务器查询缺少的对象、下载待拉取版本的元数据和对象大小，
+        但不会写入本地仓库或服务器，也不会推进同步游标。
+
+        Args:
+            plan (SyncPlan): `plan()` 得到的计划。
+
+        Returns:
+            TransferEstimate: 各方向的传输量和按最近吞吐量估算的耗时。
+        """
+        db = self.repo.db
+        estimate = TransferEstimate(versions_to_upload=len(plan.versions_to_upload),
+                                    versions_to_download=len(plan.versions_to_download),
+                                    throughput=SyncLog(self.repo.kcube_path).recent_throughput())
+        with span("sync.estimate"):
+            if plan.versions_to_upload:
+                blob_hashes = sorted(db.get_version_blob_hashes(plan.versions_to_upload))
+                missing = self._find_missing_blobs(blob_hashes)
+                estimate.blobs_to_upload = len(missing)
+                estimate.upload_bytes = sum(db.get_blob_sizes(missing).values())
+            if plan.versions_to_download:
+                versions_data = self._download_versions(plan.versions_to_download)
+                needed = self._blobs_needed(versions_data)
+                missing = sorted(needed - set(db.get_blob_sizes(sorted(needed))))
+                sizes = {}
+                if missing and self.client.supports(BATCH_QUERY_CAPABILITY):
+                    sizes = self.client.get_blob_sizes(self.repo.vault_id, missing)
+                estimate.blobs_to_download = len(missing)
+                estimate.download_bytes = sum(sizes.values())
+                estimate.unknown_sizes = len(missing) - len(sizes)
+        return estimate
+
+    def _estimate_upload_bytes(self, version_hashes: List[str]) -> int:
+        """估算上传量：只统计服务器上最近一个已同步版本中没有的对象。"""
+        db = self.repo.db
+        blob_hashes = db.get_version_blob_hashes(version_hashes)
+        synced = db.get_latest_version_hash(exclude=set(version_hashes))
+        if synced is not None:
+            blob_hashes -= set(db.get_version_manifest(synced).values())
+        return sum(db.get_blob_sizes(sorted(blob_hashes)).values())
+
+    def _full_reconcile(self) -> dict:
+        """
+        完整对账。服务器支持 "reconcile-v1" 时使用区间对账，
+        传输量与差异大小成正比；否则发送全部本地版本哈希。
+        """
         local_versions = self.repo.db.get_all_version_hashes()
-        sync_state = self.client.check_sync_state(
-            self.repo.vault_id, local_versions)
+        shallow = self.repo.shallow
+        if shallow is not None:
+            # 浅克隆：区间对账无法排除边界之前的版本，由服务器按时间过滤
+            return self.client.check_sync_state(
+                self.repo.vault_id, local_versions, shallow_since=shallow["timestamp"])
+        if not self.client.supports(RECONCILE_CAPABILITY):
+            return self.client.check_sync_state(self.repo.vault_id, local_versions)
+
+        seqs = []
+
+        def exchange(ranges):
+            response = self.client.reconcile_versions(self.repo.vault_id, ranges)
+            # 游标取第一轮时的序号：对账期间新写入的版本会在下一次增量检查中出现
+            seqs.append(response.get("current_seq"))
+            return response.get("ranges", [])
+
+        with span("sync.reconcile"):
+            only_local, only_remote, rounds = reconcile(local_versions, exchange)
+        log.info(f"  - 区间对账完成，共 {rounds} 次请求")
+        return {"versions_to_upload": sorted(only_local),
+                "versions_to_download": sorted(only_remote),
+                "current_seq": seqs[0]}
+
+    def fetch_snapshot(self) -> Optional[str]:
+        """
+        为新克隆的保险库下载最新版本的快照：一次请求得到版本清单和它引用的全部对象，
+        检出后工作区即可使用，其余历史再由普通同步补齐。
+
+        Returns:
+            Optional[str]: 快照中的版本哈希；服务器不支持快照或保险库为空时返回 None。
+        """
+        if not self.client.supports(SNAPSHOT_CAPABILITY):
+            return None
+        received = []
+        batch = []
+        with span("sync.snapshot"):
+            for blob in self.client.download_snapshot(self.repo.vault_id, received.append):
+                batch.append(blob)
+                if len(batch) >= self.max_batch_blobs:
+                    self.repo._write_blobs(batch)
+                    batch = []
+            self.repo._write_blobs(batch)
+            if not received:
+                return None
+            # 与拉取相同：对象全部落盘之后才写入版本
+            self.repo.db.bulk_insert_versions(received)
+        return received[0]["hash"]
+
+    def fetch_history(self, depth: Optional[int] = None, since: Optional[int] = None,
+                      deepen: Optional[int] = None) -> int:
+        """
+        下载一段历史窗口内的版本，并更新本地的浅克隆边界。
+
+        `kv clone --depth/--since` 用它只获取最近的历史；`deepen` 在现有边界之前
+        再获取若干个版本 (`kv fetch --deepen`)。服务器报告窗口之外没有更早的版本时，
+        本地拥有完整历史，不再是浅克隆。
+
+        Args:
+            depth (Optional[int]): 最多获取的版本数。
+            since (Optional[int]): 只获取不早于该时间戳的版本。
+            deepen (Optional[int]): 在当前边界之前再获取的版本数。
+
+        Returns:
+            int: 新下载的版本数。
+
+        Raises:
+            APIError: 服务器不支持 "shallow-history"。
+        """
+        if not self.client.supports(SHALLOW_CAPABILITY):
+            raise APIError("服务器不支持浅克隆 (shallow-history)。")
+        before = None
+        if deepen is not None:
+            shallow = self.repo.shallow
+            if shallow is None:
+                return 0
+            before, depth = shallow["timestamp"], deepen
+
+        window = self.client.get_version_window(
+            self.repo.vault_id, depth=depth, since=since, before=before)
+        versions = window.get("versions", [])
+        missing = self.repo.db.filter_missing_versions([v["hash"] for v in versions])
+        if missing:
+            self.client.set_pool_size(self.concurrency)
+            with span("sync.pull", versions=len(missing)):
+                self._pull_changes(missing)
+
+        if not window.get("has_more"):
+            self.repo.config.set("shallow", None)
+        elif versions:
+            oldest = versions[-1]
+            self.repo.config.set("shallow", {"boundary": oldest["hash"], "timestamp": oldest["timestamp"]})
+        elif before is None:
+            # 窗口为空 (例如 --since 晚于所有版本)：边界就是请求的起始时间
+            self.repo.config.set("shallow", {"boundary": None, "timestamp": since})
+        return len(missing)
 
-        versions_to_upload = sync_state.get('versions_to_upload', [])
-        versions_to_download = sync_state.get('versions_to_download', [])
+    def _load_cursor(self) -> Optional[dict]:
+        """读取上次成功同步时保存的游标；不适用时返回 None。"""
+        if self.full_reconcile or not self.client.supports(CURSOR_CAPABILITY):
+            return None
+        cursor = self.repo.config.get("sync_cursor")
+        if not cursor or cursor.get("vault_id") != self.repo.vault_id:
+            return None
+        return cursor
+
+    def _execute(self, plan: SyncPlan) -> SyncResult:
+        # 连接池不小于并发数
+        self.client.set_pool_size(self.concurrency)
+        self._next_cursor = dict(plan.cursor) if plan.cursor else None
+
+        versions_to_upload = plan.versions_to_upload
+        versions_to_download = plan.versions_to_download
 
         result = SyncResult(
             versions_uploaded=len(versions_to_upload),
@@ -61,11 +473,17 @@ class Synchronizer:
         if versions_to_upload:
             log.info(
                 f"  - [yellow]正在上传 {result.versions_uploaded} 个版本...[/yellow]")
-            self._push_changes(versions_to_upload)
+            with span("sync.push", versions=len(versions_to_upload)):
+                self._push_changes(versions_to_upload, result)
         if versions_to_download:
             log.info(
                 f"  - [green]正在下载 {result.versions_downloaded} 个版本...[/green]")
-            self._pull_changes(versions_to_download)
+            with span("sync.pull", versions=len(versions_to_download)):
+                self._pull_changes(versions_to_download, result)
+
+        # 只有整个周期成功后才推进游标；中途失败时下次仍从旧游标开始
+        if self._next_cursor is not None:
+            self.repo.config.set("sync_cursor", self._next_cursor)
 
         if not result.has_changes:
             log.info("[bold green]✅ 你的知识库已经是最新的了！[/bold green]")
@@ -74,7 +492,7 @@ class Synchronizer:
 
         return result
 
-    def _push_changes(self, version_hashes: list):
+    def _push_changes(self, version_hashes: list, result: SyncResult):
         """处理上传逻辑。"""
         log.info("\n[bold yellow]⬆️ 正在上传本地变更...[/bold yellow]")
 
@@ -88,73 +506,425 @@ class Synchronizer:
                 versions_data_to_upload.append(v_data)
                 blobs_to_upload_hashes.update(v_data['manifest'].values())
 
-        # b. 筛选出远程不存在的 blob
-        local_blob_hashes = set(self.repo.db.get_all_blob_hashes())
-        # (在真实场景中，check_sync_state 也应返回需要上传的blob哈希)
-        # 为简化，我们这里假设上传所有相关 blob
+        # b. 与服务器协商，筛选出远程不存在的 blob。
+        #    如果上一次针对同一组版本的上传被中断，直接沿用当时的计划，跳过已完成的批次
+        journal = SyncJournal(self.repo.kcube_path, "push")
+        key = plan_key(self.repo.vault_id, version_hashes)
+        plan = journal.load(key)
+        if plan is not None:
+            done = journal.completed()
+            missing_hashes = [h for h in plan["missing"] if h not in done]
+            log.info(f"  - 继续上一次中断的上传，剩余 {len(missing_hashes)} 个对象")
+        else:
+            with span("sync.find_missing", candidates=len(blobs_to_upload_hashes)):
+                missing_hashes = self._find_missing_blobs(sorted(blobs_to_upload_hashes))
+            journal.begin(key, vault_id=self.repo.vault_id, missing=missing_hashes)
 
-        # c. 准备并上传 blob 数据
-        blobs_payload = []
-        for b_hash in blobs_to_upload_hashes:
-            try:
-                # 注意: 我们需要发送原始（解压后）的内容，或者让服务器知道是压缩的。
-                # 为简单起见，我们发送 base64 编码的压缩后内容。
-                compressed_content = self.repo._read_blob(
-                    b_hash, compressed=True)
-                encoded_content = base64.b64encode(
-                    compressed_content).decode('ascii')
-                blobs_payload.append(
-                    {"hash": b_hash, "content_b64": encoded_content})
-            except IOError as e:
-                log.info(f"[red]错误：无法读取 blob {b_hash[:8]}: {e}[/red]")
+        # c. 服务器已有同一路径的上一个修订时，先尝试以增量上传；服务器无法重建的对象照常完整上传
+        if missing_hashes and self.client.supports(DELTA_CAPABILITY):
+            bases = self._delta_bases(versions_data_to_upload, set(missing_hashes))
+            if bases:
+                with span("sync.push_deltas", candidates=len(bases)):
+                    sent = self._upload_deltas(bases, result)
+                journal.mark_done(sorted(sent))
+                missing_hashes = [h for h in missing_hashes if h not in sent]
 
-        if blobs_payload:
+        # d. 按字节数和数量分批上传 blob：服务器支持时使用二进制 pack 流，否则回退到 JSON
+        if missing_hashes:
+            sizes = self.repo.db.get_blob_sizes(missing_hashes)
+            batches = list(make_batches(missing_hashes, sizes,
+                                        self.max_batch_bytes, self.max_batch_blobs))
+            if self.client.supports(LOCAL_OBJECTS_CAPABILITY):
+                upload = self._upload_local
+            elif self.client.supports(PACK_CAPABILITY):
+                upload = self._upload_pack
+            else:
+                upload = self._upload_json
             with Progress() as progress:
                 task = progress.add_task(
-                    "[cyan]上传对象...", total=len(blobs_payload))
-                self.client.upload_blobs(self.repo.vault_id, blobs_payload)
-                progress.update(task, advance=len(blobs_payload))
+                    "[cyan]上传对象...", total=len(missing_hashes))
+
+                def on_uploaded(batch, counts):
+                    result.blobs_uploaded += counts[0]
+                    result.bytes_uploaded += counts[1]
+                    journal.mark_done(batch)
+                    progress.update(task, advance=len(batch))
+
+                # 任何一批失败都会在这里抛出，之后的版本数据不会被上传
+                self._run_concurrently(upload, batches, on_uploaded)
 
-        # d. 上传版本数据
+        # e. 在所有 blob 就绪后，按时间顺序分批上传版本数据
+        #    每批的第一个版本以它之前的版本 (上一批的最后一个，或服务器已有的本地版本) 为增量基准
+        versions_data_to_upload.sort(key=lambda v: v['timestamp'])
+        response = None
+        base = None
+        if versions_data_to_upload:
+            previous = self.repo.db.get_previous_version_hash(
+                versions_data_to_upload[0]['timestamp'])
+            if previous:
+                base = (previous, self.repo.db.get_version_manifest(previous))
+        version_sizes = {id(v): len(json.dumps(v))
+                         for v in versions_data_to_upload}
         with Progress() as progress:
             task = progress.add_task(
                 "[cyan]上传版本...", total=len(versions_data_to_upload))
-            self.client.upload_versions(
-                self.repo.vault_id, versions_data_to_upload)
-            progress.update(task, advance=len(versions_data_to_upload))
+            for batch in make_batches(versions_data_to_upload,
+                                      lambda v: version_sizes[id(v)],
+                                      self.max_batch_bytes, self.max_batch_versions):
+                response = self.client.upload_versions(self.repo.vault_id, batch, base=base)
+                base = (batch[-1]['hash'], batch[-1]['manifest'])
+                progress.update(task, advance=len(batch))
+        journal.clear()
 
-    def _pull_changes(self, version_hashes: list):
+        # 如果上传期间没有其他客户端写入 (序号恰好增加了本次上传的版本数)，
+        # 游标可以直接越过本机刚上传的版本，下次检查时服务器不必再把它们列出来
+        if self._next_cursor is not None and isinstance(response, dict):
+            expected = self._next_cursor["remote_seq"] + len(versions_data_to_upload)
+            if response.get("current_seq") == expected:
+                self._next_cursor["remote_seq"] = expected
+
+    def _run_concurrently(self, func: Callable, batches: list, on_done: Callable):
+        """
+        在线程池中并发执行 `func(batch)`，并在调用线程中按完成顺序回调 `on_done(batch, value)`。
+
+        同时提交的批次数受 `concurrency` 限制，已完成但尚未处理的结果不会无限堆积。
+        回调总是在调用线程中执行，因此可以安全地写入 SQLite 和更新进度条。
+        第一个失败的批次会取消尚未开始的批次并重新抛出异常。
+        """
+        if self.concurrency == 1 or len(batches) <= 1:
+            for batch in batches:
+                on_done(batch, func(batch))
+            return
+
+        parent = profiler.current()
+
+        def run(batch):
+            with profiler.attach(parent):
+                return func(batch)
+
+        pending = iter(batches)
+        with ThreadPoolExecutor(max_workers=self.concurrency,
+                                thread_name_prefix="kcube-sync") as executor:
+            in_flight = {}
+            try:
+                for batch in itertools.islice(pending, self.concurrency):
+                    in_flight[executor.submit(run, batch)] = batch
+                while in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        batch = in_flight.pop(future)
+                        on_done(batch, future.result())
+                        for next_batch in itertools.islice(pending, 1):
+                            in_flight[executor.submit(run, next_batch)] = next_batch
+            except BaseException:
+                for future in in_flight:
+                    future.cancel()
+                raise
+
+    def _read_local_blobs(self, blob_hashes: list, counts: list):
+        """逐个读取对象库中的 blob，产出 (哈希, 编码后的内容)，并在 counts 中累计 [数量, 字节数]。"""
+        for b_hash in blob_hashes:
+            try:
+                content = self.repo._read_blob(b_hash, compressed=True)
+            except IOError as e:
+                log.info(f"[red]错误：无法读取 blob {b_hash[:8]}: {e}[/red]")
+                continue
+            counts[0] += 1
+            counts[1] += len(content)
+            yield b_hash, content
+
+    def _upload_pack(self, blob_hashes: list) -> list:
+        """
+        以 pack 数据流上传一批 blob：边从磁盘读取边发送，不在内存中堆积。
+
+        Returns:
+            list: 实际上传的 [blob 数量, 字节数]。
+        """
+        counts = [0, 0]
+        with span("sync.upload_pack", blobs=len(blob_hashes)):
+            self.client.upload_blob_pack(
+                self.repo.vault_id, self._read_local_blobs(blob_hashes, counts))
+        return counts
+
+    def _upload_local(self, blob_hashes: list) -> list:
+        """文件系统远程 (file://)：对象文件直接链接或复制到远程目录，不经过读取和编码。"""
+        with span("sync.upload_local", blobs=len(blob_hashes)):
+            copied = self.client.import_objects(
+                self.repo.vault_id, self.repo.versions_path, blob_hashes)
+        return [len(copied), sum(size for _, size in copied)]
+
+    def _upload_json(self, blob_hashes: list) -> list:
+        """旧服务器的上传方式：把一批 blob base64 编码后放入一个 JSON 文档。"""
+        counts = [0, 0]
+        with span("sync.read_blobs"):
+            blobs_payload = [
+                {"hash": b_hash, "content_b64": base64.b64encode(content).decode('ascii')}
+                for b_hash, content in self._read_local_blobs(blob_hashes, counts)]
+        if blobs_payload:
+            self.client.upload_blobs(self.repo.vault_id, blobs_payload)
+        return counts
+
+    def _pull_changes(self, version_hashes: list, result: Optional[SyncResult] = None):
         """处理下载逻辑。"""
         log.info("\n[bold green]⬇️ 正在下载远程变更...[/bold green]")
 
-        # a. 下载版本元数据
+        # a. 分批并发下载版本元数据。元数据保存在同步日志中，
+        #    中断后重新同步同一组版本时无需再次下载
+        journal = SyncJournal(self.repo.kcube_path, "pull")
+        key = plan_key(self.repo.vault_id, version_hashes)
+        plan = journal.load(key)
+        if plan is not None:
+            versions_data = plan["versions"]
+            log.info("  - 继续上一次中断的下载")
+        else:
+            versions_data = self._download_versions(version_hashes)
+            journal.begin(key, vault_id=self.repo.vault_id, versions=versions_data)
+
+        # b. 找出所有需要的 blob 哈希
+        blobs_needed = self._blobs_needed(versions_data)
+        local_blobs = set(self.repo.db.get_all_blob_hashes())
+        blobs_to_download = sorted(blobs_needed - local_blobs)
+        # 本地已有同一路径的上一个修订时，可以只下载增量
+        bases = {}
+        if blobs_to_download and self.client.supports(DELTA_CAPABILITY):
+            bases = self._delta_bases(versions_data, set(blobs_to_download), local_blobs)
+        self._fetch_blobs(blobs_to_download, bases, result)
+
+        # c. 所有 blob 落盘之后才写入版本数据，保证任何已记录的版本都可以检出
+        #    (部分克隆中缺少的对象可以从 promisor 远程补齐)
+        self.repo.db.bulk_insert_versions(versions_data, promised=self.partial)
+        journal.clear()
+
+    def _find_missing_blobs(self, blob_hashes: List[str]) -> List[str]:
+        """
+        询问服务器缺少哪些 blob。不支持协商的旧服务器视为全部缺少，即照旧上传所有引用的对象。
+        """
+        if not self.client.supports(NEGOTIATION_CAPABILITY):
+            return list(blob_hashes)
+        return self.client.find_missing_blobs(self.repo.vault_id, blob_hashes)
+
+    def _blobs_needed(self, versions_data: list) -> set:
+        """拉取一组版本需要的对象。部分克隆只需要最新版本 (即随后检出的版本) 的对象。"""
+        if self.partial:
+            if not versions_data:
+                return set()
+            newest = max(versions_data, key=lambda v: v['timestamp'])
+            return set(newest['manifest'].values())
+        return {h for v_data in versions_data for h in v_data['manifest'].values()}
+
+    def fetch_blobs(self, blob_hashes: List[str]):
+        """
+        下载一组本地缺少的对象并写入对象库，供部分克隆的仓库在检出时按需调用。
+
+        Args:
+            blob_hashes (List[str]): 需要的 blob 哈希；本地已有的会被跳过。
+        """
+        existing = self.repo.db.get_blob_sizes(list(blob_hashes))
+        missing = sorted(set(blob_hashes) - set(existing))
+        if not missing:
+            return
+        log.info(f"  - 正在从远程获取 {len(missing)} 个对象...")
+        self.client.set_pool_size(self.concurrency)
+        with span("sync.fetch_promised", blobs=len(missing)):
+            self._fetch_blobs(missing)
+
+    def _fetch_blobs(self, blobs_to_download: list, bases: Optional[Dict[str, str]] = None,
+                     result: Optional[SyncResult] = None):
+        """
+        按服务器报告的大小把对象分批并发下载，并写入本地对象库。
+
+        Args:
+            blobs_to_download (list): 需要下载的 blob 哈希。
+            bases (Optional[Dict[str, str]]): {目标哈希: 本地已有的基准哈希}，这些对象先尝试以增量下载。
+            result (Optional[SyncResult]): 累计增量传输的统计。
+        """
+        # 已经落盘但尚未登记的对象 (上一次同步中断) 经过校验后直接复用
+        if blobs_to_download:
+            with span("sync.adopt_orphans"):
+                adopted = set(self.repo._adopt_orphan_blobs(blobs_to_download))
+            blobs_to_download = [h for h in blobs_to_download if h not in adopted]
+        if bases and blobs_to_download:
+            pairs = {h: bases[h] for h in blobs_to_download if h in bases}
+            with span("sync.fetch_deltas", candidates=len(pairs)):
+                received = self._download_deltas(pairs, result)
+            blobs_to_download = [h for h in blobs_to_download if h not in received]
+        if not blobs_to_download:
+            return
+
+        sizes = {}
+        if self.client.supports(BATCH_QUERY_CAPABILITY):
+            sizes = self.client.get_blob_sizes(
+                self.repo.vault_id, blobs_to_download)
+        batches = list(make_batches(blobs_to_download, sizes,
+                                    self.max_batch_bytes, self.max_batch_blobs))
+        with Progress() as progress:
+            task = progress.add_task(
+                "[cyan]下载对象...", total=len(blobs_to_download))
+
+            # 文件系统远程把对象文件直接链接或复制到本地对象库，之后只需校验并登记
+            local = self.client.supports(LOCAL_OBJECTS_CAPABILITY)
+
+            # 网络传输在工作线程中进行，下载好的批次在当前线程写入本地对象库
+            def on_downloaded(batch, blobs):
+                if result is not None:
+                    result.blobs_downloaded += len(blobs)
+                with span("sync.write_blobs", blobs=len(blobs)):
+                    if local:
+                        adopted = self.repo._adopt_orphan_blobs(blobs)
+                        if len(adopted) != len(blobs):
+                            log.info(f"[red]错误：{len(blobs) - len(adopted)} 个远程对象校验失败。[/red]")
+                    else:
+                        self.repo._write_blobs(blobs)
+                progress.update(task, advance=len(batch))
+
+            if local:
+                def download(batch):
+                    return self.client.export_objects(
+                        self.repo.vault_id, batch, self.repo.versions_path)
+            else:
+                def download(batch):
+                    return list(self._download_blobs(batch))
+            self._run_concurrently(download, batches, on_downloaded)
+
+    def _delta_bases(self, versions_data: list, targets: set,
+                     local_blobs: Optional[set] = None) -> Dict[str, str]:
+        """
+        为待传输的对象选择增量基准：同一路径在前一个版本中的对象。
+
+        第一个版本之前的版本取本地早于它的最新版本。基准必须在本地对象库中，
+        且不能是本身也待传输的对象 (对方还没有)。
+
+        Args:
+            versions_data (list): 带有完整清单的版本数据。
+            targets (set): 待传输的 blob 哈希。
+            local_blobs (Optional[set]): 本地已有的 blob 哈希；为空时查询数据库。
+
+        Returns:
+            Dict[str, str]: {目标哈希: 基准哈希}。
+        """
+        versions = sorted(versions_data, key=lambda v: v['timestamp'])
+        if not versions:
+            return {}
+        previous_hash = self.repo.db.get_previous_version_hash(versions[0]['timestamp'])
+        previous = self.repo.db.get_version_manifest(previous_hash) if previous_hash else {}
+        bases = {}
+        for version in versions:
+            for path, blob_hash in version['manifest'].items():
+                base = previous.get(path)
+                if blob_hash in targets and blob_hash not in bases and base and base not in targets:
+                    bases[blob_hash] = base
+            previous = version['manifest']
+        if local_blobs is None:
+            local_blobs = set(self.repo.db.get_blob_sizes(sorted(set(bases.values()))))
+        return {target: base for target, base in bases.items() if base in local_blobs}
+
+    def _upload_deltas(self, bases: Dict[str, str], result: SyncResult) -> set:
+        """
+        计算并上传增量，返回服务器已经写入的对象；增量不划算或被服务器拒绝的对象需要完整上传。
+        """
+        items = []
+        for target, base in bases.items():
+            try:
+                full = self.repo._read_blob(target, compressed=True)
+                delta = make_delta(self.repo._read_blob(base, compressed=True), full)
+            except IOError:
+                continue
+            if delta is not None:
+                items.append((target, base, delta, len(full)))
+
+        sent = set()
+        for start in range(0, len(items), self.max_batch_deltas):
+            batch = items[start:start + self.max_batch_deltas]
+            response = self.client.upload_blob_deltas(self.repo.vault_id, [
+                {"hash": target, "base": base, "delta_b64": base64.b64encode(delta).decode('ascii')}
+                for target, base, delta, _ in batch])
+            stored = set(response.get("stored", []))
+            for target, _, delta, full_size in batch:
+                if target in stored:
+                    result.blobs_uploaded += 1
+                    result.bytes_uploaded += len(delta)
+                    result.blobs_delta_uploaded += 1
+                    result.bytes_saved_by_delta += full_size - len(delta)
+            sent |= stored
+        return sent
+
+    def _download_deltas(self, pairs: Dict[str, str], result: Optional[SyncResult]) -> set:
+        """下载并应用增量，返回已经重建并写入本地的对象；其余对象需要完整下载。"""
+        received = set()
+        items = sorted(pairs.items())
+        for start in range(0, len(items), self.max_batch_deltas):
+            deltas = self.client.download_blob_deltas(
+                self.repo.vault_id, dict(items[start:start + self.max_batch_deltas]))
+            blobs = []
+            for item in deltas:
+                if pairs.get(item['hash']) != item['base']:
+                    continue
+                delta = base64.b64decode(item['delta_b64'])
+                try:
+                    content = apply_delta(self.repo._read_blob(item['base'], compressed=True),
+                                          delta, item['hash'])
+                except (DeltaError, IOError) as e:
+                    log.info(f"[yellow]增量 {item['hash'][:8]} 无法应用，改为完整下载: {e}[/yellow]")
+                    continue
+                blobs.append((item['hash'], content))
+                if result is not None:
+                    result.blobs_delta_downloaded += 1
+                    result.bytes_saved_by_delta += len(content) - len(delta)
+            self.repo._write_blobs(blobs)
+            received.update(h for h, _ in blobs)
+        return received
+
+    def _download_versions(self, version_hashes: list) -> list:
+        """分批并发下载版本元数据。"""
+        versions_data = []
+        version_batches = [version_hashes[start:start + self.max_batch_versions]
+                           for start in range(0, len(version_hashes), self.max_batch_versions)]
         with Progress() as progress:
             task = progress.add_task(
                 "[cyan]下载版本...", total=len(version_hashes))
-            versions_data = self.client.download_versions(
-                self.repo.vault_id, version_hashes)
-            progress.update(task, advance=len(version_hashes))
 
-        # b. 找出所有需要的 blob 哈希并下载
-        blobs_needed = set()
-        for v_data in versions_data:
-            blobs_needed.update(v_data['manifest'].values())
+            def on_versions(batch, data):
+                versions_data.extend(data)
+                progress.update(task, advance=len(batch))
 
-        local_blobs = set(self.repo.db.get_all_blob_hashes())
-        blobs_to_download = list(blobs_needed - local_blobs)
+            self._run_concurrently(
+                lambda batch: self.client.download_versions(
+                    self.repo.vault_id, batch),
+                version_batches, on_versions)
+        return versions_data
 
-        if blobs_to_download:
-            with Progress() as progress:
-                task = progress.add_task(
-                    "[cyan]下载对象...", total=len(blobs_to_download))
-                downloaded_blobs = self.client.download_blobs(
-                    self.repo.vault_id, blobs_to_download)
-                progress.update(task, advance=len(blobs_to_download))
-
-            # c. 将下载的 blob 写入本地对象库
-            for blob in downloaded_blobs:
-                self.repo._write_blob(blob['hash'], base64.b64decode(
-                    blob['content_b64']), is_compressed=True)
-
-        # d. 将下载的版本数据写入数据库
-        self.repo.db.bulk_insert_versions(versions_data)
+    def _download_blobs(self, blob_hashes: list):
+        """下载一批 blob，产出 (哈希, 编码后的内容)。pack 流中的每一帧都已校验。"""
+        if self.client.supports(PACK_CAPABILITY):
+            yield from self.client.download_blob_pack(self.repo.vault_id, blob_hashes)
+            return
+        for blob in self.client.download_blobs(self.repo.vault_id, blob_hashes):
+            yield blob['hash'], base64.b64decode(blob['content_b64'])
+
+
+def make_batches(items: list, sizes: Union[Dict, Callable], max_bytes: int, max_count: int) -> Iterator[list]:
+    """
+    把待传输的条目切分为字节数和数量都有上限的批次，保持原有顺序。
+
+    单个条目超过 `max_bytes` 时独占一个批次。
+
+    Args:
+        items (list): 待传输的条目 (如 blob 哈希)。
+        sizes (Union[Dict, Callable]): 条目大小的映射或函数；未知大小按 0 计。
+        max_bytes (int): 每批的字节数上限。
+        max_count (int): 每批的条目数上限。
+
+    Yields:
+        list: 一个批次。
+    """
+    size_of = sizes if callable(sizes) else (lambda item: sizes.get(item, 0))
+    batch, batch_bytes = [], 0
+    for item in items:
+        size = size_of(item)
+        if batch and (batch_bytes + size > max_bytes or len(batch) >= max_count):
+            yield batch
+            batch, batch_bytes = [], 0
+        batch.append(item)
+        batch_bytes += size
+    if batch:
+        yield batch
@@ -0,0 +1,106 @@
+# k_cube/sync_journal.py
+
+"""
+同步日志：记录进行中的上传或下载，使被中断的同步可以从断点继续，而不是重新协商和传输。
+
+日志位于 .kcube/sync/ 下，每个方向一组文件，同步成功后删除：
+
+    push.json   上传计划 {"key": 计划标识, "vault_id", "missing": 服务器缺少的 blob 哈希}
+    push.done   已上传的 blob 哈希，每行一个，每批完成后追加并 fsync
+    pull.json   下载计划 {"key": 计划标识, "vault_id", "versions": 已下载的版本元数据}
+                (已下载的对象直接以对象库中的文件为准，不另行记录)
+
+计划文件先写入 <name>.tmp 再原子重命名；.done 的最后一行可能因中断而不完整，读取时忽略。
+计划标识由保险库 ID 和待传输的版本集合计算 (`plan_key`)，与本次协商结果不一致的旧日志会被丢弃。
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Iterable, List, Optional, Set
+
+# 同步日志所在的子目录 (位于 .kcube/ 下)
+JOURNAL_DIR = "sync"
+
+
+def plan_key(vault_id: str, version_hashes: Iterable[str]) -> str:
+    """
+    计算一次同步计划的标识：同一个保险库、同一组待传输的版本得到相同的标识。
+
+    Args:
+        vault_id (str): 保险库 ID。
+        version_hashes (Iterable[str]): 本次需要上传或下载的版本哈希。
+
+    Returns:
+        str: 十六进制摘要。
+    """
+    digest = hashlib.sha256(vault_id.encode('utf-8'))
+    for v_hash in sorted(version_hashes):
+        digest.update(v_hash.encode('ascii'))
+    return digest.hexdigest()
+
+
+class SyncJournal:
+    """
+    记录一次同步的传输计划和已完成的批次，使中断后的同步可以从断点继续。
+
+    每个方向 (push / pull) 使用两个文件：
+    - `<name>.json`：协商得到的计划 (计划标识及方向相关的数据)，原子写入；
+    - `<name>.done`：追加写入的已完成条目 (每行一个哈希)，每个批次完成后追加。
+
+    计划标识 (见 `plan_key`) 与本次协商结果不一致时，旧的日志会被丢弃。
+    同步成功结束后调用 `clear()` 删除日志。
+    """
+
+    def __init__(self, kcube_path: Path, name: str):
+        self.directory = kcube_path / JOURNAL_DIR
+        self.plan_path = self.directory / f"{name}.json"
+        self.done_path = self.directory / f"{name}.done"
+
+    def load(self, key: str) -> Optional[dict]:
+        """
+        读取与 `key` 匹配的计划；不存在、损坏或不匹配时返回 None。
+        """
+        try:
+            with open(self.plan_path, 'r', encoding='utf-8') as f:
+                plan = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        return plan if plan.get("key") == key else None
+
+    def begin(self, key: str, **data) -> dict:
+        """开始一个新的计划，清空已完成记录。"""
+        plan = {"key": key, **data}
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.plan_path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(plan, f)
+            f.flush()
+            os.fsync(f.fileno())
+        self.done_path.unlink(missing_ok=True)
+        os.replace(tmp_path, self.plan_path)
+        return plan
+
+    def completed(self) -> Set[str]:
+        """返回已完成的条目。"""
+        try:
+            with open(self.done_path, 'r', encoding='ascii') as f:
+                # 最后一行可能因中断而不完整，哈希长度不对的行直接忽略
+                return {line.strip() for line in f if len(line.strip()) == 64}
+        except OSError:
+            return set()
+
+    def mark_done(self, items: List[str]) -> None:
+        """追加一批已完成的条目。"""
+        if not items:
+            return
+        with open(self.done_path, 'a', encoding='ascii') as f:
+            f.write("".join(f"{item}\n" for item in items))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def clear(self) -> None:
+        """同步完成后删除日志。"""
+        self.plan_path.unlink(missing_ok=True)
+        self.done_path.unlink(missing_ok=True)
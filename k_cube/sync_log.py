@@ -0,0 +1,76 @@
+# k_cube/sync_log.py
+
+"""
+本地同步记录：每次同步成功后把 SyncResult.telemetry() 追加到 .kcube/sync_log.jsonl，
+用于观察同步性能随时间的变化，以及为 `kv sync --dry-run` 估算传输耗时。
+
+文件每行一个 JSON 对象，按时间从旧到新排列，例如：
+
+    {"timestamp": ..., "direction": "upload", "versions_uploaded": 1, "bytes_sent": 2048,
+     "bytes_sent_compressed": 1024, "requests": 4, "retries": 0, "seconds": 0.3,
+     "throughput": 6826.7, "phase_seconds": {"negotiate": 0.1, "upload": 0.2}, ...}
+
+记录只追加不修改。文件超过 `MAX_LOG_BYTES` (1 MiB) 时保留较新的一半记录，
+先写入 sync_log.tmp 再原子替换，因此文件大小始终有界；无法解析的行 (例如写入被中断) 读取时跳过。
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# 同步记录文件 (位于 .kcube/ 下)，每行一次同步的统计 (参见 SyncResult.telemetry)
+LOG_FILE = "sync_log.jsonl"
+# 文件超过该大小时只保留较新的一半记录
+MAX_LOG_BYTES = 1024 * 1024
+
+
+class SyncLog:
+    """
+    滚动的本地同步记录：每次同步成功后追加一行 JSON，用于观察同步性能随时间的变化。
+
+    记录只追加；文件超过 `MAX_LOG_BYTES` 时丢弃较旧的一半，总大小保持有界。
+    """
+
+    def __init__(self, kcube_path: Path):
+        self.path = Path(kcube_path) / LOG_FILE
+
+    def append(self, entry: Dict):
+        """追加一条记录，必要时截断旧记录。"""
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line)
+            size = f.tell()
+        if size > MAX_LOG_BYTES:
+            lines = self.path.read_text(encoding='utf-8').splitlines(keepends=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            tmp_path.write_text("".join(lines[len(lines) // 2:]), encoding='utf-8')
+            os.replace(tmp_path, self.path)
+
+    def entries(self, limit: Optional[int] = None) -> List[Dict]:
+        """
+        读取记录，按时间从旧到新排列。
+
+        Args:
+            limit (Optional[int]): 只返回最近的若干条。
+
+        Returns:
+            List[Dict]: 记录列表；无法解析的行 (例如写入被中断) 被跳过。
+        """
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return []
+        entries = []
+        for line in lines[-limit:] if limit else lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+        return entries
+
+    def recent_throughput(self, limit: int = 20) -> Optional[float]:
+        """最近 `limit` 次传输过数据的同步的吞吐量中位数 (字节/秒)；没有记录时返回 None。"""
+        rates = sorted(e["throughput"] for e in self.entries(limit=limit) if e.get("throughput"))
+        return rates[len(rates) // 2] if rates else None
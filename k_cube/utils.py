@@ -5,7 +5,9 @@ from pathlib import Path
 from typing import Optional
 
 import hashlib
+import math
 import zlib
+from collections import Counter
 from datetime import datetime
 
 # 定义保险库的元数据目录名，便于全局统一修改
@@ -53,6 +55,109 @@ def hash_blob(content: bytes) -> str:
     return hashlib.sha256(content).hexdigest()
 
 
+# 对象编码 (codec)
+# - zlib:   zlib.compress 的输出，首字节总是 0x78
+# - stored: STORED_MAGIC + 原始内容，用于图片、PDF、压缩包等已经压缩过的内容
+# blob 哈希是对编码后的字节计算的，因此编码方式必须只由文件本身决定 (确定性)。
+STORED_MAGIC = b"\x00KST"
+
+# 已知的已压缩格式：只看扩展名还不够 (有人会把文本存成 .bin)，还需要通过熵探测确认
+_STORED_EXTENSIONS = {
+    ".jpg", ".jpeg", ".png", ".gif", ".webp", ".heic", ".avif",
+    ".pdf", ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".rar", ".zst",
+    ".mp3", ".m4a", ".aac", ".ogg", ".opus", ".flac",
+    ".mp4", ".m4v", ".mov", ".mkv", ".webm", ".avi",
+    ".docx", ".xlsx", ".pptx", ".epub", ".woff", ".woff2",
+}
+
+# 纯文本格式：总是值得压缩，跳过探测
+_TEXT_EXTENSIONS = {
+    ".md", ".markdown", ".txt", ".json", ".canvas", ".csv", ".html", ".htm",
+    ".css", ".js", ".ts", ".py", ".yaml", ".yml", ".xml", ".svg", ".tex", ".org",
+}
+
+# 常见已压缩格式的文件头
+_COMPRESSED_MAGICS = (
+    b"\xff\xd8\xff",             # JPEG
+    b"\x89PNG\r\n\x1a\n",        # PNG
+    b"GIF87a", b"GIF89a",        # GIF
+    b"PK\x03\x04",               # ZIP / docx / xlsx / epub
+    b"\x1f\x8b",                 # gzip
+    b"BZh",                      # bzip2
+    b"\xfd7zXZ\x00",             # xz
+    b"7z\xbc\xaf\x27\x1c",         # 7z
+    b"Rar!\x1a\x07",              # rar
+    b"\x28\xb5\x2f\xfd",           # zstd
+    b"OggS",                     # ogg
+    b"fLaC",                     # flac
+    b"ID3",                      # mp3
+    b"wOFF", b"wOF2",            # woff
+)
+
+# 小于该大小的内容直接压缩：探测本身的开销和节省都可以忽略
+_PROBE_MIN_SIZE = 512
+# 探测时采样的字节数 (文件头、中部、尾部各取一段)
+_PROBE_SAMPLE = 4096
+# 每字节的香农熵 (比特) 超过该值即视为不可压缩
+_ENTROPY_THRESHOLD = 7.5
+
+
+def _sample_entropy(content: bytes) -> float:
+    """估算内容的香农熵 (比特/字节)，只采样头、中、尾三段。"""
+    if len(content) <= _PROBE_SAMPLE * 3:
+        sample = content
+    else:
+        middle = len(content) // 2
+        sample = (content[:_PROBE_SAMPLE]
+                  + content[middle:middle + _PROBE_SAMPLE]
+                  + content[-_PROBE_SAMPLE:])
+    total = len(sample)
+    entropy = 0.0
+    for occurrences in Counter(sample).values():
+        p = occurrences / total
+        entropy -= p * math.log2(p)
+    return entropy
+
+
+def choose_codec(content: bytes, path: Optional[str] = None) -> str:
+    """
+    为一个对象选择编码方式。
+
+    规则 (按顺序)：文本扩展名或过小的内容 -> zlib；
+    已知压缩格式的文件头 -> stored；否则由采样熵决定。
+
+    Args:
+        content (bytes): 文件的原始内容。
+        path (Optional[str]): 文件的相对路径，用于扩展名策略。
+
+    Returns:
+        str: "zlib" 或 "stored"。
+    """
+    suffix = os.path.splitext(path)[1].lower() if path else ""
+    if suffix in _TEXT_EXTENSIONS or len(content) < _PROBE_MIN_SIZE:
+        return "zlib"
+    if content.startswith(_COMPRESSED_MAGICS):
+        return "stored"
+    threshold = _ENTROPY_THRESHOLD - 0.5 if suffix in _STORED_EXTENSIONS else _ENTROPY_THRESHOLD
+    return "stored" if _sample_entropy(content) >= threshold else "zlib"
+
+
+def encode_blob(content: bytes, path: Optional[str] = None) -> bytes:
+    """
+    按 `choose_codec` 的结果编码文件内容，得到写入对象库的字节。
+
+    Args:
+        content (bytes): 文件的原始内容。
+        path (Optional[str]): 文件的相对路径。
+
+    Returns:
+        bytes: 编码后的二进制内容。
+    """
+    if choose_codec(content, path) == "stored":
+        return STORED_MAGIC + content
+    return compress_blob(content)
+
+
 def compress_blob(content: bytes) -> bytes:
     """
     使用 zlib 压缩文件内容。
@@ -68,17 +173,34 @@ def compress_blob(content: bytes) -> bytes:
 
 def decompress_blob(compressed_content: bytes) -> bytes:
     """
-    使用 zlib 解压文件内容。
+    解码对象库中的内容，自动识别 stored 与 zlib 两种编码。
 
     Args:
-        compressed_content (bytes): 压缩后的二进制内容。
+        compressed_content (bytes): 编码后的二进制内容。
 
     Returns:
-        bytes: 解压后的原始二进制内容。
+        bytes: 原始二进制内容。
     """
+    if compressed_content.startswith(STORED_MAGIC):
+        return compressed_content[len(STORED_MAGIC):]
     return zlib.decompress(compressed_content)
 
 
+def decoded_size(encoded: bytes) -> int:
+    """
+    返回编码内容解码后的大小；stored 编码无需解码。
+
+    Args:
+        encoded (bytes): 编码后的二进制内容。
+
+    Returns:
+        int: 原始内容的字节数。
+    """
+    if encoded.startswith(STORED_MAGIC):
+        return len(encoded) - len(STORED_MAGIC)
+    return len(zlib.decompress(encoded))
+
+
 def format_timestamp(ts: int) -> str:
     """
     将 Unix 时间戳格式化为易于阅读的字符串。
@@ -90,3 +212,32 @@ def format_timestamp(ts: int) -> str:
         str: 格式化后的日期时间字符串。
     """
     return datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+
+
+_console = None
+
+
+def get_console():
+    """
+    获取全局共享的 Rich Console 实例。
+
+    Rich 的导入开销不小，因此只在第一次真正需要输出时才导入并创建。
+
+    Returns:
+        rich.console.Console: 共享的 Console 实例。
+    """
+    global _console
+    if _console is None:
+        from rich.console import Console
+        _console = Console()
+    return _console
+
+
+class LazyConsole:
+    """
+    Console 的轻量代理：模块加载时可以直接创建，
+    直到第一次访问属性 (如 `console.print`) 时才导入 Rich。
+    """
+
+    def __getattr__(self, name):
+        return getattr(get_console(), name)
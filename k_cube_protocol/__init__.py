@@ -0,0 +1,7 @@
+# k_cube_protocol/__init__.py
+
+"""
+客户端 (k_cube) 与服务器 (k-cube-server) 共用的同步线路格式。
+
+这里的模块只依赖标准库，两端导入同一份代码，编码和解码的实现不会各自演变。
+"""
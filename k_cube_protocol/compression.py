@@ -0,0 +1,101 @@
+# k_cube_protocol/compression.py
+
+"""
+HTTP 请求体 / 响应体的透明压缩。
+
+版本清单等 JSON 高度重复 (相同的路径和哈希在多个版本中反复出现)，批量传输多个版本时压缩率可达十倍以上。
+支持 gzip (标准库) 和 zstd (需要可选依赖 `zstandard`)，通过标准的
+Content-Encoding / Accept-Encoding 头协商。小于阈值的数据不压缩，避免得不偿失。
+"""
+
+import gzip
+import io
+from typing import List, Optional
+
+try:
+    import zstandard
+except ImportError:  # zstd 是可选的，缺少时只使用 gzip
+    zstandard = None
+
+# 小于该字节数的数据不压缩
+COMPRESSION_THRESHOLD = 1024
+# gzip 使用较低的压缩级别：同步数据在本机生成，CPU 时间比多压缩几个百分点更重要
+GZIP_LEVEL = 5
+ZSTD_LEVEL = 3
+# 解压后的大小上限，防止"压缩炸弹"
+MAX_DECODED_SIZE = 512 * 1024 * 1024
+
+_DECODE_ERRORS = (OSError, EOFError) + \
+    ((zstandard.ZstdError,) if zstandard is not None else ())
+
+
+class CompressionError(Exception):
+    """无法解压数据或编码不受支持时引发。"""
+    pass
+
+
+def available_encodings() -> List[str]:
+    """返回本机可用的编码，按优先级排列。"""
+    return (["zstd"] if zstandard is not None else []) + ["gzip"]
+
+
+def choose_encoding(accepted: List[str]) -> Optional[str]:
+    """
+    在对方接受的编码中选出本机优先级最高的一个。
+
+    Args:
+        accepted (List[str]): 对方接受的编码。
+
+    Returns:
+        Optional[str]: 编码名称；没有共同的编码时返回 None。
+    """
+    for encoding in available_encodings():
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """按指定编码压缩数据。"""
+    if encoding == "gzip":
+        return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    if encoding == "zstd" and zstandard is not None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    raise CompressionError(f"不支持的编码: {encoding}")
+
+
+def decompress(data: bytes, encoding: str, max_size: int = MAX_DECODED_SIZE) -> bytes:
+    """
+    按指定编码解压数据。
+
+    Raises:
+        CompressionError: 编码不受支持、数据损坏或解压后超过 `max_size`。
+    """
+    # 两种编码都以流的方式解压，最多读出 max_size + 1 字节，不会先把炸弹完整展开
+    try:
+        if encoding == "gzip":
+            with gzip.GzipFile(fileobj=io.BytesIO(data)) as f:
+                decoded = _read_at_most(f, max_size + 1)
+        elif encoding == "zstd" and zstandard is not None:
+            with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(data)) as f:
+                decoded = _read_at_most(f, max_size + 1)
+        else:
+            raise CompressionError(f"不支持的编码: {encoding}")
+    except _DECODE_ERRORS as e:
+        raise CompressionError(f"{encoding} 数据损坏: {e}") from e
+    if len(decoded) > max_size:
+        raise CompressionError("解压后的数据超过大小上限。")
+    return decoded
+
+
+def _read_at_most(reader, limit: int) -> bytes:
+    """从流中读取数据直到结束或满 `limit` 字节 (单次 read 可能返回较少的数据)。"""
+    chunks = []
+    remaining = limit
+    while remaining > 0:
+        chunk = reader.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
@@ -0,0 +1,225 @@
+# k_cube_protocol/delta.py
+
+"""
+对象的增量 (delta) 编码：只传输新版本相对于对方已有的旧版本 (同一路径的上一个修订) 的差异。
+
+差异在解码后的原始内容上计算，方法与 rsync 相同：
+- 先去掉公共前缀和公共后缀 (大多数编辑只改动文件中的一段)；
+- 中间部分把旧内容按固定大小分块，用滚动校验和在新内容中逐字节寻找相同的块，
+  找到后尽量向后延伸，其余部分作为字面数据。
+
+增量格式:
+    MAGIC (4 字节) + 版本号 (1 字节) + 编码方式 (1 字节, b"z" 或 b"s") + 目标原始长度 (8 字节, 大端)
+    + zlib 压缩的操作序列: b"C" + 偏移 (8 字节) + 长度 (8 字节) | b"I" + 长度 (8 字节) + 数据
+
+接收方按操作序列还原原始内容，再按记录的编码方式重新编码，并用目标哈希校验结果；
+编码结果与发送方的对象不一致 (例如两端的 zlib 版本不同) 时校验失败，由调用方改为传输完整对象。
+"""
+
+import hashlib
+import struct
+import zlib
+from itertools import accumulate
+from typing import List, Optional, Tuple
+
+MAGIC = b"KCDL"
+VERSION = 1
+# 与 k_cube.utils.STORED_MAGIC 相同 (服务器不依赖 k_cube，因此在这里单独定义)：stored 编码的对象以它开头
+STORED_MAGIC = b"\x00KST"
+
+# 目标对象 (解码后) 小于该大小时直接传输完整对象
+DELTA_MIN_SIZE = 16 * 1024
+# 去掉公共前后缀之后，中间部分超过该大小时不再逐字节查找匹配块 (纯 Python 的滚动校验和较慢)，
+# 整段作为字面数据
+DELTA_SCAN_LIMIT = 4 * 1024 * 1024
+# 增量不超过完整对象的这个比例时才值得发送
+MAX_DELTA_RATIO = 0.5
+# 还原后的大小上限
+MAX_TARGET_SIZE = 512 * 1024 * 1024
+
+_HEADER = struct.Struct(">4sBcQ")
+_COPY = struct.Struct(">QQ")
+_LENGTH = struct.Struct(">Q")
+_MOD = 1 << 16
+
+
+class DeltaError(Exception):
+    """增量数据格式错误、与基准不匹配或还原结果校验失败时引发。"""
+    pass
+
+
+def _decode(encoded: bytes) -> Tuple[bytes, bytes]:
+    """把对象库中的内容解码为 (原始内容, 编码方式)。"""
+    if encoded.startswith(STORED_MAGIC):
+        return encoded[len(STORED_MAGIC):], b"s"
+    return zlib.decompress(encoded), b"z"
+
+
+def _encode(raw: bytes, codec: bytes) -> bytes:
+    """按编码方式重新编码原始内容 (与 k_cube.utils.encode_blob 的输出一致)。"""
+    if codec == b"s":
+        return STORED_MAGIC + raw
+    return zlib.compress(raw)
+
+
+def _common_prefix(a: memoryview, b: memoryview) -> int:
+    """二分查找两段内容的公共前缀长度，比较在 C 层完成。"""
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _common_suffix(a: memoryview, b: memoryview, limit: int) -> int:
+    """二分查找两段内容的公共后缀长度 (不超过 `limit`)。"""
+    lo, hi = 0, min(len(a), len(b), limit)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:len(a) - lo] == b[len(b) - mid:len(b) - lo]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _weak(block) -> Tuple[int, int]:
+    """rsync 的弱校验和 (a, b)：a 为字节和，b 为按位置加权的和。"""
+    return sum(block) % _MOD, sum(accumulate(block)) % _MOD
+
+
+def _match_blocks(base: memoryview, target: memoryview, start: int, end: int) -> List[tuple]:
+    """在 target[start:end] 中查找 base 的块，返回 ("C", 偏移, 长度) / ("I", 起点, 终点) 操作。"""
+    block = max(256, min(8192, int(len(base) ** 0.5)))
+    ops = []
+    if end - start > DELTA_SCAN_LIMIT or end - start < block or len(base) < block:
+        return [("I", start, end)] if end > start else []
+
+    index = {}
+    for offset in range(0, len(base) - block + 1, block):
+        a, b = _weak(base[offset:offset + block])
+        index.setdefault(a | (b << 16), []).append(offset)
+
+    literal = i = start
+    a, b = _weak(target[i:i + block])
+    while i + block <= end:
+        offsets = index.get(a | (b << 16))
+        if offsets:
+            window = target[i:i + block]
+            offset = next((o for o in offsets if base[o:o + block] == window), None)
+            if offset is not None:
+                if i > literal:
+                    ops.append(("I", literal, i))
+                length = block + _common_prefix(base[offset + block:], target[i + block:end])
+                ops.append(("C", offset, length))
+                i = literal = i + length
+                if i + block <= end:
+                    a, b = _weak(target[i:i + block])
+                continue
+        if i + block >= end:
+            break
+        old, new = target[i], target[i + block]
+        a = (a - old + new) % _MOD
+        b = (b - block * old + a) % _MOD
+        i += 1
+    if end > literal:
+        ops.append(("I", literal, end))
+    return ops
+
+
+def make_delta(base_encoded: bytes, target_encoded: bytes) -> Optional[bytes]:
+    """
+    计算把基准对象变为目标对象的增量。
+
+    Args:
+        base_encoded (bytes): 对方已有的基准对象 (对象库中的编码内容)。
+        target_encoded (bytes): 要传输的目标对象。
+
+    Returns:
+        Optional[bytes]: 增量数据；对象太小、无法被接收方准确重建或增量不够小时返回 None。
+    """
+    try:
+        base, _ = _decode(base_encoded)
+        target, codec = _decode(target_encoded)
+    except zlib.error:
+        return None
+    if len(target) < DELTA_MIN_SIZE or _encode(target, codec) != target_encoded:
+        return None
+
+    base_view, target_view = memoryview(base), memoryview(target)
+    prefix = _common_prefix(base_view, target_view)
+    suffix = _common_suffix(base_view, target_view, min(len(base), len(target)) - prefix)
+    ops = [("C", 0, prefix)] if prefix else []
+    ops += _match_blocks(base_view[:len(base) - suffix], target_view, prefix, len(target) - suffix)
+    if suffix:
+        ops.append(("C", len(base) - suffix, suffix))
+
+    parts = []
+    for op in ops:
+        if op[0] == "C":
+            parts.append(b"C" + _COPY.pack(op[1], op[2]))
+        else:
+            parts.append(b"I" + _LENGTH.pack(op[2] - op[1]) + target[op[1]:op[2]])
+    delta = _HEADER.pack(MAGIC, VERSION, codec, len(target)) + zlib.compress(b"".join(parts))
+    return delta if len(delta) <= len(target_encoded) * MAX_DELTA_RATIO else None
+
+
+def apply_delta(base_encoded: bytes, delta: bytes, target_hash: str) -> bytes:
+    """
+    把增量应用到基准对象上，重建并校验目标对象。
+
+    Args:
+        base_encoded (bytes): 基准对象。
+        delta (bytes): `make_delta` 的输出。
+        target_hash (str): 目标对象的哈希。
+
+    Returns:
+        bytes: 目标对象 (对象库中的编码内容)。
+
+    Raises:
+        DeltaError: 增量无效或重建结果与哈希不符。
+    """
+    if len(delta) < _HEADER.size:
+        raise DeltaError("增量数据过短。")
+    magic, version, codec, length = _HEADER.unpack_from(delta)
+    if magic != MAGIC or version != VERSION or codec not in (b"s", b"z"):
+        raise DeltaError("不是有效的 K-Cube 增量数据。")
+    if length > MAX_TARGET_SIZE:
+        raise DeltaError("增量声明的大小超过上限。")
+    try:
+        base, _ = _decode(base_encoded)
+        decompressor = zlib.decompressobj()
+        ops = decompressor.decompress(delta[_HEADER.size:], length * 2 + 1024)
+    except zlib.error as e:
+        raise DeltaError(f"增量数据损坏: {e}") from e
+    if decompressor.unconsumed_tail:
+        raise DeltaError("增量的操作序列超过大小上限。")
+
+    target = bytearray()
+    pos = 0
+    while pos < len(ops):
+        kind = ops[pos:pos + 1]
+        pos += 1
+        if kind == b"C" and pos + _COPY.size <= len(ops):
+            offset, size = _COPY.unpack_from(ops, pos)
+            pos += _COPY.size
+            if offset + size > len(base):
+                raise DeltaError("复制操作超出基准对象的范围。")
+            target += base[offset:offset + size]
+        elif kind == b"I" and pos + _LENGTH.size <= len(ops):
+            size, = _LENGTH.unpack_from(ops, pos)
+            pos += _LENGTH.size
+            target += ops[pos:pos + size]
+            pos += size
+        else:
+            raise DeltaError("增量中有无法识别的操作。")
+        if len(target) > length:
+            raise DeltaError("重建的内容超过声明的大小。")
+
+    encoded = _encode(bytes(target), codec)
+    if len(target) != length or hashlib.sha256(encoded).hexdigest() != target_hash:
+        raise DeltaError(f"重建的对象 {target_hash[:8]} 校验失败。")
+    return encoded
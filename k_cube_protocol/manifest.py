@@ -0,0 +1,114 @@
+# k_cube_protocol/manifest.py
+
+"""
+版本清单 (manifest) 的增量编码，用于同步时传输版本数据。
+
+自动提交产生的相邻版本通常只有少数文件不同，逐个发送完整清单会让传输量
+随"版本数 × 文件数"增长。增量编码后，一个版本在线路上表示为:
+
+    {"hash", "timestamp", "message", "author",
+     "base": <基准版本哈希>, "delta": {"changed": {路径: 哈希}, "removed": [路径]}}
+
+基准是同一批中按时间排在它前面的版本，或接收方已有的版本。增量不比完整清单小时，
+仍然发送 "manifest"。
+"""
+
+from typing import Callable, Dict, List, Optional
+
+
+class MissingBaseError(Exception):
+    """增量编码的版本所引用的基准版本在接收方不存在时引发。"""
+
+    def __init__(self, missing: List[str]):
+        super().__init__(f"缺少 {len(missing)} 个基准版本")
+        self.missing = missing
+
+
+def manifest_delta(base: Dict[str, str], manifest: Dict[str, str]) -> Dict:
+    """
+    计算从 `base` 到 `manifest` 的增量。
+
+    Returns:
+        Dict: {"changed": 新增或修改的 {路径: 哈希}, "removed": 删除的路径列表}。
+    """
+    return {
+        "changed": {path: h for path, h in manifest.items() if base.get(path) != h},
+        "removed": sorted(path for path in base if path not in manifest),
+    }
+
+
+def apply_delta(base: Dict[str, str], delta: Dict) -> Dict[str, str]:
+    """把增量应用到基准清单上，返回新的清单 (不修改 `base`)。"""
+    manifest = dict(base)
+    for path in delta.get("removed", []):
+        manifest.pop(path, None)
+    manifest.update(delta.get("changed", {}))
+    return manifest
+
+
+def encode_versions(versions: List[Dict], base_hash: Optional[str] = None,
+                    base_manifest: Optional[Dict[str, str]] = None) -> List[Dict]:
+    """
+    把一批完整的版本数据按时间顺序编码为增量形式。
+
+    Args:
+        versions (List[Dict]): 带有完整 "manifest" 的版本数据。
+        base_hash (Optional[str]): 接收方已有的版本，可作为第一个版本的基准。
+        base_manifest (Optional[Dict[str, str]]): `base_hash` 对应的清单。
+
+    Returns:
+        List[Dict]: 按时间排序的线路格式版本数据。
+    """
+    encoded = []
+    previous_hash, previous = (base_hash, base_manifest) if base_hash else (None, None)
+    for version in sorted(versions, key=lambda v: v['timestamp']):
+        manifest = version['manifest']
+        entry = {k: v for k, v in version.items() if k != 'manifest'}
+        delta = manifest_delta(previous, manifest) if previous is not None else None
+        if delta is not None and len(delta["changed"]) + len(delta["removed"]) < len(manifest):
+            entry["base"] = previous_hash
+            entry["delta"] = delta
+        else:
+            entry["manifest"] = manifest
+        encoded.append(entry)
+        previous_hash, previous = version['hash'], manifest
+    return encoded
+
+
+def decode_versions(versions: List[Dict],
+                    load_manifest: Callable[[str], Optional[Dict[str, str]]]) -> List[Dict]:
+    """
+    把线路格式的版本数据还原为带完整清单的版本数据。
+
+    Args:
+        versions (List[Dict]): 线路格式的版本数据 (可以混合完整清单和增量)。
+        load_manifest (Callable): 按哈希加载接收方已有版本的清单，不存在时返回 None。
+
+    Returns:
+        List[Dict]: 与输入顺序相同、带有 "manifest" 的版本数据。
+
+    Raises:
+        MissingBaseError: 有版本引用了既不在本批中、接收方也没有的基准。
+    """
+    known: Dict[str, Dict[str, str]] = {}
+    in_batch = {version['hash'] for version in versions}
+    decoded, missing, unresolved = [], [], []
+    for version in versions:
+        if "delta" not in version:
+            known[version['hash']] = version['manifest']
+            decoded.append(version)
+            continue
+        base_hash = version['base']
+        base = known.get(base_hash)
+        if base is None:
+            base = load_manifest(base_hash)
+        if base is None:
+            # 基准在本批中但自身无法还原时，只报告最初缺失的那个外部基准
+            (unresolved if base_hash in in_batch else missing).append(base_hash)
+            continue
+        entry = {k: v for k, v in version.items() if k not in ("base", "delta")}
+        entry['manifest'] = known[version['hash']] = apply_delta(base, version['delta'])
+        decoded.append(entry)
+    if missing or unresolved:
+        raise MissingBaseError(sorted(set(missing or unresolved)))
+    return decoded
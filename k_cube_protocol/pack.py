@@ -0,0 +1,127 @@
+# k_cube_protocol/pack.py
+
+"""
+K-Cube 二进制打包 (pack) 格式，用于在客户端与服务器之间流式传输 blob。
+
+布局:
+    头部:   MAGIC (4 字节) + 版本号 (1 字节)
+    帧:     类型 (1 字节) + SHA-256 摘要 (32 字节) + 长度 (8 字节, 大端) + 内容
+    结尾帧: 类型 END，摘要全零，长度字段为帧总数
+
+帧类型为 BLOB (对象) 或 META (附带的 JSON 元数据，例如快照的版本清单，只能出现在对象帧之前)。
+
+每一帧的内容都会按摘要校验，因此接收方可以边读边写入，无需把整个包放进内存。
+"""
+
+import hashlib
+import struct
+from typing import BinaryIO, Callable, Iterable, Iterator, Optional, Tuple
+
+MAGIC = b"KCPK"
+VERSION = 1
+CONTENT_TYPE = "application/octet-stream"
+
+KIND_BLOB = b"B"
+KIND_META = b"M"
+KIND_END = b"E"
+
+_FRAME_HEADER = struct.Struct(">c32sQ")
+_NULL_DIGEST = b"\x00" * 32
+
+
+class PackError(Exception):
+    """pack 数据流格式错误或校验失败时引发。"""
+    pass
+
+
+def encode_frame(blob_hash: str, content: bytes) -> bytes:
+    """
+    编码一个 blob 帧。
+
+    Args:
+        blob_hash (str): blob 的十六进制哈希。
+        content (bytes): 对象库中的 (编码后的) 内容。
+
+    Returns:
+        bytes: 帧头与内容。
+    """
+    return _FRAME_HEADER.pack(KIND_BLOB, bytes.fromhex(blob_hash), len(content)) + content
+
+
+def iter_pack(blobs: Iterable[Tuple[str, bytes]], meta: Optional[bytes] = None) -> Iterator[bytes]:
+    """
+    把 (hash, content) 序列编码为 pack 数据流，按帧逐块产出。
+
+    适合直接作为 requests 的 `data=` 参数 (分块传输) 或 Flask 的流式响应。
+
+    Args:
+        blobs (Iterable[Tuple[str, bytes]]): 待打包的 blob，可以是惰性生成器。
+        meta (Optional[bytes]): 放在所有对象之前的元数据帧。
+
+    Yields:
+        bytes: 数据流片段。
+    """
+    yield MAGIC + bytes([VERSION])
+    frames = 0
+    if meta is not None:
+        yield _FRAME_HEADER.pack(KIND_META, hashlib.sha256(meta).digest(), len(meta)) + meta
+        frames += 1
+    for blob_hash, content in blobs:
+        yield encode_frame(blob_hash, content)
+        frames += 1
+    yield _FRAME_HEADER.pack(KIND_END, _NULL_DIGEST, frames)
+
+
+def _read_exact(stream: BinaryIO, size: int) -> bytes:
+    """从流中读取恰好 `size` 个字节。"""
+    chunks = []
+    remaining = size
+    while remaining:
+        chunk = stream.read(remaining)
+        if not chunk:
+            raise PackError("pack 数据流意外结束。")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b"".join(chunks)
+
+
+def read_pack(stream: BinaryIO,
+              on_meta: Optional[Callable[[bytes], None]] = None) -> Iterator[Tuple[str, bytes]]:
+    """
+    逐帧解析 pack 数据流，并校验每一帧的哈希。
+
+    Args:
+        stream (BinaryIO): 任何提供 `read(n)` 的对象。
+        on_meta (Optional[Callable]): 接收元数据帧的内容；为空时元数据帧视为格式错误。
+
+    Yields:
+        Tuple[str, bytes]: (十六进制哈希, 内容)。
+
+    Raises:
+        PackError: 头部、帧类型、哈希或帧数不匹配时。
+    """
+    header = _read_exact(stream, len(MAGIC) + 1)
+    if header[:len(MAGIC)] != MAGIC:
+        raise PackError("不是有效的 K-Cube pack 数据流。")
+    if header[len(MAGIC)] != VERSION:
+        raise PackError(f"不支持的 pack 版本: {header[len(MAGIC)]}")
+
+    frames = 0
+    while True:
+        kind, digest, length = _FRAME_HEADER.unpack(
+            _read_exact(stream, _FRAME_HEADER.size))
+        if kind == KIND_END:
+            if length != frames:
+                raise PackError(f"帧数不匹配：声明 {length}，实际 {frames}。")
+            return
+        is_meta = kind == KIND_META and on_meta is not None and not frames
+        if kind != KIND_BLOB and not is_meta:
+            raise PackError(f"未知的帧类型: {kind!r}")
+        content = _read_exact(stream, length)
+        if hashlib.sha256(content).digest() != digest:
+            raise PackError(f"blob {digest.hex()[:8]} 校验失败。")
+        frames += 1
+        if is_meta:
+            on_meta(content)
+            continue
+        yield digest.hex(), content
@@ -0,0 +1,116 @@
+# k_cube_protocol/reconcile.py
+
+"""
+基于前缀区间哈希的集合对账 (range-based set reconciliation)。
+
+把排好序的版本哈希按十六进制前缀划分为区间，每个区间用 (数量, 指纹) 概括，
+指纹是区间内所有哈希按位异或的结果。双方从根区间开始比较：
+- 概括相同的区间直接跳过；
+- 不同且较小的区间，由服务器列出其中的全部哈希，客户端在本地求差集；
+- 不同且较大的区间，服务器返回 16 个子区间的概括，客户端只继续追问仍然不同的子区间。
+
+往返次数约为 log16(总数 / 叶子阈值)，传输量与差异的大小成正比，而不是与历史总长度成正比。
+"""
+
+from bisect import bisect_left
+from typing import Callable, Dict, List, Sequence, Set, Tuple
+
+HEX_DIGITS = "0123456789abcdef"
+# 服务器上区间内的哈希数不超过该值时，直接列出哈希而不是继续细分
+LEAF_THRESHOLD = 16
+# 单次请求最多携带的区间数
+MAX_RANGES_PER_REQUEST = 256
+
+
+def prefix_slice(sorted_hashes: Sequence[str], prefix: str) -> Sequence[str]:
+    """返回有序哈希列表中以 `prefix` 开头的连续片段。"""
+    if not prefix:
+        return sorted_hashes
+    start = bisect_left(sorted_hashes, prefix)
+    # 在十六进制字母表中，"g" 排在所有以 prefix 开头的字符串之后
+    end = bisect_left(sorted_hashes, prefix + "g", lo=start)
+    return sorted_hashes[start:end]
+
+
+def fingerprint(hashes: Sequence[str]) -> str:
+    """计算一组哈希的异或指纹 (与顺序无关)。"""
+    value = 0
+    for h in hashes:
+        value ^= int(h, 16)
+    return f"{value:064x}"
+
+
+def summarize(sorted_hashes: Sequence[str], prefix: str) -> Dict:
+    """
+    概括一个前缀区间。
+
+    Returns:
+        Dict: {"prefix", "count", "fingerprint"}。
+    """
+    members = prefix_slice(sorted_hashes, prefix)
+    return {"prefix": prefix, "count": len(members), "fingerprint": fingerprint(members)}
+
+
+def answer_ranges(sorted_hashes: Sequence[str], ranges: List[Dict]) -> List[Dict]:
+    """
+    服务器端：回答客户端提交的一批区间概括。
+
+    Args:
+        sorted_hashes (Sequence[str]): 服务器上该保险库的全部版本哈希 (已排序)。
+        ranges (List[Dict]): 客户端的区间概括。
+
+    Returns:
+        List[Dict]: 每个区间一项，包含 "match"、"hashes" 或 "children" 之一。
+    """
+    answers = []
+    for theirs in ranges:
+        prefix = theirs.get("prefix", "")
+        members = prefix_slice(sorted_hashes, prefix)
+        if len(members) == theirs.get("count") and fingerprint(members) == theirs.get("fingerprint"):
+            answers.append({"prefix": prefix, "match": True})
+        elif len(members) <= LEAF_THRESHOLD or not theirs.get("count") or len(prefix) >= 64:
+            answers.append({"prefix": prefix, "hashes": list(members)})
+        else:
+            answers.append({"prefix": prefix, "children": [
+                summarize(members, prefix + digit) for digit in HEX_DIGITS]})
+    return answers
+
+
+def reconcile(local_hashes: Sequence[str],
+              exchange: Callable[[List[Dict]], List[Dict]]) -> Tuple[Set[str], Set[str], int]:
+    """
+    客户端：通过若干轮区间比较求出本地与服务器版本集合的对称差。
+
+    Args:
+        local_hashes (Sequence[str]): 本地全部版本哈希。
+        exchange (Callable): 把一批区间概括发给服务器并返回其回答 (见 `answer_ranges`)。
+
+    Returns:
+        Tuple[Set[str], Set[str], int]: (只在本地的哈希, 只在服务器的哈希, 请求次数)。
+    """
+    local = sorted(local_hashes)
+    only_local: Set[str] = set()
+    only_remote: Set[str] = set()
+    pending = [summarize(local, "")]
+    requests = 0
+
+    while pending:
+        batch, pending = pending[:MAX_RANGES_PER_REQUEST], pending[MAX_RANGES_PER_REQUEST:]
+        requests += 1
+        for answer in exchange(batch):
+            prefix = answer["prefix"]
+            if answer.get("match"):
+                continue
+            if "hashes" in answer:
+                remote = set(answer["hashes"])
+                mine = set(prefix_slice(local, prefix))
+                only_local |= mine - remote
+                only_remote |= remote - mine
+                continue
+            for child in answer["children"]:
+                mine = summarize(local, child["prefix"])
+                if child["count"] == 0:
+                    only_local.update(prefix_slice(local, child["prefix"]))
+                elif (mine["count"], mine["fingerprint"]) != (child["count"], child["fingerprint"]):
+                    pending.append(mine)
+    return only_local, only_remote, requests
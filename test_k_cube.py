@@ -1,10 +1,23 @@
 # test_k_cube.py
 
+import functools
+import io
+import os
 import unittest
 import shutil
 import subprocess
+import time
 from pathlib import Path
 
+from benchmarks import startup
+from benchmarks.vault_generator import VaultSpec, generate_vault
+from k_cube_protocol.delta import DeltaError, apply_delta, make_delta
+from k_cube.fsmonitor import DirtyJournal
+from k_cube_protocol.pack import PackError, iter_pack, read_pack
+from k_cube.profiling import Profiler, render_span_tree
+from k_cube.repository import Repository
+from k_cube.utils import choose_codec, compress_blob, decompress_blob, encode_blob, hash_blob
+
 # --- 测试配置 ---
 TEST_DIR = Path("./temp_test_vault").resolve()
 KV_COMMAND = "kv"  # 确保 kv 命令在系统 PATH 中
@@ -161,5 +174,1069 @@ class KCubeIntegrationTest(unittest.TestCase):
         self.assertEqual(content_after_restore, "content a")
 
 
+class DirtyJournalTest(unittest.TestCase):
+    """直接调用 Repository，验证脏路径日志驱动的增量状态扫描。"""
+
+    def setUp(self):
+        if TEST_DIR.exists():
+            shutil.rmtree(TEST_DIR)
+        TEST_DIR.mkdir(parents=True)
+        self.repo = Repository.initialize(TEST_DIR)
+        self.journal = DirtyJournal(self.repo.kcube_path)
+
+    def tearDown(self):
+        self.repo.db.close()
+        shutil.rmtree(TEST_DIR)
+
+    def test_status_only_rechecks_journaled_paths(self):
+        """测试：日志有效时，只有被记录的路径会被重新检查。"""
+        (TEST_DIR / "a.md").write_text("a", encoding='utf-8')
+        (TEST_DIR / "b.md").write_text("b", encoding='utf-8')
+        self.journal.start()
+        self.assertEqual(self.repo.get_status().untracked_files, ["a.md", "b.md"])
+
+        # 未被记录的修改不会被看到：这正是日志带来的“信任”
+        (TEST_DIR / "c.md").write_text("c", encoding='utf-8')
+        self.assertEqual(self.repo.get_status().untracked_files, ["a.md", "b.md"])
+
+        self.journal.record("c.md")
+        (TEST_DIR / "a.md").unlink()
+        self.journal.record("a.md")
+        self.assertEqual(self.repo.get_status().untracked_files, ["b.md", "c.md"])
+
+    def test_invalid_journal_falls_back_to_full_scan(self):
+        """测试：会话结束或更换后，回退到全量扫描。"""
+        self.journal.start()
+        self.repo.get_status()
+        (TEST_DIR / "new.md").write_text("new", encoding='utf-8')
+
+        self.journal.start()
+        self.assertEqual(self.repo.get_status().untracked_files, ["new.md"])
+
+        self.journal.stop()
+        (TEST_DIR / "other.md").write_text("other", encoding='utf-8')
+        self.assertEqual(self.repo.get_status().untracked_files,
+                         ["new.md", "other.md"])
+
+
+class StartupBudgetTest(unittest.TestCase):
+    """`kv` 启动耗时回归测试：Shell 提示符集成会频繁调用 `kv status`。"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.results = startup.run_all(repeat=1)
+
+    def test_local_commands_do_not_import_network_stack(self):
+        """测试：本地命令不会导入 requests 及同步模块。"""
+        for name, result in self.results.items():
+            self.assertEqual(result["network_modules"], [], name)
+
+    def test_help_does_not_import_rich(self):
+        """测试：`kv --help` 不会加载 Rich。"""
+        self.assertFalse(self.results["help"]["rich_loaded"])
+
+    def test_import_time_within_budget(self):
+        """测试：导入耗时不超过预算。"""
+        for name, result in self.results.items():
+            self.assertLessEqual(result["import_ms"], startup.STARTUP_BUDGET_MS, name)
+
+
+class VaultGeneratorTest(unittest.TestCase):
+    """基准用合成保险库必须是确定性的，结果才能跨提交对比。"""
+
+    def test_same_spec_generates_identical_vaults(self):
+        spec = VaultSpec(file_count=20, size_median=256, binary_ratio=0.3, seed=7)
+        contents = []
+        for name in ("gen_a", "gen_b"):
+            root = TEST_DIR / name
+            files = generate_vault(root, spec)
+            contents.append({str(f): (root / f).read_bytes() for f in files})
+        shutil.rmtree(TEST_DIR)
+        self.assertEqual(len(contents[0]), 20)
+        self.assertEqual(contents[0], contents[1])
+
+
+class StoredCodecTest(unittest.TestCase):
+    """已压缩的附件以 stored 编码写入对象库，不再经过 zlib。"""
+
+    def setUp(self):
+        if TEST_DIR.exists():
+            shutil.rmtree(TEST_DIR)
+        TEST_DIR.mkdir(parents=True)
+        self.repo = Repository.initialize(TEST_DIR)
+
+    def tearDown(self):
+        self.repo.db.close()
+        shutil.rmtree(TEST_DIR)
+
+    def test_codec_choice_and_round_trip(self):
+        noise = os.urandom(64 * 1024)
+        text = b"knowledge note " * 4096
+        self.assertEqual(choose_codec(noise, "photo.jpg"), "stored")
+        self.assertEqual(choose_codec(b"\x89PNG\r\n\x1a\n" + text, "a.png"), "stored")
+        self.assertEqual(choose_codec(text, "note.md"), "zlib")
+        self.assertEqual(choose_codec(text, "data.bin"), "zlib")
+        for content, name in ((noise, "a.bin"), (text, "a.md")):
+            self.assertEqual(decompress_blob(encode_blob(content, name)), content)
+
+    def test_legacy_zlib_objects_are_not_reported_as_modified(self):
+        """测试：旧版本用 zlib 编码的附件，在内容未变时不应显示为修改。"""
+        noise = os.urandom(32 * 1024)
+        (TEST_DIR / "scan.pdf").write_bytes(noise)
+        legacy = compress_blob(noise)
+        legacy_hash = hash_blob(legacy)
+        self.repo._write_blob(legacy_hash, legacy, is_compressed=True)
+        self.repo._write_staging_area({"scan.pdf": legacy_hash})
+
+        self.assertFalse(self.repo.get_status().has_unstaged_changes())
+        self.repo.add([TEST_DIR])
+        self.assertEqual(self.repo._read_staging_area(), {"scan.pdf": legacy_hash})
+
+
+class ServerTestCase(unittest.TestCase):
+    """需要 k-cube-server 的依赖的测试：在本进程中启动临时服务器，仓库关联到服务器上新建的保险库。"""
+
+    def setUp(self):
+        try:
+            from benchmarks.server import LocalServer
+        except ImportError as e:
+            self.skipTest(f"缺少服务器依赖: {e}")
+        if TEST_DIR.exists():
+            shutil.rmtree(TEST_DIR)
+        TEST_DIR.mkdir(parents=True)
+        self.server = LocalServer().__enter__()
+        self.addCleanup(self.server.__exit__, None, None, None)
+        self.client = self.server.client()
+        self.repo = Repository.initialize(TEST_DIR)
+        self.repo.vault_id = self.client.create_vault("test")['id']
+
+    def tearDown(self):
+        self.repo.db.close()
+        shutil.rmtree(TEST_DIR)
+
+    def _commit(self, summary):
+        self.repo.add([TEST_DIR])
+        self.repo.commit({"type": "Test", "summary": summary})
+
+
+class BlobNegotiationTest(ServerTestCase):
+    """推送时只上传服务器缺少的 blob。"""
+
+    def test_incremental_push_uploads_only_missing_blobs(self):
+        from k_cube.sync import Synchronizer
+        for i in range(5):
+            (TEST_DIR / f"note{i}.md").write_text(f"note {i}", encoding='utf-8')
+        self._commit("initial")
+        first = Synchronizer(self.repo, self.client).sync()
+        self.assertEqual(first.blobs_uploaded, 5)
+
+        time.sleep(1)
+        (TEST_DIR / "note0.md").write_text("edited", encoding='utf-8')
+        self._commit("edit")
+        second = Synchronizer(self.repo, self.client).sync()
+        self.assertEqual(second.versions_uploaded, 1)
+        self.assertEqual(second.blobs_uploaded, 1)
+        self.assertGreater(second.bytes_uploaded, 0)
+
+    def test_push_without_negotiation_uploads_all_blobs(self):
+        """测试：服务器不支持协商时不调用协商接口，推送版本引用的全部对象。"""
+        from k_cube.sync import Synchronizer
+        (TEST_DIR / "a.md").write_text("alpha", encoding='utf-8')
+        self._commit("initial")
+        Synchronizer(self.repo, self.client).sync()
+
+        time.sleep(1)
+        (TEST_DIR / "b.md").write_text("beta", encoding='utf-8')
+        self._commit("add b")
+        self.client.get_capabilities().discard("blob-negotiation")
+        self.client.find_missing_blobs = None
+        synchronizer = Synchronizer(self.repo, self.client)
+        plan = synchronizer.plan()
+        self.assertEqual(synchronizer.estimate(plan).blobs_to_upload, 2)
+        self.assertEqual(synchronizer.execute(plan).blobs_uploaded, 2)
+
+
+class SyncPlanTest(ServerTestCase):
+    """先生成同步计划，再按计划执行。"""
+
+    def test_plan_then_execute_negotiates_once(self):
+        """测试：一次状态扫描驱动暂存，计划携带方向和预计字节数，执行时不再协商。"""
+        from k_cube.sync import Synchronizer
+        for i in range(3):
+            (TEST_DIR / f"note{i}.md").write_text(f"note {i}", encoding='utf-8')
+        self._commit("initial")
+        Synchronizer(self.repo, self.client).sync()
+
+        time.sleep(1)
+        (TEST_DIR / "note0.md").write_text("edited " * 100, encoding='utf-8')
+        (TEST_DIR / "note1.md").unlink()
+        (TEST_DIR / "new.md").write_text("brand new", encoding='utf-8')
+        status = self.repo.get_status()
+        self.assertTrue(self.repo.add_from_status(status))
+        self.repo.commit({"type": "Test", "summary": "edit"})
+        manifest = self.repo.db.get_version_manifest(self.repo.db.get_latest_version_hash())
+        self.assertEqual(sorted(manifest), ["new.md", "note0.md", "note2.md"])
+
+        synchronizer = Synchronizer(self.repo, self.client)
+        plan = synchronizer.plan()
+        self.assertEqual((plan.direction, len(plan.versions_to_upload)), ("upload", 1))
+        new_blobs = [manifest["note0.md"], manifest["new.md"]]
+        self.assertEqual(plan.estimated_upload_bytes,
+                         sum(self.repo.db.get_blob_sizes(new_blobs).values()))
+        self.assertIn("上传 1 个版本", plan.describe())
+
+        self.client.check_sync_state = self.client.reconcile_versions = None
+        result = synchronizer.execute(plan)
+        self.assertEqual((result.versions_uploaded, result.blobs_uploaded), (1, 2))
+
+
+class SyncDryRunTest(ServerTestCase):
+    """同步预演：估算传输量而不写入任何一端。"""
+
+    def test_dry_run_estimates_without_writing(self):
+        """测试：预演报告两个方向的对象和字节数，但不修改本地或服务器。"""
+        from k_cube.sync import Synchronizer
+        (TEST_DIR / "a.md").write_text("alpha", encoding='utf-8')
+        (TEST_DIR / "b.bin").write_bytes(os.urandom(4096))
+        self._commit("initial")
+        local_bytes = sum(self.repo.db.get_blob_sizes(self.repo.db.get_all_blob_hashes()).values())
+
+        synchronizer = Synchronizer(self.repo, self.client)
+        estimate = synchronizer.estimate(synchronizer.plan())
+        self.assertEqual((estimate.versions_to_upload, estimate.blobs_to_upload), (1, 2))
+        self.assertEqual(estimate.upload_bytes, local_bytes)
+        self.assertIsNone(estimate.estimated_seconds)
+        self.assertEqual(self.client.check_sync_state(self.repo.vault_id, [])["versions_to_download"], [])
+        self.assertIsNone(self.repo.config.get("sync_cursor"))
+
+        Synchronizer(self.repo, self.client).sync()
+        clone_dir = TEST_DIR.parent / "temp_test_clone"
+        self.addCleanup(shutil.rmtree, clone_dir, True)
+        clone = Repository.initialize(clone_dir)
+        self.addCleanup(clone.db.close)
+        clone.vault_id = self.repo.vault_id
+        puller = Synchronizer(clone, self.client)
+        estimate = puller.estimate(puller.plan())
+        self.assertEqual((estimate.versions_to_download, estimate.blobs_to_download), (1, 2))
+        self.assertEqual(estimate.download_bytes, local_bytes)
+        self.assertEqual(clone.db.get_all_version_hashes(), [])
+
+
+class SyncTelemetryTest(ServerTestCase):
+    """同步统计与本地同步记录。"""
+
+    def test_sync_records_telemetry(self):
+        """测试：同步结果包含流量与各阶段耗时，并追加到本地同步记录。"""
+        from k_cube.sync import Synchronizer
+        from k_cube.sync_log import SyncLog
+        (TEST_DIR / "a.md").write_text("alpha " * 2000, encoding='utf-8')
+        self._commit("initial")
+        synchronizer = Synchronizer(self.repo, self.client)
+        result = synchronizer.execute(synchronizer.plan())
+        self.assertGreater(result.requests, 0)
+        self.assertGreater(result.bytes_sent, 0)
+        self.assertLessEqual(result.bytes_sent_compressed, result.bytes_sent)
+        self.assertEqual(set(result.phase_seconds), {"negotiate", "upload"})
+        self.assertIsNotNone(result.throughput)
+
+        Synchronizer(self.repo, self.client).sync()
+        entries = SyncLog(self.repo.kcube_path).entries()
+        self.assertEqual(len(entries), 2)
+        self.assertEqual(entries[0]["bytes_sent"], result.bytes_sent)
+        self.assertEqual((entries[0]["direction"], entries[1]["direction"]), ("upload", "none"))
+
+
+class SyncJournalResumeTest(ServerTestCase):
+    """中断的拉取从同步日志恢复。"""
+
+    def test_interrupted_pull_resumes_from_journal(self):
+        """测试：中断的拉取重新开始时复用已下载的对象和版本元数据。"""
+        from k_cube.sync import Synchronizer
+        for i in range(4):
+            (TEST_DIR / f"note{i}.md").write_text(f"note {i}", encoding='utf-8')
+        self._commit("initial")
+        Synchronizer(self.repo, self.client).sync()
+
+        clone_dir = TEST_DIR.parent / "temp_test_clone"
+        self.addCleanup(shutil.rmtree, clone_dir, True)
+        clone = Repository.initialize(clone_dir)
+        clone.vault_id = self.repo.vault_id
+        self.addCleanup(clone.db.close)
+
+        fetched = []
+
+        class Flaky(Synchronizer):
+            max_batch_blobs = 1
+            fail_after = 2
+
+            def _download_blobs(self, blob_hashes):
+                if len(fetched) >= self.fail_after:
+                    raise ConnectionError("网络中断")
+                fetched.extend(blob_hashes)
+                return super()._download_blobs(blob_hashes)
+
+        with self.assertRaises(ConnectionError):
+            Flaky(clone, self.client, concurrency=1).sync()
+        self.assertEqual(clone.db.get_all_version_hashes(), [])
+
+        # 模拟写入对象文件后、登记数据库前被中断的 blob
+        orphan = next(h for h in self.repo.db.get_all_blob_hashes() if h not in fetched)
+        orphan_path = clone.versions_path / orphan[:2] / orphan[2:]
+        orphan_path.parent.mkdir(exist_ok=True)
+        orphan_path.write_bytes(self.repo._read_blob(orphan, compressed=True))
+
+        self.client.download_versions = None  # 元数据应当来自同步日志
+        resumed = Flaky(clone, self.client, concurrency=1)
+        resumed.fail_after = 10
+        self.assertEqual(resumed.sync().versions_downloaded, 1)
+        self.assertEqual(len(fetched), 3)
+        self.assertEqual(len(clone.db.get_all_blob_hashes()), 4)
+        self.assertFalse((clone.kcube_path / "sync" / "pull.json").exists())
+
+
+class PartialCloneTest(ServerTestCase):
+    """部分克隆：对象按需获取。"""
+
+    def test_partial_clone_fetches_history_on_demand(self):
+        """测试：部分克隆只下载最新版本的对象，恢复旧版本时按需批量获取缺失对象。"""
+        from k_cube.sync import Synchronizer
+        (TEST_DIR / "a.md").write_text("old a", encoding='utf-8')
+        (TEST_DIR / "b.md").write_text("old b", encoding='utf-8')
+        self._commit("v1")
+        old_hash = self.repo.db.get_latest_version_hash()
+        time.sleep(1)
+        (TEST_DIR / "a.md").write_text("new a", encoding='utf-8')
+        (TEST_DIR / "b.md").write_text("new b", encoding='utf-8')
+        self._commit("v2")
+        Synchronizer(self.repo, self.client).sync()
+
+        clone_dir = TEST_DIR.parent / "temp_test_clone"
+        self.addCleanup(shutil.rmtree, clone_dir, True)
+        clone = Repository.initialize(clone_dir)
+        clone.vault_id = self.repo.vault_id
+        clone.config.set("promisor", {"vault_id": clone.vault_id})
+        self.addCleanup(clone.db.close)
+        puller = Synchronizer(clone, self.client)
+        self.assertEqual(puller.sync().versions_downloaded, 2)
+        self.assertEqual(len(clone.db.get_all_blob_hashes()), 2)
+
+        fetches = []
+        fetch = clone.promisor
+        clone.promisor = lambda hashes: (fetches.append(list(hashes)), fetch(hashes))
+        clone.restore(old_hash)
+        self.assertEqual(len(fetches), 1)
+        self.assertEqual(len(fetches[0]), 2)
+        self.assertEqual((clone_dir / "a.md").read_text(encoding='utf-8'), "old a")
+        self.assertEqual((clone_dir / "b.md").read_text(encoding='utf-8'), "old b")
+
+
+class ShallowCloneTest(ServerTestCase):
+    """浅克隆与加深历史。"""
+
+    def test_shallow_clone_and_deepen(self):
+        """测试：浅克隆只下载最近的版本，同步不会补齐更早的历史，加深后边界随之移动。"""
+        from k_cube.sync import Synchronizer
+        hashes = []
+        for i in range(3):
+            if i:
+                time.sleep(1)
+            (TEST_DIR / "note.md").write_text(f"note {i}", encoding='utf-8')
+            self._commit(f"v{i}")
+            hashes.append(self.repo.db.get_latest_version_hash())
+        Synchronizer(self.repo, self.client).sync()
+
+        clone_dir = TEST_DIR.parent / "temp_test_clone"
+        self.addCleanup(shutil.rmtree, clone_dir, True)
+        clone = Repository.initialize(clone_dir)
+        clone.vault_id = self.repo.vault_id
+        self.addCleanup(clone.db.close)
+        synchronizer = Synchronizer(clone, self.client)
+        self.assertEqual(synchronizer.fetch_history(depth=1), 1)
+        self.assertEqual(clone.shallow["boundary"], hashes[2])
+        self.assertEqual(synchronizer.sync().versions_downloaded, 0)
+        with self.assertRaises(ValueError):
+            clone.revert(hashes[2])
+
+        self.assertEqual(synchronizer.fetch_history(deepen=1), 1)
+        self.assertEqual(clone.shallow["boundary"], hashes[1])
+        self.assertEqual(synchronizer.fetch_history(deepen=5), 1)
+        self.assertIsNone(clone.shallow)
+        self.assertEqual(set(clone.db.get_all_version_hashes()), set(hashes))
+
+
+class SnapshotCloneTest(ServerTestCase):
+    """从服务器快照克隆。"""
+
+    def test_snapshot_clone_checks_out_latest_version(self):
+        """测试：快照一次请求下载最新版本及其对象，按保险库变更序号缓存，其余历史由同步补齐。"""
+        from k_cube.sync import Synchronizer
+        (TEST_DIR / "a.md").write_text("old", encoding='utf-8')
+        self._commit("v1")
+        time.sleep(1)
+        (TEST_DIR / "a.md").write_text("new", encoding='utf-8')
+        (TEST_DIR / "b.bin").write_bytes(os.urandom(2048))
+        self._commit("v2")
+        latest = self.repo.db.get_latest_version_hash()
+        Synchronizer(self.repo, self.client).sync()
+
+        clone_dir = TEST_DIR.parent / "temp_test_clone"
+        self.addCleanup(shutil.rmtree, clone_dir, True)
+        clone = Repository.initialize(clone_dir)
+        clone.vault_id = self.repo.vault_id
+        self.addCleanup(clone.db.close)
+        synchronizer = Synchronizer(clone, self.client)
+        self.assertEqual(synchronizer.fetch_snapshot(), latest)
+        self.assertEqual(clone.db.get_all_version_hashes(), [latest])
+        self.assertEqual(len(clone.db.get_all_blob_hashes()), 2)
+        clone.restore(latest)
+        self.assertEqual((clone_dir / "b.bin").read_bytes(), (TEST_DIR / "b.bin").read_bytes())
+
+        # 第二次请求命中缓存：ETag 相同，条件请求返回 304
+        url = f"{self.server.url}/api/v1/vaults/{clone.vault_id}/sync/snapshot"
+        etag = self.client.session.get(url).headers["ETag"]
+        self.assertEqual(self.client.session.get(
+            url, headers={"If-None-Match": etag}).status_code, 304)
+
+        self.assertEqual(synchronizer.sync().versions_downloaded, 1)
+
+
+class ChangeEventsTest(ServerTestCase):
+    """服务器推送的变更事件流。"""
+
+    def test_change_events_announce_new_versions(self):
+        """测试：一个事件流连接先报告所有保险库的序号，写入新版本后推送变更。"""
+        import threading
+        from k_cube.sync import Synchronizer
+        other_vault = self.client.create_vault("other")['id']
+        events = []
+        ready = threading.Event()
+
+        def listen():
+            for event, data in self.server.client().stream_events():
+                events.append((event, data))
+                ready.set()
+                if event == "change":
+                    return
+        listener = threading.Thread(target=listen, daemon=True)
+        listener.start()
+        self.assertTrue(ready.wait(10))
+        self.assertEqual(events[0], ("snapshot", {"vaults": {self.repo.vault_id: 0, other_vault: 0}}))
+
+        (TEST_DIR / "note.md").write_text("hello", encoding='utf-8')
+        self._commit("initial")
+        Synchronizer(self.repo, self.client).sync()
+        listener.join(10)
+        self.assertEqual(events[-1], ("change", {"vault_id": self.repo.vault_id, "seq": 1}))
+
+
+class TransportRetryTest(unittest.TestCase):
+    """传输层：暂时性错误的重试与幂等性判断 (不需要服务器)。"""
+
+    def setUp(self):
+        import requests
+        from k_cube.client import APIClient
+        self.requests = requests
+        self.client = APIClient("http://kcube.invalid", max_retries=2)
+        self.client.backoff_base = 0
+        self.client._capabilities = set()
+        self.calls = []
+
+    def _respond(self, *statuses):
+        statuses = list(statuses)
+
+        def fake_request(method, url, **kwargs):
+            self.calls.append(kwargs["headers"].get("Idempotency-Key"))
+            status = statuses.pop(0)
+            if isinstance(status, Exception):
+                raise status
+            response = self.requests.Response()
+            response.status_code = status
+            response.raw = io.BytesIO(b'{"ok": true}')
+            return response
+        self.client.session.request = fake_request
+
+    def test_idempotent_requests_retry_with_backoff(self):
+        from k_cube.client import APIError
+        self._respond(503, self.requests.exceptions.ReadTimeout("slow"), 200)
+        self.assertEqual(self.client._request("GET", "api/v1/vaults"), {"ok": True})
+        self.assertEqual(len(self.calls), 3)
+
+        self._respond(503, 503, 503)
+        with self.assertRaises(APIError) as ctx:
+            self.client._request("GET", "api/v1/vaults")
+        self.assertEqual(ctx.exception.status_code, 503)
+        summary = self.client.metrics.summary()["GET api/v1/vaults"]
+        self.assertEqual((summary["count"], summary["retries"], summary["errors"]), (2, 4, 1))
+
+    def test_post_retries_only_with_server_idempotency_support(self):
+        from k_cube.client import APIError
+        self.calls.clear()
+        self._respond(503, 200)
+        with self.assertRaises(APIError):
+            self.client._request("POST", "api/v1/vaults/v1/sync/versions", json={"versions": []})
+        self.assertEqual(len(self.calls), 1)
+
+        self.calls.clear()
+        self.client._capabilities = {"idempotency-keys"}
+        self._respond(502, 200)
+        self.client._request("POST", "api/v1/vaults/v1/sync/versions", json={"versions": []})
+        self.assertEqual(len(self.calls), 2)
+        self.assertIsNotNone(self.calls[0])
+        self.assertEqual(self.calls[0], self.calls[1])
+
+
+class IdempotencyKeyTest(ServerTestCase):
+    """服务器按 Idempotency-Key 重放重复的写请求。"""
+
+    def test_idempotency_key_replays_recorded_response(self):
+        """测试：带相同 Idempotency-Key 的重复上传不再执行，而是重放第一次的响应。"""
+        from k_cube.sync import Synchronizer
+        (TEST_DIR / "note.md").write_text("hello", encoding='utf-8')
+        self._commit("initial")
+        Synchronizer(self.repo, self.client).sync()
+        self.assertTrue(self.client.supports("idempotency-keys"))
+
+        url = f"{self.server.url}/api/v1/vaults/{self.repo.vault_id}/sync/versions"
+        version = dict(self.repo.db.get_version_data(self.repo.db.get_latest_version_hash()),
+                       hash="f" * 64)
+        post = functools.partial(self.client.session.post, url, json={"versions": [version]},
+                                 headers={"Idempotency-Key": "retry-1"})
+        first, second = post(), post()
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(second.headers.get("Idempotent-Replayed"), "true")
+        self.assertEqual(first.json()["current_seq"], 2)
+
+        # 超过保留时间的记录即使尚未被清理也不再重放
+        from datetime import datetime, timezone
+        from app import db
+        from app.idempotency import KEY_TTL
+        from app.models import IdempotencyRecord
+        with self.server.app.app_context():
+            for record in IdempotencyRecord.query.all():
+                record.created_at = datetime.now(timezone.utc).replace(tzinfo=None) - KEY_TTL * 2
+            db.session.commit()
+        self.assertIsNone(post().headers.get("Idempotent-Replayed"))
+        self.assertEqual(post().headers.get("Idempotent-Replayed"), "true")
+
+
+def _note_text(words: int, seed: int = 0) -> bytes:
+    """生成可压缩但不重复的文本，用于增量传输测试。"""
+    import random
+    rng = random.Random(seed)
+    vocabulary = [f"word{i}" for i in range(3000)]
+    return " ".join(rng.choice(vocabulary) for _ in range(words)).encode('utf-8')
+
+
+class BlobDeltaTest(unittest.TestCase):
+    """对象增量的计算、重建与校验。"""
+
+    def test_round_trip_for_both_codecs(self):
+        for path, base_raw in (("note.md", _note_text(40000)), ("data.bin", os.urandom(200000))):
+            target_raw = base_raw[:5000] + b"inserted text" + base_raw[9000:] + b"appended"
+            base, target = encode_blob(base_raw, path), encode_blob(target_raw, path)
+            delta = make_delta(base, target)
+            self.assertIsNotNone(delta, path)
+            self.assertLess(len(delta), len(target) // 10)
+            self.assertEqual(apply_delta(base, delta, hash_blob(target)), target)
+
+    def test_rejects_wrong_base_and_small_objects(self):
+        base, target = encode_blob(_note_text(40000), "a.md"), encode_blob(_note_text(40000) + b"!", "a.md")
+        delta = make_delta(base, target)
+        with self.assertRaises(DeltaError):
+            apply_delta(encode_blob(_note_text(40000, seed=1), "a.md"), delta, hash_blob(target))
+        self.assertIsNone(make_delta(encode_blob(b"small", "a.md"), encode_blob(b"small!", "a.md")))
+
+    def test_stored_magic_matches_blob_codec(self):
+        from k_cube import utils
+        from k_cube_protocol import delta
+        self.assertEqual(delta.STORED_MAGIC, utils.STORED_MAGIC)
+
+
+class DeltaTransferTest(ServerTestCase):
+    """对象增量经服务器上传和下载。"""
+
+    def test_modified_large_file_transfers_as_delta(self):
+        """测试：大文件的小改动以增量上传和下载，节省的字节数记录在 SyncResult 中。"""
+        from k_cube.sync import Synchronizer
+        original = _note_text(40000)
+        (TEST_DIR / "big.md").write_text(original.decode('utf-8'), encoding='utf-8')
+        self._commit("v1")
+        Synchronizer(self.repo, self.client).sync()
+
+        clone_dir = TEST_DIR.parent / "temp_test_clone"
+        self.addCleanup(shutil.rmtree, clone_dir, True)
+        clone = Repository.initialize(clone_dir)
+        clone.vault_id = self.repo.vault_id
+        self.addCleanup(clone.db.close)
+        Synchronizer(clone, self.client).sync()
+
+        time.sleep(1)
+        edited = original[:1000] + b"a small edit" + original[1000:]
+        (TEST_DIR / "big.md").write_bytes(edited)
+        self._commit("v2")
+        pushed = Synchronizer(self.repo, self.client).sync()
+        self.assertEqual(pushed.blobs_delta_uploaded, 1)
+        self.assertGreater(pushed.bytes_saved_by_delta, pushed.bytes_uploaded * 10)
+
+        pulled = Synchronizer(clone, self.client).sync()
+        self.assertEqual(pulled.blobs_delta_downloaded, 1)
+        self.assertGreater(pulled.bytes_saved_by_delta, 0)
+        clone.restore(clone.db.get_latest_version_hash())
+        self.assertEqual((clone_dir / "big.md").read_bytes(), edited)
+
+
+class LocalRemoteTest(unittest.TestCase):
+    """file:// 远程：不需要服务器即可在两个仓库之间同步。"""
+
+    def setUp(self):
+        import tempfile
+        from k_cube.local_remote import open_remote
+        for path in (TEST_DIR, TEST_DIR.parent / "temp_test_clone"):
+            if path.exists():
+                shutil.rmtree(path)
+        self.remote_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.remote_dir, True)
+        self.client = open_remote(self.remote_dir.as_uri())
+        self.repo = Repository.initialize(TEST_DIR)
+        self.repo.vault_id = self.client.create_vault("local")['id']
+
+    def tearDown(self):
+        self.repo.db.close()
+        shutil.rmtree(TEST_DIR)
+
+    def test_sync_round_trip_through_directory(self):
+        from k_cube.sync import Synchronizer
+        (TEST_DIR / "a.md").write_text("alpha", encoding='utf-8')
+        (TEST_DIR / "b.bin").write_bytes(os.urandom(4096))
+        self.repo.add([TEST_DIR])
+        self.repo.commit({"type": "Test", "summary": "initial"})
+        self.assertEqual(Synchronizer(self.repo, self.client).sync().blobs_uploaded, 2)
+
+        clone_dir = TEST_DIR.parent / "temp_test_clone"
+        self.addCleanup(shutil.rmtree, clone_dir, True)
+        clone = Repository.initialize(clone_dir)
+        self.addCleanup(clone.db.close)
+        clone.vault_id = self.repo.vault_id
+        self.assertEqual(Synchronizer(clone, self.client).sync().versions_downloaded, 1)
+        clone.restore(clone.db.get_latest_version_hash())
+        for name in ("a.md", "b.bin"):
+            self.assertEqual((clone_dir / name).read_bytes(), (TEST_DIR / name).read_bytes())
+
+        # 反方向：克隆中的修改经由同一个目录回到原仓库，游标只列出新版本
+        time.sleep(1)
+        (clone_dir / "a.md").write_text("edited", encoding='utf-8')
+        clone.add([clone_dir])
+        clone.commit({"type": "Test", "summary": "edit"})
+        self.assertEqual(Synchronizer(clone, self.client).sync().blobs_uploaded, 1)
+        pulled = Synchronizer(self.repo, self.client).sync()
+        self.assertEqual((pulled.versions_downloaded, pulled.versions_uploaded), (1, 0))
+        self.repo.restore(self.repo.db.get_latest_version_hash())
+        self.assertEqual((TEST_DIR / "a.md").read_text(encoding='utf-8'), "edited")
+        self.assertEqual(self.client.check_sync_state(self.repo.vault_id, [])["current_seq"], 2)
+
+
+class BundleTest(unittest.TestCase):
+    """离线同步包的创建、增量导入与校验。"""
+
+    def setUp(self):
+        for path in (TEST_DIR, TEST_DIR.parent / "temp_test_clone"):
+            if path.exists():
+                shutil.rmtree(path)
+        self.repo = Repository.initialize(TEST_DIR)
+        self.repo.vault_id = "offline-vault"
+        self.clone_dir = TEST_DIR.parent / "temp_test_clone"
+        self.clone = Repository.initialize(self.clone_dir)
+        self.bundle_path = TEST_DIR.parent / "temp_test.kcbundle"
+
+    def tearDown(self):
+        self.repo.db.close()
+        self.clone.db.close()
+        shutil.rmtree(TEST_DIR)
+        shutil.rmtree(self.clone_dir)
+        self.bundle_path.unlink(missing_ok=True)
+
+    def _commit(self, name, content):
+        (TEST_DIR / name).write_text(content, encoding='utf-8')
+        self.repo.add([TEST_DIR])
+        self.repo.commit({"type": "Test", "summary": name})
+        return self.repo.db.get_latest_version_hash()
+
+    def test_incremental_bundles_apply_in_order(self):
+        from k_cube.bundle import BundleError, apply_bundle, create_bundle
+        first = self._commit("a.md", "alpha")
+        time.sleep(1)
+        self._commit("b.md", "beta")
+
+        summary = create_bundle(self.repo, self.bundle_path, since=first[:8])
+        self.assertEqual((summary["versions"], summary["blobs"]), (1, 1))
+        with self.assertRaises(BundleError):
+            apply_bundle(self.clone, self.bundle_path)  # 缺少基准版本
+
+        create_bundle(self.repo, self.bundle_path)
+        self.assertEqual(apply_bundle(self.clone, self.bundle_path)["versions"], 2)
+        self.assertEqual(self.clone.vault_id, "offline-vault")
+        self.clone.restore(self.clone.db.get_latest_version_hash())
+        self.assertEqual((self.clone_dir / "b.md").read_text(encoding='utf-8'), "beta")
+
+    def test_base_is_the_only_assumed_version(self):
+        """测试：导入方缺少早于基准的并发版本时，新版本仍能带上它们共用的对象。"""
+        from k_cube.bundle import apply_bundle, create_bundle
+        first = self._commit("a.md", "alpha")
+        time.sleep(1)
+        self._commit("x.md", "shared")  # 另一台设备的版本，导入方没有
+        time.sleep(1)
+        (TEST_DIR / "x.md").unlink()
+        self.repo.add_from_status(self.repo.get_status())
+        self.repo.commit({"type": "Test", "summary": "remove x"})
+        base = self.repo.db.get_latest_version_hash()
+        time.sleep(1)
+        self._commit("x.md", "shared")
+
+        known = [self.repo.db.get_version_data(h) for h in (first, base)]
+        blobs = sorted({h for v in known for h in v['manifest'].values()})
+        self.clone._write_blobs([(h, self.repo._read_blob(h, compressed=True)) for h in blobs])
+        self.clone.db.bulk_insert_versions(known)
+        self.clone.vault_id = self.repo.vault_id
+
+        create_bundle(self.repo, self.bundle_path, since=base)
+        self.assertEqual(apply_bundle(self.clone, self.bundle_path)["versions"], 1)
+        self.clone.restore(self.clone.db.get_latest_version_hash())
+        self.assertEqual((self.clone_dir / "x.md").read_text(encoding='utf-8'), "shared")
+
+    def test_corrupted_bundle_is_rejected(self):
+        from k_cube.bundle import BundleError, apply_bundle, create_bundle
+        self._commit("a.md", "alpha" * 100)
+        create_bundle(self.repo, self.bundle_path)
+        data = bytearray(self.bundle_path.read_bytes())
+        data[-60] ^= 0xFF
+        self.bundle_path.write_bytes(bytes(data))
+        with self.assertRaises(BundleError):
+            apply_bundle(self.clone, self.bundle_path)
+        self.assertEqual(self.clone.db.get_all_version_hashes(), [])
+
+
+class CompressionTest(unittest.TestCase):
+    """HTTP 传输压缩：解压后的大小上限与压缩请求体的大小上限。"""
+
+    def test_decompress_stops_at_size_limit(self):
+        from k_cube_protocol.compression import CompressionError, available_encodings, compress, decompress
+        data = b"\0" * (1024 * 1024)
+        for encoding in available_encodings():
+            encoded = compress(data, encoding)
+            self.assertEqual(decompress(encoded, encoding), data)
+            with self.assertRaises(CompressionError):
+                decompress(encoded, encoding, max_size=1000)
+
+    def test_middleware_rejects_oversized_compressed_body(self):
+        import sys
+        from benchmarks.server import SERVER_DIR
+        from k_cube_protocol.compression import compress
+        if str(SERVER_DIR) not in sys.path:
+            sys.path.insert(0, str(SERVER_DIR))
+        try:
+            from app.compression import RequestDecompressionMiddleware
+        except ImportError as e:
+            self.skipTest(f"缺少服务器依赖: {e}")
+        received = []
+        middleware = RequestDecompressionMiddleware(
+            lambda environ, start_response: received.append(environ['wsgi.input'].read()) or [],
+            max_compressed_size=100)
+
+        def post(body, with_length):
+            statuses = []
+            environ = {'HTTP_CONTENT_ENCODING': 'gzip', 'wsgi.input': io.BytesIO(body)}
+            if with_length:
+                environ['CONTENT_LENGTH'] = str(len(body))
+            middleware(environ, lambda status, headers: statuses.append(status))
+            return statuses[0][:3] if statuses else None
+
+        oversized = os.urandom(101)
+        self.assertEqual(post(oversized, True), "413")
+        self.assertEqual(post(oversized, False), "413")
+        self.assertIsNone(post(compress(b'{"a": 1}', "gzip"), False))
+        self.assertEqual(received, [b'{"a": 1}'])
+
+
+class CompressionTransportTest(ServerTestCase):
+    """请求体和响应体的压缩传输。"""
+
+    def test_large_json_bodies_are_compressed(self):
+        """测试：较大的请求体和响应体经过压缩传输，小请求保持原样。"""
+        from k_cube.profiling import profiler
+        (TEST_DIR / "folder").mkdir()
+        for i in range(30):
+            (TEST_DIR / f"folder/note{i}.md").write_text(f"note {i}", encoding='utf-8')
+        # 多个版本的清单共享大部分路径和哈希，这正是压缩的收益所在
+        for rev in range(3):
+            (TEST_DIR / "folder/note0.md").write_text(f"rev {rev}", encoding='utf-8')
+            self._commit(f"rev {rev}")
+            time.sleep(1)
+        versions = [self.repo.db.get_version_data(h)
+                    for h in self.repo.db.get_all_version_hashes()]
+        v_hash = self.repo.db.get_latest_version_hash()
+
+        # 关闭清单增量，单独观察压缩的效果
+        self.client.get_capabilities().discard("manifest-delta")
+        with profiler.capture("upload") as root:
+            self.client.upload_versions(self.repo.vault_id, versions)
+        counters = root.children[-1].counters
+        self.assertLess(counters["bytes_sent"] * 3, counters["bytes_uncompressed"])
+
+        response = self.client.session.post(
+            f"{self.server.url}/api/v1/vaults/{self.repo.vault_id}/sync/versions/query",
+            json={"hashes": [v_hash]}, headers={"Accept-Encoding": "gzip"}, stream=True)
+        self.assertEqual(response.headers.get("Content-Encoding"), "gzip")
+        self.assertEqual(response.json()["versions"][0]["manifest"],
+                         self.repo.db.get_version_data(v_hash)["manifest"])
+
+        with profiler.capture("small") as root:
+            self.client.check_sync_state(self.repo.vault_id, [v_hash])
+        self.assertNotIn("bytes_uncompressed", root.children[-1].counters)
+
+
+class ManifestDeltaTest(unittest.TestCase):
+    """清单增量编码与还原。"""
+
+    def test_encode_decode_round_trip(self):
+        from k_cube_protocol.manifest import MissingBaseError, decode_versions, encode_versions
+        base = {f"n{i}.md": f"{i:064x}" for i in range(10)}
+        v1 = dict(base, **{"n1.md": "a" * 64})
+        v2 = {k: h for k, h in v1.items() if k != "n2.md"}
+        versions = [{"hash": "v2", "timestamp": 2, "manifest": v2},
+                    {"hash": "v1", "timestamp": 1, "manifest": v1}]
+
+        encoded = encode_versions(versions, "v0", base)
+        self.assertEqual([(v["hash"], v["base"]) for v in encoded], [("v1", "v0"), ("v2", "v1")])
+        self.assertEqual(encoded[1]["delta"], {"changed": {}, "removed": ["n2.md"]})
+        decoded = decode_versions(encoded, {"v0": base}.get)
+        self.assertEqual([v["manifest"] for v in decoded], [v1, v2])
+
+        with self.assertRaises(MissingBaseError) as ctx:
+            decode_versions(encoded, lambda h: None)
+        self.assertEqual(ctx.exception.missing, ["v0"])
+        self.assertIn("manifest", encode_versions(versions)[0])
+
+
+class ManifestDeltaTransferTest(ServerTestCase):
+    """清单增量经服务器上传和下载。"""
+
+    def test_manifest_deltas_round_trip_through_server(self):
+        """测试：以增量上传的版本在服务器上还原，并能以增量下载回完整清单。"""
+        from k_cube.sync import Synchronizer
+        self.assertTrue(self.client.supports("manifest-delta"))
+        for i in range(20):
+            (TEST_DIR / f"note{i}.md").write_text(f"note {i}", encoding='utf-8')
+        self._commit("rev 0")
+        Synchronizer(self.repo, self.client).sync()
+        for rev in range(1, 3):
+            time.sleep(1)
+            (TEST_DIR / f"note{rev}.md").write_text(f"rev {rev}", encoding='utf-8')
+            (TEST_DIR / f"note{10 + rev}.md").unlink()
+            self._commit(f"rev {rev}")
+        sent = []
+        self.client._request = self._recording(self.client._request, sent)
+        Synchronizer(self.repo, self.client).sync()
+        uploaded = next(kw["json"]["versions"] for method, endpoint, kw in sent
+                        if endpoint.endswith("/sync/versions"))
+        self.assertEqual([len(v["delta"]["changed"]) for v in uploaded], [1, 1])
+
+        hashes = self.repo.db.get_all_version_hashes()
+        downloaded = self.client.download_versions(self.repo.vault_id, hashes)
+        self.assertEqual({v["hash"]: v["manifest"] for v in downloaded},
+                         {h: self.repo.db.get_version_manifest(h) for h in hashes})
+
+        # 服务器上不存在的基准：客户端改为发送完整清单
+        latest = self.repo.db.get_version_data(self.repo.db.get_latest_version_hash())
+        self.client.upload_versions(self.repo.vault_id, [latest], base=("0" * 64, {}))
+
+    @staticmethod
+    def _recording(request, sent):
+        def wrapper(method, endpoint, **kwargs):
+            sent.append((method, endpoint, kwargs))
+            return request(method, endpoint, **kwargs)
+        return wrapper
+
+
+class BatchingTest(unittest.TestCase):
+    """同步批次同时受字节数和数量限制。"""
+
+    def test_batches_respect_byte_and_count_limits(self):
+        from k_cube.sync import make_batches
+        sizes = {"a": 6, "b": 6, "c": 1, "d": 20, "e": 1, "f": 1}
+        batches = list(make_batches(list("abcdef"), sizes, max_bytes=10, max_count=2))
+        self.assertEqual(batches, [["a"], ["b", "c"], ["d"], ["e", "f"]])
+        self.assertEqual(list(make_batches(list("abc"), {}, 10, 2)), [["a", "b"], ["c"]])
+
+    def test_concurrent_batches_report_on_calling_thread(self):
+        import threading
+        from k_cube.sync import Synchronizer
+        if TEST_DIR.exists():
+            shutil.rmtree(TEST_DIR)
+        repo = Repository.initialize(TEST_DIR)
+        self.addCleanup(shutil.rmtree, TEST_DIR)
+        self.addCleanup(repo.db.close)
+        synchronizer = Synchronizer(repo, api_client=None, concurrency=3)
+
+        done = []
+        synchronizer._run_concurrently(
+            lambda batch: sum(batch), [[i, i] for i in range(10)],
+            lambda batch, value: done.append((threading.current_thread(), value)))
+        self.assertEqual(sorted(v for _, v in done), [2 * i for i in range(10)])
+        self.assertTrue(all(t is threading.current_thread() for t, _ in done))
+
+        def fail_on_five(batch):
+            if batch == [5]:
+                raise RuntimeError("batch failed")
+            return batch
+        with self.assertRaises(RuntimeError):
+            synchronizer._run_concurrently(
+                fail_on_five, [[i] for i in range(10)], lambda *_: None)
+
+
+class ReconcileTest(unittest.TestCase):
+    """区间对账：请求次数与传输量随差异而不是历史长度增长。"""
+
+    def test_finds_symmetric_difference_with_few_rounds(self):
+        from k_cube_protocol.reconcile import answer_ranges, reconcile
+        shared = [hash_blob(str(i).encode()) for i in range(5000)]
+        local_only = [hash_blob(f"local {i}".encode()) for i in range(3)]
+        remote_only = [hash_blob(f"remote {i}".encode()) for i in range(4)]
+        server = sorted(shared + remote_only)
+        transferred = []
+
+        def exchange(ranges):
+            answers = answer_ranges(server, ranges)
+            transferred.extend(h for a in answers for h in a.get("hashes", []))
+            return answers
+
+        only_local, only_remote, rounds = reconcile(shared + local_only, exchange)
+        self.assertEqual(only_local, set(local_only))
+        self.assertEqual(only_remote, set(remote_only))
+        self.assertLessEqual(rounds, 4)
+        self.assertLess(len(transferred), 200)
+
+        _, _, rounds = reconcile(server, exchange)
+        self.assertEqual(rounds, 1)
+
+
+class SyncCursorTest(ServerTestCase):
+    """同步游标：只检查游标之后的新版本。"""
+
+    def test_cursor_limits_check_to_new_versions(self):
+        """测试：保存游标后，检查只发送新版本；游标失效时回退到完整对账。"""
+        from k_cube.sync import Synchronizer
+        sent = []
+        check = self.client.check_sync_state
+        reconcile_round = self.client.reconcile_versions
+
+        def recording_check(vault_id, local_versions, since_seq=None):
+            sent.append(("check", len(local_versions), since_seq))
+            return check(vault_id, local_versions, since_seq=since_seq)
+
+        def recording_reconcile(vault_id, ranges):
+            sent.append(("reconcile", len(ranges), None))
+            return reconcile_round(vault_id, ranges)
+        self.client.check_sync_state = recording_check
+        self.client.reconcile_versions = recording_reconcile
+
+        for i in range(3):
+            (TEST_DIR / "note.md").write_text(f"rev {i}", encoding='utf-8')
+            self._commit(f"rev {i}")
+            time.sleep(1)
+        Synchronizer(self.repo, self.client).sync()
+        self.assertEqual(sent[-1], ("reconcile", 1, None))
+
+        (TEST_DIR / "note.md").write_text("rev 3", encoding='utf-8')
+        self._commit("rev 3")
+        result = Synchronizer(self.repo, self.client).sync()
+        self.assertEqual(sent[-1], ("check", 1, 3))
+        self.assertEqual((result.versions_uploaded, result.versions_downloaded), (1, 0))
+
+        self.repo.config.set("sync_cursor", dict(
+            self.repo.config.get("sync_cursor"), remote_seq=999))
+        result = Synchronizer(self.repo, self.client).sync()
+        self.assertEqual(sent[-1][0], "reconcile")
+        self.assertFalse(result.has_changes)
+        self.assertEqual(self.repo.config.get("sync_cursor")["remote_seq"], 4)
+
+
+class PackFormatTest(unittest.TestCase):
+    """二进制 pack 格式的编码、解码与逐帧校验。"""
+
+    def test_round_trip_and_corruption(self):
+        blobs = [(hash_blob(c), c) for c in (b"one", b"two" * 1000, b"")]
+        data = b"".join(iter_pack(iter(blobs)))
+        self.assertEqual(list(read_pack(io.BytesIO(data))), blobs)
+
+        corrupted = bytearray(data)
+        corrupted[data.index(b"twotwo")] ^= 0xFF
+        with self.assertRaises(PackError):
+            list(read_pack(io.BytesIO(bytes(corrupted))))
+        with self.assertRaises(PackError):
+            list(read_pack(io.BytesIO(data[:-5])))
+
+    def test_meta_frame_precedes_blobs(self):
+        blobs = [(hash_blob(b"one"), b"one")]
+        data = b"".join(iter_pack(iter(blobs), meta=b'{"seq": 1}'))
+        received = []
+        self.assertEqual(list(read_pack(io.BytesIO(data), on_meta=received.append)), blobs)
+        self.assertEqual(received, [b'{"seq": 1}'])
+        # 不接收元数据的读取方 (例如普通的对象下载) 把元数据帧视为格式错误
+        with self.assertRaises(PackError):
+            list(read_pack(io.BytesIO(data)))
+
+
+class PackTransportTest(ServerTestCase):
+    """通过二进制 pack 传输对象。"""
+
+    def test_pack_transport_round_trip(self):
+        """测试：通过二进制 pack 推送后，另一个仓库可以拉取并检出相同内容。"""
+        from k_cube.sync import Synchronizer
+        self.assertTrue(self.client.supports("pack-v1"))
+        (TEST_DIR / "a.md").write_text("alpha", encoding='utf-8')
+        (TEST_DIR / "b.bin").write_bytes(os.urandom(4096))
+        (TEST_DIR / "c.md").write_text("gamma", encoding='utf-8')
+        self._commit("initial")
+        # 每批只放一个 blob，覆盖多批次的上传与下载
+        pusher = Synchronizer(self.repo, self.client)
+        pusher.max_batch_blobs = 1
+        self.assertEqual(pusher.sync().blobs_uploaded, 3)
+
+        clone_dir = TEST_DIR.parent / "temp_test_clone"
+        self.addCleanup(shutil.rmtree, clone_dir, True)
+        clone = Repository.initialize(clone_dir)
+        clone.vault_id = self.repo.vault_id
+        puller = Synchronizer(clone, self.client)
+        puller.max_batch_bytes = 1
+        self.assertEqual(puller.sync().versions_downloaded, 1)
+        clone.restore(clone.db.get_latest_version_hash())
+        clone.db.close()
+        for name in ("a.md", "b.bin", "c.md"):
+            self.assertEqual((clone_dir / name).read_bytes(), (TEST_DIR / name).read_bytes())
+
+
+class ProfilerTest(unittest.TestCase):
+    """Span 树的记录与渲染。"""
+
+    def test_capture_records_nested_spans_and_counters(self):
+        profiler = Profiler()
+        with profiler.capture("sync") as root:
+            for _ in range(2):
+                with profiler.span("http.POST"):
+                    profiler.count("bytes_sent", 10)
+        tree = root.to_dict()
+        self.assertEqual([c["name"] for c in tree["children"]], ["http.POST"] * 2)
+        self.assertIsNone(profiler.current())
+        self.assertIn("http.POST x2", render_span_tree(tree))
+        self.assertIn("bytes_sent=20", render_span_tree(tree))
+
+    def test_span_is_noop_when_disabled(self):
+        profiler = Profiler()
+        with profiler.span("repo.status") as current:
+            profiler.count("files_hashed")
+        self.assertIsNone(current)
+        self.assertIsNone(profiler.summary())
+
+
 if __name__ == '__main__':
     unittest.main()